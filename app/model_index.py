@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import os
+import json
+import logging
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+EXCLUDED_DIR_NAMES = {".git"}
+
+
+class ChangeHandler(FileSystemEventHandler):
+    def __init__(self, wake):
+        self.wake = wake
+
+    def on_any_event(self, event):
+        self.wake.set()
+
+
+class ModelIndex:
+    """
+    Index of the files in the model folders, so listing them or looking one up never walks the directory tree.
+
+    Every directory is indexed with its mtime and entries. A background thread stats the indexed directories every
+    poll_interval seconds and only lists again the ones that changed, right away when watchdog is installed and reports
+    a change. With a path the index is saved there and used as is on the next start while it gets checked.
+    """
+    def __init__(self, path: str | None = None, poll_interval: float = 10.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        # root -> relative directory path ("" for the root) -> [mtime, file names, subdirectory names]
+        self.roots: dict[str, dict[str, list]] = {}
+        self.mutex = threading.Lock()
+        self.version = 0
+        self.file_lists: dict[str, tuple[int, list[str], set[str]]] = {}
+        self.wake = threading.Event()
+        self.observer = None
+        self.watched: set[str] = set()
+        if path is not None:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.roots = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring model index {}: {}".format(self.path, e))
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.mutex:
+            data = json.dumps(self.roots)
+        temp_path = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(temp_path, "w") as f:
+                f.write(data)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logging.warning("Failed to save model index to {}: {}".format(self.path, e))
+
+    def start(self):
+        if Observer is not None:
+            self.observer = Observer()
+            self.observer.start()
+        with self.mutex:
+            roots = list(self.roots)
+        for root in roots:
+            self.watch(root)
+        threading.Thread(target=self.poll_loop, daemon=True, name="model-index").start()
+
+    def watch(self, root: str):
+        if self.observer is None or root in self.watched or not os.path.isdir(root):
+            return
+        try:
+            self.observer.schedule(ChangeHandler(self.wake), root, recursive=True)
+            self.watched.add(root)
+        except OSError as e:
+            logging.debug("Not watching {}, polling it: {}".format(root, e))
+
+    def poll_loop(self):
+        while True:
+            with self.mutex:
+                roots = list(self.roots)
+            if any([self.refresh(root) for root in roots]):
+                self.save()
+            self.wake.wait(timeout=self.poll_interval)
+            self.wake.clear()
+
+    @staticmethod
+    def list_dir(path: str) -> list | None:
+        try:
+            mtime = os.path.getmtime(path)
+            files, subdirs = [], []
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        continue
+                    if not is_dir:
+                        files.append(entry.name)
+                    elif entry.name not in EXCLUDED_DIR_NAMES:
+                        subdirs.append(entry.name)
+        except OSError:
+            return None
+        return [mtime, files, subdirs]
+
+    def scan_tree(self, root: str, reldir: str, entries: dict[str, list]):
+        dirs = [reldir]
+        while len(dirs) > 0:
+            reldir = dirs.pop()
+            entry = self.list_dir(os.path.join(root, reldir))
+            if entry is None:
+                continue
+            entries[reldir] = entry
+            dirs.extend(os.path.join(reldir, d) for d in entry[2])
+
+    @staticmethod
+    def remove_tree(reldir: str, entries: dict[str, list]):
+        prefix = reldir + os.sep
+        for d in [d for d in entries if reldir == "" or d == reldir or d.startswith(prefix)]:
+            del entries[d]
+
+    def refresh(self, root: str) -> bool:
+        """Lists again the directories of root that changed since they were indexed, returns whether any did."""
+        with self.mutex:
+            entries = dict(self.roots.get(root, {}))
+        changed = False
+        if "" not in entries:
+            if os.path.isdir(root):
+                self.scan_tree(root, "", entries)
+                changed = True
+        for reldir in list(entries):
+            if reldir not in entries:
+                continue
+            old = entries[reldir]
+            try:
+                if os.path.getmtime(os.path.join(root, reldir)) == old[0]:
+                    continue
+            except OSError:
+                pass
+            changed = True
+            new = self.list_dir(os.path.join(root, reldir))
+            if new is None:
+                self.remove_tree(reldir, entries)
+                continue
+            entries[reldir] = new
+            for d in set(old[2]).difference(new[2]):
+                self.remove_tree(os.path.join(reldir, d), entries)
+            for d in set(new[2]).difference(old[2]):
+                self.scan_tree(root, os.path.join(reldir, d), entries)
+
+        with self.mutex:
+            # Missing roots are kept too, so they get polled until they show up.
+            if changed or root not in self.roots:
+                self.roots[root] = entries
+            if changed:
+                self.version += 1
+        if changed:
+            self.watch(root)
+        return changed
+
+    def get_files(self, root: str) -> tuple[list[str], set[str]]:
+        """The paths relative to root of all the files under it, as a sorted list and a set."""
+        with self.mutex:
+            indexed = root in self.roots
+            cached = self.file_lists.get(root)
+            if cached is not None and cached[0] == self.version:
+                return cached[1], cached[2]
+        if not indexed:
+            # First time this folder is used, later changes are picked up in the background.
+            if self.refresh(root):
+                self.save()
+        with self.mutex:
+            version = self.version
+            files = []
+            for reldir, entry in self.roots.get(root, {}).items():
+                files.extend(os.path.join(reldir, f) for f in entry[1])
+        files.sort()
+        out = (version, files, set(files))
+        with self.mutex:
+            self.file_lists[root] = out
+        return out[1], out[2]
+
+    def contains(self, root: str, filename: str) -> bool:
+        return filename in self.get_files(root)[1]
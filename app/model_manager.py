@@ -79,6 +79,9 @@ class ModelFileManager:
         output_list: list[dict] = []
 
         for index, folder in enumerate(folders[0]):
+            if folder_paths.model_index is not None:
+                output_list.extend(self.indexed_model_file_list_(folder, index))
+                continue
             if not os.path.isdir(folder):
                 continue
             out = self.cache_model_file_list_(folder)
@@ -89,6 +92,13 @@ class ModelFileManager:
 
         return output_list
 
+    def indexed_model_file_list_(self, folder: str, pathIndex: int) -> list[dict]:
+        files = folder_paths.model_index.get_files(folder)[0]
+        # Same files as recursive_search_models_: no hidden files or directories.
+        files = [f for f in files if not any(x.startswith(".") for x in f.split(os.sep))]
+        files = filter_files_extensions(files, folder_paths.supported_pt_extensions)
+        return [{"name": f, "pathIndex": pathIndex} for f in files]
+
     def cache_model_file_list_(self, folder: str):
         model_file_list_cache = self.get_cache(folder)
 
@@ -0,0 +1,138 @@
+"""
+Images /view derives from output files (previews in another format, single channels), cached on disk so a gallery
+showing the same outputs again doesn't decode and encode them on every request.
+
+Entries are keyed by the file path, its mtime and size and the transform, so a changed file is never served from a
+stale entry. The least recently used entries are removed when the cache grows over its size limit.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from io import BytesIO
+
+from PIL import Image
+
+def get_transform(query):
+    """The transform for the /view query parameters, None to serve the file itself."""
+    channel = query.get('channel', '')
+    if 'preview' in query:
+        preview_info = query['preview'].split(';')
+        image_format = preview_info[0]
+        if image_format not in ['webp', 'jpeg'] or 'a' in channel:
+            image_format = 'webp'
+
+        quality = 90
+        if preview_info[-1].isdigit():
+            quality = int(preview_info[-1])
+        return ("preview", image_format, quality, image_format == 'jpeg' or channel == 'rgb')
+    if channel == 'rgb':
+        return ("rgb",)
+    if channel == 'a':
+        return ("a",)
+    return None
+
+def get_content_type(transform):
+    if transform[0] == "preview":
+        return "image/{}".format(transform[1])
+    return "image/png"
+
+def get_key(file, stat, transform):
+    key = json.dumps([os.path.abspath(file), stat.st_mtime_ns, stat.st_size, transform])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def apply_transform(file, transform):
+    with Image.open(file) as img:
+        buffer = BytesIO()
+        if transform[0] == "preview":
+            _, image_format, quality, rgb = transform
+            if rgb:
+                img = img.convert("RGB")
+            img.save(buffer, format=image_format, quality=quality)
+        elif transform[0] == "rgb":
+            if img.mode == "RGBA":
+                r, g, b, a = img.split()
+                new_img = Image.merge('RGB', (r, g, b))
+            else:
+                new_img = img.convert("RGB")
+            new_img.save(buffer, format='PNG')
+        else:
+            if img.mode == "RGBA":
+                _, _, _, a = img.split()
+            else:
+                a = Image.new('L', img.size, 255)
+
+            # alpha img
+            alpha_img = Image.new('RGBA', img.size)
+            alpha_img.putalpha(a)
+            alpha_img.save(buffer, format='PNG')
+        return buffer.getvalue()
+
+class ViewCache:
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.mutex = threading.Lock()
+        # total size of the entries, counted on the first write
+        self.size = None
+
+    def entries(self):
+        try:
+            with os.scandir(self.directory) as it:
+                return [(e.path, e.stat()) for e in it if e.is_file()]
+        except FileNotFoundError:
+            return []
+
+    def get(self, key):
+        path = os.path.join(self.directory, key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def put(self, key, data):
+        if len(data) > self.max_size:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, key)
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning("Could not write to the view cache: {}".format(e))
+            return
+
+        with self.mutex:
+            if self.size is None:
+                self.size = sum(st.st_size for _, st in self.entries())
+            else:
+                self.size += len(data)
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        entries = sorted(self.entries(), key=lambda e: e[1].st_mtime_ns)
+        self.size = sum(st.st_size for _, st in entries)
+        for path, st in entries:
+            if self.size <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= st.st_size
+
+    def get_image(self, file, key, transform):
+        """The derived image, from the cache or made and added to it."""
+        data = self.get(key)
+        if data is None:
+            data = apply_transform(file, transform)
+            self.put(key, data)
+        return data
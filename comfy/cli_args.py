@@ -42,6 +42,8 @@ parser.add_argument("--tls-keyfile", type=str, help="Path to TLS (SSL) key file.
 parser.add_argument("--tls-certfile", type=str, help="Path to TLS (SSL) certificate file. Enables TLS, makes app accessible at https://... requires --tls-keyfile to function")
 parser.add_argument("--enable-cors-header", type=str, default=None, metavar="ORIGIN", nargs="?", const="*", help="Enable CORS (Cross-Origin Resource Sharing) with optional origin or allow all with default '*'.")
 parser.add_argument("--max-upload-size", type=float, default=100, help="Set the maximum upload size in MB.")
+parser.add_argument("--websocket-compress", action="store_true", help="Negotiate permessage-deflate with websocket clients. It makes the JSON messages smaller, but every message is compressed separately for every client, previews included.")
+parser.add_argument("--view-cache-size", type=float, default=512, metavar="MB", help="Size of the disk cache (in the temp directory) of the previews and channels /view makes from output images. 0 disables it.")
 
 parser.add_argument("--extra-model-paths-config", type=str, default=None, metavar="PATH", nargs='+', action='append', help="Load one or more extra_model_paths.yaml files.")
 parser.add_argument("--output-directory", type=str, default=None, help="Set the ComfyUI output directory.")
@@ -95,10 +97,17 @@ class LatentPreviewMethod(enum.Enum):
 parser.add_argument("--preview-method", type=LatentPreviewMethod, default=LatentPreviewMethod.NoPreviews, help="Default preview method for sampler nodes.", action=EnumAction)
 
 parser.add_argument("--preview-size", type=int, default=512, help="Sets the maximum preview size for sampler nodes.")
+parser.add_argument("--preview-rate", type=float, default=0.0, metavar="FPS", help="Decode at most this many previews per second for sampler nodes, the steps in between get no preview. 0 previews every step.")
 
 cache_group = parser.add_mutually_exclusive_group()
 cache_group.add_argument("--cache-classic", action="store_true", help="Use the old style (aggressive) caching.")
 cache_group.add_argument("--cache-lru", type=int, default=0, help="Use LRU caching with a maximum of N node results cached. May use more RAM/VRAM.")
+cache_group.add_argument("--cache-ram", type=float, default=None, metavar="GB", help="Cache node results until they hold GB of RAM, evicting the results that are cheapest to recompute per byte first.")
+
+parser.add_argument("--cache-vram", type=float, default=None, metavar="GB", help="With --cache-ram, also limit the VRAM held by cached node results to GB.")
+
+parser.add_argument("--cache-disk", type=str, default=None, metavar="PATH", help="Also store node outputs made of tensors (conditioning, latents, images...) in this directory so they are reused across restarts. Entries are keyed on the node inputs, clear the directory if you replace model files in place.")
+parser.add_argument("--cache-disk-size", type=float, default=10.0, metavar="GB", help="Maximum size in GB of the --cache-disk directory. Least recently used entries are evicted first.")
 
 attn_group = parser.add_mutually_exclusive_group()
 attn_group.add_argument("--use-split-cross-attention", action="store_true", help="Use the split cross attention optimization. Ignored when xformers is used.")
@@ -120,15 +129,40 @@ vram_group.add_argument("--lowvram", action="store_true", help="Split the unet i
 vram_group.add_argument("--novram", action="store_true", help="When lowvram isn't enough.")
 vram_group.add_argument("--cpu", action="store_true", help="To use the CPU for everything (slow).")
 
+parser.add_argument("--worker-devices", type=str, default=None, metavar="DEVICE", nargs="+", help="Run one prompt worker per listed device (for example: cuda:0 cuda:1), each with its own cache and loaded models. Prompts are preferably given to the worker that last used the same model files.")
+
+parser.add_argument("--schedule-window", type=int, default=0, metavar="N", help="Let the queue reorder the next N prompts so prompts using the same models run back to back. A prompt is never passed over more than N times.")
+
+parser.add_argument("--batch-prompts", type=int, default=0, metavar="N", help="Sample up to N queued prompts that only differ in their seed or prompt text in a single batch. Only done for the KSampler node with samplers that don't add noise during sampling, so the results are the same as sampling each prompt on its own.")
+
+parser.add_argument("--parallel-nodes", type=int, default=0, metavar="N", help="Run up to N ready nodes that declare themselves thread safe (image loading and other CPU side work) on a thread pool while other branches of the workflow execute.")
+
+parser.add_argument("--history-db", type=str, default=None, metavar="PATH", help="Keep the prompt history in this SQLite database so it survives restarts. Only the most recent prompts are also kept in memory.")
+
+parser.add_argument("--disable-mmap", action="store_true", help="Load safetensors files with the safetensors library instead of memory mapping them as views that are only read when used. Memory mapped files stay open while their model is loaded, on Windows that means they can't be deleted or overwritten.")
+
+parser.add_argument("--output-writers", type=int, default=0, metavar="N", help="Convert, encode and write the files of the save and preview nodes on N background threads so the next prompt can start while they are written. The files are complete when /view serves them or when they appear under their final name.")
+
+parser.add_argument("--file-digest-cache", type=str, default=None, metavar="PATH", help="Save the hashes of input files used to detect changes (image, mask, latent and audio loaders, upload deduplication) to this JSON file so unchanged files aren't hashed again after a restart.")
+
+parser.add_argument("--model-index", type=str, default=None, metavar="PATH", help="Keep an index of the files in the model folders, saved to this JSON file, instead of walking the folders when listing or looking up models. It is updated in the background when directories change.")
+parser.add_argument("--model-index-poll", type=float, default=10.0, metavar="SECONDS", help="How often the model index checks the model folders for changes. Changes are picked up right away when the watchdog package is installed and the filesystem supports it.")
+
+parser.add_argument("--memory-estimates", type=str, default=None, metavar="PATH", help="Measure the peak VRAM used by VAE encoding/decoding and sampling and use it instead of the built in estimates to pick batch sizes and how much memory to free. The measurements are saved to this JSON file.")
+
 parser.add_argument("--reserve-vram", type=float, default=None, help="Set the amount of vram in GB you want to reserve for use by your OS/other software. By default some amount is reverved depending on your OS.")
 
 
 parser.add_argument("--default-hashing-function", type=str, choices=['md5', 'sha1', 'sha256', 'sha512'], default='sha256', help="Allows you to choose the hash function to use for duplicate filename / contents comparison. Default is sha256.")
 
 parser.add_argument("--disable-smart-memory", action="store_true", help="Force ComfyUI to agressively offload to regular ram instead of keeping models in vram when it can.")
+parser.add_argument("--pinned-model-pool", type=float, default=None, metavar="GB", help="Offload model weights from the GPU into up to GB of pinned RAM that is kept and reused, so switching back and forth between models is limited by the bus speed. Nvidia GPUs only.")
 parser.add_argument("--deterministic", action="store_true", help="Make pytorch use slower deterministic algorithms when it can. Note that this might not make images deterministic in all cases.")
 parser.add_argument("--fast", action="store_true", help="Enable some untested and potentially quality deteriorating optimizations.")
 
+parser.add_argument("--profile-nodes", action="store_true", help="Record time, memory use and cache hits of every node, stored in the prompt history and sent to the client as an execution_profile event.")
+parser.add_argument("--profile-trace-dir", type=str, default=None, metavar="PATH", help="Like --profile-nodes and also write a Chrome trace (chrome://tracing, Perfetto) of every prompt to this directory.")
+
 parser.add_argument("--dont-print-server", action="store_true", help="Don't print server output.")
 parser.add_argument("--quick-test-for-ci", action="store_true", help="Quick test for CI.")
 parser.add_argument("--windows-standalone-build", action="store_true", help="Windows standalone build: Enable convenient things that most people using the standalone windows build will probably enjoy (like auto opening the page on startup).")
@@ -0,0 +1,96 @@
+"""
+Process wide cache of file content hashes, so IS_CHANGED of loader nodes and upload deduplication only hash a file
+again when its size, modification time or inode changed. Otherwise checking a file costs one stat call.
+
+With --file-digest-cache the digests are also saved to a JSON file and survive restarts.
+"""
+
+import os
+import json
+import time
+import atexit
+import hashlib
+import logging
+import threading
+
+from comfy.cli_args import args
+
+MAX_ENTRIES = 100000
+SAVE_INTERVAL = 30.0
+READ_SIZE = 1024 * 1024
+
+class FileDigestCache:
+    def __init__(self, path=None):
+        self.path = path
+        # "hash_name:absolute path" -> [size, mtime_ns, inode, hex digest], oldest first
+        self.digests = {}
+        self.mutex = threading.Lock()
+        self.dirty = False
+        self.last_save = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            self.load()
+            atexit.register(self.save)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.digests = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring file digest cache {}: {}".format(self.path, e))
+
+    def save(self):
+        with self.mutex:
+            if not self.dirty:
+                return
+            data = json.dumps(self.digests)
+            self.dirty = False
+            self.last_save = time.monotonic()
+        temp_path = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(temp_path, "w") as f:
+                f.write(data)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logging.warning("Failed to save file digest cache to {}: {}".format(self.path, e))
+
+    def digest(self, file_path, hash_name="sha256"):
+        """Hex digest of the file's content with the hashlib algorithm hash_name."""
+        st = os.stat(file_path)
+        stamp = [st.st_size, st.st_mtime_ns, st.st_ino]
+        key = "{}:{}".format(hash_name, os.path.abspath(file_path))
+        with self.mutex:
+            entry = self.digests.get(key, None)
+            if entry is not None and entry[:3] == stamp:
+                self.hits += 1
+                return entry[3]
+            self.misses += 1
+
+        m = hashlib.new(hash_name)
+        with open(file_path, "rb") as f:
+            while True:
+                data = f.read(READ_SIZE)
+                if len(data) == 0:
+                    break
+                m.update(data)
+        digest = m.hexdigest()
+
+        with self.mutex:
+            self.digests.pop(key, None)
+            self.digests[key] = stamp + [digest]
+            while len(self.digests) > MAX_ENTRIES:
+                self.digests.pop(next(iter(self.digests)))
+            self.dirty = True
+            save = self.path is not None and time.monotonic() - self.last_save > SAVE_INTERVAL
+        if save:
+            self.save()
+        return digest
+
+file_digest_cache = FileDigestCache(args.file_digest_cache)
+
+def file_digest(file_path, hash_name="sha256"):
+    return file_digest_cache.digest(file_path, hash_name)
@@ -0,0 +1,164 @@
+"""
+Memory use of models learned from the peak memory actually allocated while running them.
+
+Estimates are kept per model, input shape (without the batch size) and dtype as the peak memory per batch item, so
+VAE decoding and sampling can batch as much as really fits instead of relying on the hard coded formulas. Shapes that
+were never measured get the most bytes per input element seen for the model. Enabled with --memory-estimates, which is
+also where they are saved between runs.
+"""
+
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+import contextlib
+
+import torch
+from comfy.cli_args import args
+
+# Headroom on top of the largest peak seen, for allocator fragmentation and inputs we haven't seen yet.
+SAFETY_MARGIN = 1.2
+SAVE_INTERVAL = 30.0
+
+peak_memory_lock = threading.Lock()
+open_peak_memory_scopes = []
+
+class PeakMemoryScope:
+    """
+    Peak memory allocated on a CUDA device between start() and stop(), above what was allocated at start().
+
+    The allocator's peak stats are process wide, so they are reset when a scope starts, after folding the peak so far
+    into the scopes already open (nested ones, or ones in other prompt workers). Each scope sees the peak of its own
+    lifetime, which includes whatever else ran on the device at the same time.
+    """
+    def __init__(self, device):
+        self.device = device
+        self.allocated_start = 0
+        self.peak = 0
+
+    @staticmethod
+    def fold_peak(device):
+        peak = torch.cuda.max_memory_allocated(device)
+        for scope in open_peak_memory_scopes:
+            if scope.device == device:
+                scope.peak = max(scope.peak, peak)
+
+    def start(self):
+        with peak_memory_lock:
+            self.fold_peak(self.device)
+            torch.cuda.reset_peak_memory_stats(self.device)
+            self.allocated_start = torch.cuda.memory_allocated(self.device)
+            self.peak = self.allocated_start
+            open_peak_memory_scopes.append(self)
+
+    def stop(self):
+        with peak_memory_lock:
+            self.fold_peak(self.device)
+            open_peak_memory_scopes.remove(self)
+        return self.peak - self.allocated_start
+
+def shape_elements(shape):
+    elements = 1
+    for x in shape[1:]:
+        elements *= x
+    return max(elements, 1)
+
+class MemoryEstimates:
+    def __init__(self, path=None):
+        self.path = path
+        self.estimates = {}
+        # model key: most bytes per input element measured, for the shapes that weren't
+        self.per_element = {}
+        self.mutex = threading.Lock()
+        self.dirty = False
+        self.last_save = time.monotonic()
+        if path is not None:
+            self.load()
+            atexit.register(self.save)
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    @staticmethod
+    def make_key(model_key, shape):
+        return "{}|{}".format(model_key, "x".join(str(x) for x in shape[1:]))
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                estimates = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring memory estimates file {}: {}".format(self.path, e))
+            return
+        for key, per_item in estimates.items():
+            model_key, _, shape = key.rpartition("|")
+            shape = [1] + [int(x) for x in shape.split("x") if x != ""]
+            self.estimates[key] = per_item
+            self.fit(model_key, shape, per_item)
+
+    def fit(self, model_key, shape, per_item):
+        per_element = per_item / shape_elements(shape)
+        if per_element > self.per_element.get(model_key, 0):
+            self.per_element[model_key] = per_element
+
+    def save(self):
+        with self.mutex:
+            if not self.dirty:
+                return
+            data = json.dumps(self.estimates, indent=1, sort_keys=True)
+            self.dirty = False
+            self.last_save = time.monotonic()
+        temp_path = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(temp_path, "w") as f:
+                f.write(data)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logging.warning("Failed to save memory estimates to {}: {}".format(self.path, e))
+
+    def estimate(self, model_key, shape):
+        """Returns the memory in bytes needed to run the model on an input of this shape, None if it was never measured."""
+        if not self.enabled:
+            return None
+        per_item = self.estimates.get(self.make_key(model_key, shape), None)
+        if per_item is None:
+            per_element = self.per_element.get(model_key, None)
+            if per_element is None:
+                return None
+            per_item = per_element * shape_elements(shape)
+        return per_item * shape[0] * SAFETY_MARGIN
+
+    def record(self, model_key, shape, peak_memory):
+        key = self.make_key(model_key, shape)
+        per_item = peak_memory / max(shape[0], 1)
+        with self.mutex:
+            if per_item <= self.estimates.get(key, 0):
+                return
+            self.estimates[key] = per_item
+            self.fit(model_key, shape, per_item)
+            self.dirty = True
+            save = time.monotonic() - self.last_save > SAVE_INTERVAL
+        if save:
+            self.save()
+
+    @contextlib.contextmanager
+    def measure(self, model_key, shape, device):
+        # Peak memory stats are only available from the CUDA allocator.
+        if not self.enabled or device.type != "cuda":
+            yield
+            return
+        scope = PeakMemoryScope(device)
+        scope.start()
+        try:
+            yield
+        finally:
+            peak = scope.stop()
+        self.record(model_key, shape, peak)
+
+memory_estimates = MemoryEstimates(args.memory_estimates)
@@ -0,0 +1,129 @@
+"""
+Minimal process-wide metrics in the Prometheus text exposition format, served by the /metrics endpoint.
+Updating a metric is a dict update under a lock so they are cheap enough to leave on.
+"""
+
+import bisect
+import math
+import threading
+
+registry = []
+
+def _format_labels(labels):
+    if len(labels) == 0:
+        return ""
+    escaped = []
+    for k, v in labels:
+        v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append('{}="{}"'.format(k, v))
+    return "{" + ",".join(escaped) + "}"
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name, documentation, registry=registry):
+        """Adds the metric to registry, the list of metrics served by /metrics unless another one is passed."""
+        self.name = name
+        self.documentation = documentation
+        self.mutex = threading.Lock()
+        registry.append(self)
+
+    def samples(self):
+        raise NotImplementedError()
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} {}".format(self.name, self.metric_type)]
+        for name, labels, value in self.samples():
+            lines.append("{}{} {}".format(name, _format_labels(labels), _format_value(value)))
+        return "\n".join(lines)
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def __init__(self, name, documentation, registry=registry):
+        super().__init__(name, documentation, registry)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.mutex:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.mutex:
+            return [(self.name, labels, value) for labels, value in self.values.items()]
+
+class Gauge(Metric):
+    """A gauge whose value is read from a callback when the metrics are rendered."""
+    metric_type = "gauge"
+
+    def __init__(self, name, documentation, function=None, registry=registry):
+        super().__init__(name, documentation, registry)
+        self.function = function
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self):
+        value = self.value
+        if self.function is not None:
+            value = self.function()
+        return [(self.name, (), value)]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, math.inf)
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS, registry=registry):
+        super().__init__(name, documentation, registry)
+        self.buckets = tuple(buckets)
+        if self.buckets[-1] != math.inf:
+            self.buckets = self.buckets + (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.mutex:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self):
+        with self.mutex:
+            counts = list(self.counts)
+            total = self.sum
+        out = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            out.append((self.name + "_bucket", (("le", _format_value(bound)),), cumulative))
+        out.append((self.name + "_sum", (), total))
+        out.append((self.name + "_count", (), cumulative))
+        return out
+
+def render(registry=registry):
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+queue_pending = Gauge("comfyui_queue_pending", "Number of prompts waiting in the queue.")
+queue_running = Gauge("comfyui_queue_running", "Number of prompts currently executing.")
+prompts_total = Counter("comfyui_prompts_total", "Prompts finished, by status.")
+prompt_queue_seconds = Histogram("comfyui_prompt_queue_seconds", "Time prompts spent waiting in the queue.")
+prompt_execution_seconds = Histogram("comfyui_prompt_execution_seconds", "Time spent executing prompts.")
+node_executions_total = Counter("comfyui_node_executions_total", "Node executions, by whether the output cache was hit.")
+model_loads_total = Counter("comfyui_model_loads_total", "Models loaded onto a device by load_models_gpu.")
+model_load_seconds = Histogram("comfyui_model_load_seconds", "Time load_models_gpu spent loading models.")
+model_unloads_total = Counter("comfyui_model_unloads_total", "Models unloaded by free_memory.")
+websocket_send_seconds = Histogram("comfyui_websocket_send_seconds", "Time taken to encode one message and queue it for all its websocket recipients.", buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+previews_dropped_total = Counter("comfyui_previews_dropped_total", "Sampler previews dropped because the previous one wasn't encoded or sent yet.")
+websocket_messages_dropped_total = Counter("comfyui_websocket_messages_dropped_total", "Progress and preview messages replaced by a newer one before they were sent to a slow client, by kind.")
+websocket_clients = Gauge("comfyui_websocket_clients", "Connected websocket clients.")
@@ -33,6 +33,7 @@ import comfy.ldm.flux.model
 import comfy.ldm.lightricks.model
 
 import comfy.model_management
+from comfy.memory_estimates import memory_estimates
 import comfy.patcher_extension
 import comfy.conds
 import comfy.ops
@@ -291,7 +292,17 @@ class BaseModel(torch.nn.Module):
             return blank_image
         self.blank_inpaint_image_like = blank_inpaint_image_like
 
-    def memory_required(self, input_shape):
+    def memory_estimate_key(self, control=False):
+        dtype = self.get_dtype()
+        if self.manual_cast_dtype is not None:
+            dtype = self.manual_cast_dtype
+        # A controlnet runs within the measured sampling step, its memory is part of the peak.
+        return "{}/{}{}".format(type(self.model_config).__name__, dtype, "/control" if control else "")
+
+    def memory_required(self, input_shape, control=False):
+        learned = memory_estimates.estimate(self.memory_estimate_key(control), input_shape)
+        if learned is not None:
+            return learned
         if comfy.model_management.xformers_enabled() or comfy.model_management.pytorch_attention_flash_attention():
             dtype = self.get_dtype()
             if self.manual_cast_dtype is not None:
@@ -25,6 +25,12 @@ import sys
 import platform
 import weakref
 import gc
+import threading
+import time
+import collections
+import contextvars
+import contextlib
+import comfy.metrics
 
 class VRAMState(Enum):
     DISABLED = 0    #No vram present: no need to move models to vram
@@ -97,9 +103,24 @@ def is_intel_xpu():
             return True
     return False
 
+# Worker threads (see --worker-devices) each get pinned to their own device.
+thread_device = threading.local()
+
+def set_thread_torch_device(device):
+    if device is not None:
+        device = torch.device(device)
+        if device.type == "cuda" and device.index is not None:
+            torch.cuda.set_device(device)
+        elif device.type == "xpu" and device.index is not None:
+            torch.xpu.set_device(device)
+    thread_device.device = device
+
 def get_torch_device():
     global directml_enabled
     global cpu_state
+    device = getattr(thread_device, "device", None)
+    if device is not None:
+        return device
     if directml_enabled:
         global directml_device
         return directml_device
@@ -278,6 +299,10 @@ except:
 
 
 current_loaded_models = []
+# Guards current_loaded_models when several worker threads load and unload models.
+models_mutex = threading.RLock()
+# str(device) -> lock held while loading or unloading models on that device, see device_lock.
+device_locks = {}
 
 def module_size(module):
     module_mem = 0
@@ -287,6 +312,100 @@ def module_size(module):
         module_mem += t.nelement() * t.element_size()
     return module_mem
 
+class PinnedModelPool:
+    """
+    Pinned host memory that the weights of models offloaded from the GPU are copied into (--pinned-model-pool). Each
+    weight keeps its buffer when loaded back, so offloading the same model again allocates nothing, and copies between
+    pinned memory and the GPU run asynchronously at full bus speed. Models rotated in and out of VRAM cost a transfer
+    instead of pageable copies. Buffers that don't hold an offloaded weight are released least recently used first to
+    stay within the budget; weights that don't fit are offloaded to regular memory.
+    """
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        # (id(module), name) -> (weakref to module, buffer), least recently used first
+        self.buffers = collections.OrderedDict()
+        self.mutex = threading.Lock()
+
+    @staticmethod
+    def allocate(shape, dtype):
+        return torch.empty(shape, dtype=dtype, pin_memory=True)
+
+    @staticmethod
+    def in_use(module_ref, name, buffer):
+        module = module_ref()
+        if module is None:
+            return False
+        t = module._parameters.get(name, None)
+        if t is None:
+            t = module._buffers.get(name, None)
+        return t is not None and t.device.type == "cpu" and t.data_ptr() == buffer.data_ptr()
+
+    def make_room(self, size):
+        if size > self.budget:
+            return False
+        for key in list(self.buffers):
+            if self.size + size <= self.budget:
+                break
+            module_ref, buffer = self.buffers[key]
+            if not self.in_use(module_ref, key[1], buffer):
+                del self.buffers[key]
+                self.size -= buffer.nelement() * buffer.element_size()
+        return self.size + size <= self.budget
+
+    def get_buffer(self, module, name, t):
+        key = (id(module), name)
+        with self.mutex:
+            entry = self.buffers.pop(key, None)
+            if entry is not None:
+                module_ref, buffer = entry
+                if module_ref() is not module or buffer.shape != t.shape or buffer.dtype != t.dtype:
+                    self.size -= buffer.nelement() * buffer.element_size()
+                    entry = None
+            if entry is None:
+                size = t.nelement() * t.element_size()
+                if not self.make_room(size):
+                    return None
+                buffer = self.allocate(t.shape, t.dtype)
+                self.size += size
+            self.buffers[key] = (weakref.ref(module), buffer)
+            return buffer
+
+    def offload(self, module, device):
+        streams = set()
+        for m in module.modules():
+            for tensors in (m._parameters, m._buffers):
+                for name, t in tensors.items():
+                    if t is None or t.device.type == "cpu":
+                        continue
+                    buffer = self.get_buffer(m, name, t)
+                    if buffer is None:
+                        continue
+                    buffer.copy_(t, non_blocking=True)
+                    streams.add(torch.cuda.current_stream(t.device))
+                    if isinstance(t, torch.nn.Parameter):
+                        t.data = buffer
+                    else:
+                        tensors[name] = buffer
+        # Everything else (weights that didn't fit) the regular way, then wait for the copies once.
+        module.to(device)
+        for stream in streams:
+            stream.synchronize()
+
+pinned_model_pool = None
+if args.pinned_model_pool is not None and is_nvidia():
+    pinned_model_pool = PinnedModelPool(round(args.pinned_model_pool * 1024 * 1024 * 1024))
+
+def offload_module(module, device):
+    """Moves the weights of module to its offload device, through the pinned model pool when enabled."""
+    if pinned_model_pool is not None and torch.device(device).type == "cpu":
+        pinned_model_pool.offload(module, device)
+    else:
+        module.to(device)
+
+def load_module(module, device):
+    module.to(device, non_blocking=pinned_model_pool is not None)
+
 class LoadedModel:
     def __init__(self, model):
         self._set_model(model)
@@ -403,45 +522,59 @@ def extra_reserved_memory():
 def minimum_inference_memory():
     return (1024 * 1024 * 1024) * 0.8 + extra_reserved_memory()
 
-def free_memory(memory_required, device, keep_loaded=[]):
-    cleanup_models_gc()
-    unloaded_model = []
-    can_unload = []
-    unloaded_models = []
-
-    for i in range(len(current_loaded_models) -1, -1, -1):
-        shift_model = current_loaded_models[i]
-        if shift_model.device == device:
-            if shift_model not in keep_loaded and not shift_model.is_dead():
-                can_unload.append((-shift_model.model_offloaded_memory(), sys.getrefcount(shift_model.model), shift_model.model_memory(), i))
-                shift_model.currently_used = False
-
-    for x in sorted(can_unload):
-        i = x[-1]
-        memory_to_free = None
-        if not DISABLE_SMART_MEMORY:
-            free_mem = get_free_memory(device)
-            if free_mem > memory_required:
-                break
-            memory_to_free = memory_required - free_mem
-        logging.debug(f"Unloading {current_loaded_models[i].model.model.__class__.__name__}")
-        if current_loaded_models[i].model_unload(memory_to_free):
-            unloaded_model.append(i)
-
-    for i in sorted(unloaded_model, reverse=True):
-        unloaded_models.append(current_loaded_models.pop(i))
+def device_lock(device):
+    """The lock serializing loading and unloading models on device, so workers on other devices aren't held up."""
+    with models_mutex:
+        key = str(device)
+        if key not in device_locks:
+            device_locks[key] = threading.RLock()
+        return device_locks[key]
 
-    if len(unloaded_model) > 0:
-        soft_empty_cache()
-    else:
-        if vram_state != VRAMState.HIGH_VRAM:
-            mem_free_total, mem_free_torch = get_free_memory(device, torch_free_too=True)
-            if mem_free_torch > mem_free_total * 0.25:
-                soft_empty_cache()
-    return unloaded_models
+def free_memory(memory_required, device, keep_loaded=[]):
+    with device_lock(device):
+        with models_mutex:
+            cleanup_models_gc()
+            can_unload = []
+            for i in range(len(current_loaded_models) -1, -1, -1):
+                shift_model = current_loaded_models[i]
+                if shift_model.device == device:
+                    if shift_model not in keep_loaded and not shift_model.is_dead():
+                        can_unload.append((-shift_model.model_offloaded_memory(), sys.getrefcount(shift_model.model), shift_model.model_memory(), i, shift_model))
+                        shift_model.currently_used = False
+
+        # Unloading moves weights around, only hold models_mutex to update current_loaded_models.
+        unloaded_models = []
+        for x in sorted(can_unload, key=lambda x: x[:-1]):
+            shift_model = x[-1]
+            memory_to_free = None
+            if not DISABLE_SMART_MEMORY:
+                free_mem = get_free_memory(device)
+                if free_mem > memory_required:
+                    break
+                memory_to_free = memory_required - free_mem
+            logging.debug(f"Unloading {shift_model.model.model.__class__.__name__}")
+            if shift_model.model_unload(memory_to_free):
+                unloaded_models.append(shift_model)
+
+        with models_mutex:
+            for shift_model in unloaded_models:
+                for i in range(len(current_loaded_models)):
+                    if current_loaded_models[i] is shift_model:
+                        current_loaded_models.pop(i)
+                        break
+        comfy.metrics.model_unloads_total.inc(len(unloaded_models))
+
+        if len(unloaded_models) > 0:
+            soft_empty_cache()
+        else:
+            if vram_state != VRAMState.HIGH_VRAM:
+                mem_free_total, mem_free_torch = get_free_memory(device, torch_free_too=True)
+                if mem_free_torch > mem_free_total * 0.25:
+                    soft_empty_cache()
+        return unloaded_models
 
 def load_models_gpu(models, memory_required=0, force_patch_weights=False, minimum_memory_required=None, force_full_load=False):
-    cleanup_models_gc()
+    load_start = time.perf_counter()
     global vram_state
 
     inference_memory = minimum_inference_memory()
@@ -453,67 +586,80 @@ def load_models_gpu(models, memory_required=0, force_patch_weights=False, minimu
 
     models = set(models)
 
-    models_to_load = []
-
-    for x in models:
-        loaded_model = LoadedModel(x)
-        try:
-            loaded_model_index = current_loaded_models.index(loaded_model)
-        except:
-            loaded_model_index = None
-
-        if loaded_model_index is not None:
-            loaded = current_loaded_models[loaded_model_index]
-            loaded.currently_used = True
-            models_to_load.append(loaded)
-        else:
-            if hasattr(x, "model"):
-                logging.info(f"Requested to load {x.model.__class__.__name__}")
-            models_to_load.append(loaded_model)
-
-    for loaded_model in models_to_load:
-        to_unload = []
-        for i in range(len(current_loaded_models)):
-            if loaded_model.model.is_clone(current_loaded_models[i].model):
-                to_unload = [i] + to_unload
-        for i in to_unload:
-            current_loaded_models.pop(i).model.detach(unpatch_all=False)
-
-    total_memory_required = {}
-    for loaded_model in models_to_load:
-        total_memory_required[loaded_model.device] = total_memory_required.get(loaded_model.device, 0) + loaded_model.model_memory_required(loaded_model.device)
-
-    for device in total_memory_required:
-        if device != torch.device("cpu"):
-            free_memory(total_memory_required[device] * 1.1 + extra_mem, device)
-
-    for device in total_memory_required:
-        if device != torch.device("cpu"):
-            free_mem = get_free_memory(device)
-            if free_mem < minimum_memory_required:
-                models_l = free_memory(minimum_memory_required, device)
-                logging.info("{} models unloaded.".format(len(models_l)))
-
-    for loaded_model in models_to_load:
-        model = loaded_model.model
-        torch_dev = model.load_device
-        if is_device_cpu(torch_dev):
-            vram_set_state = VRAMState.DISABLED
-        else:
-            vram_set_state = vram_state
-        lowvram_model_memory = 0
-        if lowvram_available and (vram_set_state == VRAMState.LOW_VRAM or vram_set_state == VRAMState.NORMAL_VRAM) and not force_full_load:
-            model_size = loaded_model.model_memory_required(torch_dev)
-            current_free_mem = get_free_memory(torch_dev)
-            lowvram_model_memory = max(64 * (1024 * 1024), (current_free_mem - minimum_memory_required), min(current_free_mem * 0.4, current_free_mem - minimum_inference_memory()))
-            if model_size <= lowvram_model_memory: #only switch to lowvram if really necessary
-                lowvram_model_memory = 0
-
-        if vram_set_state == VRAMState.NO_VRAM:
-            lowvram_model_memory = 64 * 1024 * 1024
-
-        loaded_model.model_load(lowvram_model_memory, force_patch_weights=force_patch_weights)
-        current_loaded_models.insert(0, loaded_model)
+    # Only the devices the models load to are locked (in a fixed order), so workers on different devices
+    # (--worker-devices) load their models at the same time.
+    with contextlib.ExitStack() as stack:
+        for device in sorted(set(str(x.load_device) for x in models)):
+            stack.enter_context(device_lock(device))
+
+        with models_mutex:
+            cleanup_models_gc()
+            models_to_load = []
+
+            for x in models:
+                loaded_model = LoadedModel(x)
+                try:
+                    loaded_model_index = current_loaded_models.index(loaded_model)
+                except:
+                    loaded_model_index = None
+
+                if loaded_model_index is not None:
+                    loaded = current_loaded_models[loaded_model_index]
+                    loaded.currently_used = True
+                    models_to_load.append(loaded)
+                else:
+                    if hasattr(x, "model"):
+                        logging.info(f"Requested to load {x.model.__class__.__name__}")
+                        comfy.metrics.model_loads_total.inc(model=x.model.__class__.__name__)
+                    else:
+                        comfy.metrics.model_loads_total.inc(model=x.__class__.__name__)
+                    models_to_load.append(loaded_model)
+
+            for loaded_model in models_to_load:
+                to_unload = []
+                for i in range(len(current_loaded_models)):
+                    if loaded_model.model.is_clone(current_loaded_models[i].model):
+                        to_unload = [i] + to_unload
+                for i in to_unload:
+                    current_loaded_models.pop(i).model.detach(unpatch_all=False)
+
+        total_memory_required = {}
+        for loaded_model in models_to_load:
+            total_memory_required[loaded_model.device] = total_memory_required.get(loaded_model.device, 0) + loaded_model.model_memory_required(loaded_model.device)
+
+        for device in total_memory_required:
+            if device != torch.device("cpu"):
+                free_memory(total_memory_required[device] * 1.1 + extra_mem, device)
+
+        for device in total_memory_required:
+            if device != torch.device("cpu"):
+                free_mem = get_free_memory(device)
+                if free_mem < minimum_memory_required:
+                    models_l = free_memory(minimum_memory_required, device)
+                    logging.info("{} models unloaded.".format(len(models_l)))
+
+        for loaded_model in models_to_load:
+            model = loaded_model.model
+            torch_dev = model.load_device
+            if is_device_cpu(torch_dev):
+                vram_set_state = VRAMState.DISABLED
+            else:
+                vram_set_state = vram_state
+            lowvram_model_memory = 0
+            if lowvram_available and (vram_set_state == VRAMState.LOW_VRAM or vram_set_state == VRAMState.NORMAL_VRAM) and not force_full_load:
+                model_size = loaded_model.model_memory_required(torch_dev)
+                current_free_mem = get_free_memory(torch_dev)
+                lowvram_model_memory = max(64 * (1024 * 1024), (current_free_mem - minimum_memory_required), min(current_free_mem * 0.4, current_free_mem - minimum_inference_memory()))
+                if model_size <= lowvram_model_memory: #only switch to lowvram if really necessary
+                    lowvram_model_memory = 0
+
+            if vram_set_state == VRAMState.NO_VRAM:
+                lowvram_model_memory = 64 * 1024 * 1024
+
+            loaded_model.model_load(lowvram_model_memory, force_patch_weights=force_patch_weights)
+            with models_mutex:
+                current_loaded_models.insert(0, loaded_model)
+    comfy.metrics.model_load_seconds.observe(time.perf_counter() - load_start)
     return
 
 def load_model_gpu(model):
@@ -551,14 +697,15 @@ def cleanup_models_gc():
 
 
 def cleanup_models():
-    to_delete = []
-    for i in range(len(current_loaded_models)):
-        if current_loaded_models[i].real_model() is None:
-            to_delete = [i] + to_delete
+    with models_mutex:
+        to_delete = []
+        for i in range(len(current_loaded_models)):
+            if current_loaded_models[i].real_model() is None:
+                to_delete = [i] + to_delete
 
-    for i in to_delete:
-        x = current_loaded_models.pop(i)
-        del x
+        for i in to_delete:
+            x = current_loaded_models.pop(i)
+            del x
 
 def dtype_size(dtype):
     dtype_size = 4
@@ -1089,17 +1236,30 @@ class InterruptProcessingException(Exception):
 interrupt_processing_mutex = threading.RLock()
 
 interrupt_processing = False
-def interrupt_current_processing(value=True):
+# Prompts interrupted on their own, so interrupting one prompt worker (--worker-devices) doesn't stop the others.
+interrupted_prompts = set()
+# The prompt being executed in the current context, set by the PromptExecutor.
+current_prompt = contextvars.ContextVar("current_prompt", default=None)
+
+def set_current_prompt(prompt_id):
+    current_prompt.set(prompt_id)
+
+def interrupt_current_processing(value=True, prompt_id=None):
     global interrupt_processing
     global interrupt_processing_mutex
     with interrupt_processing_mutex:
-        interrupt_processing = value
+        if prompt_id is None:
+            interrupt_processing = value
+        elif value:
+            interrupted_prompts.add(prompt_id)
+        else:
+            interrupted_prompts.discard(prompt_id)
 
 def processing_interrupted():
     global interrupt_processing
     global interrupt_processing_mutex
     with interrupt_processing_mutex:
-        return interrupt_processing
+        return interrupt_processing or current_prompt.get() in interrupted_prompts
 
 def throw_exception_if_processing_interrupted():
     global interrupt_processing
@@ -1108,3 +1268,7 @@ def throw_exception_if_processing_interrupted():
         if interrupt_processing:
             interrupt_processing = False
             raise InterruptProcessingException()
+        prompt_id = current_prompt.get()
+        if prompt_id in interrupted_prompts:
+            interrupted_prompts.discard(prompt_id)
+            raise InterruptProcessingException()
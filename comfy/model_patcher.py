@@ -334,8 +334,8 @@ class ModelPatcher:
             else:
                 return True
 
-    def memory_required(self, input_shape):
-        return self.model.memory_required(input_shape=input_shape)
+    def memory_required(self, input_shape, control=False):
+        return self.model.memory_required(input_shape=input_shape, control=control)
 
     def set_model_sampler_cfg_function(self, sampler_cfg_function, disable_cfg1_optimization=False):
         if len(inspect.signature(sampler_cfg_function).parameters) == 3:
@@ -604,7 +604,7 @@ class ModelPatcher:
                 m.comfy_patched_weights = True
 
             for x in load_completely:
-                x[2].to(device_to)
+                comfy.model_management.load_module(x[2], device_to)
 
             if lowvram_counter > 0:
                 logging.info("loaded partially {} {} {}".format(lowvram_model_memory / (1024 * 1024), mem_counter / (1024 * 1024), patch_counter))
@@ -613,7 +613,7 @@ class ModelPatcher:
                 logging.info("loaded completely {} {} {}".format(lowvram_model_memory / (1024 * 1024), mem_counter / (1024 * 1024), full_load))
                 self.model.model_lowvram = False
                 if full_load:
-                    self.model.to(device_to)
+                    comfy.model_management.load_module(self.model, device_to)
                     mem_counter = self.model_size()
 
             self.model.lowvram_patch_counter += patch_counter
@@ -667,7 +667,7 @@ class ModelPatcher:
             self.backup.clear()
 
             if device_to is not None:
-                self.model.to(device_to)
+                comfy.model_management.offload_module(self.model, device_to)
                 self.model.device = device_to
             self.model.model_loaded_weight_memory = 0
 
@@ -715,7 +715,7 @@ class ModelPatcher:
                     weight_key = "{}.weight".format(n)
                     bias_key = "{}.bias".format(n)
                     if move_weight:
-                        m.to(device_to)
+                        comfy.model_management.offload_module(m, device_to)
                         if lowvram_possible:
                             if weight_key in self.patches:
                                 m.weight_function = LowVramPatch(weight_key, self.patches)
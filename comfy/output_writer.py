@@ -0,0 +1,81 @@
+"""
+Writes the files of output nodes (SaveImage, SaveAudio, ...) on a pool of background threads, so the conversion and
+encoding of a batch is done in parallel and the next prompt can start while it is written.
+
+Files are written to "<name>.tmp" and renamed when complete, so a file never exists half written. The .tmp file is
+created right away: it keeps the counter of get_save_image_path from handing out the same name again while the write
+is still pending. /view waits for pending writes before serving a file.
+
+At most MAX_PENDING_PER_WORKER writes per worker are in flight: once that many are pending, write() blocks until one
+is done, so a prompt saving faster than the files can be encoded doesn't pile up its images in memory.
+"""
+
+import os
+import logging
+import threading
+import concurrent.futures
+
+from comfy.cli_args import args
+
+MAX_PENDING_PER_WORKER = 4
+
+class OutputWriter:
+    def __init__(self, workers=0):
+        self.executor = None
+        if workers > 0:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="output_writer")
+            self.in_flight = threading.BoundedSemaphore(workers * MAX_PENDING_PER_WORKER)
+        # absolute path -> future of the write
+        self.pending = {}
+        self.mutex = threading.Lock()
+
+    def write_file(self, path, tmp_path, save, save_args):
+        try:
+            with open(tmp_path, "wb") as f:
+                save(f, *save_args)
+            os.replace(tmp_path, path)
+        except:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def write(self, path, save, *save_args):
+        """Calls save(file, *save_args) to write the file at path, on a background thread when there are workers."""
+        path = os.path.abspath(path)
+        tmp_path = path + ".tmp"
+        open(tmp_path, "wb").close()
+        if self.executor is None:
+            self.write_file(path, tmp_path, save, save_args)
+            return
+
+        self.in_flight.acquire()
+        try:
+            with self.mutex:
+                future = self.executor.submit(self.write_file, path, tmp_path, save, save_args)
+                self.pending[path] = future
+        except:
+            self.in_flight.release()
+            raise
+        future.add_done_callback(lambda f: self.done(path, f))
+
+    def done(self, path, future):
+        self.in_flight.release()
+        with self.mutex:
+            if self.pending.get(path) is future:
+                del self.pending[path]
+        if future.exception() is not None:
+            logging.error("Error writing output file {}: {}".format(path, future.exception()))
+
+    def get_pending(self, path):
+        """The future of a pending write of path or None."""
+        with self.mutex:
+            return self.pending.get(os.path.abspath(path))
+
+    def flush(self):
+        with self.mutex:
+            futures = list(self.pending.values())
+        concurrent.futures.wait(futures)
+
+output_writer = OutputWriter(args.output_writers)
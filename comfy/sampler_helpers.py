@@ -106,8 +106,9 @@ def prepare_sampling(model: 'ModelPatcher', noise_shape, conds):
     real_model: 'BaseModel' = None
     models, inference_memory = get_additional_models(conds, model.model_dtype())
     models += model.get_nested_additional_models()  # TODO: does this require inference_memory update?
-    memory_required = model.memory_required([noise_shape[0] * 2] + list(noise_shape[1:])) + inference_memory
-    minimum_memory_required = model.memory_required([noise_shape[0]] + list(noise_shape[1:])) + inference_memory
+    control = any(len(get_models_from_cond(conds[k], "control")) > 0 for k in conds)
+    memory_required = model.memory_required([noise_shape[0] * 2] + list(noise_shape[1:]), control=control) + inference_memory
+    minimum_memory_required = model.memory_required([noise_shape[0]] + list(noise_shape[1:]), control=control) + inference_memory
     comfy.model_management.load_models_gpu([model] + models, memory_required=memory_required, minimum_memory_required=minimum_memory_required)
     real_model = model.model
 
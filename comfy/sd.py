@@ -1,9 +1,11 @@
 from __future__ import annotations
+import os
 import torch
 from enum import Enum
 import logging
 
 from comfy import model_management
+from comfy.memory_estimates import memory_estimates
 from comfy.utils import ProgressBar
 from .ldm.models.autoencoder import AutoencoderKL, AutoencodingEngine
 from .ldm.cascade.stage_a import StageA
@@ -381,17 +383,51 @@ class VAE:
                 pixels = pixels.narrow(d + 1, x_offset, x)
         return pixels
 
-    def decode_tiled_(self, samples, tile_x=64, tile_y=64, overlap = 16):
+    def memory_estimate_key(self, op):
+        return "VAE/{}/{}/{}/{}".format(type(self.first_stage_model).__name__, self.latent_channels, self.vae_dtype, op)
+
+    def estimate_memory_used(self, op, shape):
+        # Memory needed per batch item, learned from earlier runs when available.
+        learned = memory_estimates.estimate(self.memory_estimate_key(op), [1] + list(shape[1:]))
+        if learned is not None:
+            return learned
+        if op == "decode":
+            return self.memory_used_decode(shape, self.vae_dtype)
+        return self.memory_used_encode(shape, self.vae_dtype)
+
+    def tile_batch_size(self, memory_used):
+        # Leave a margin: the estimate is for one tile and doesn't account for fragmentation.
+        free_memory = model_management.get_free_memory(self.device) * 0.75
+        return max(1, min(16, int(free_memory / max(1, memory_used))))
+
+    def run_tile_batches(self, function, tile_batch_size):
+        """Returns function(tile_batch_size), retrying with half as many tiles at a time when it runs out of memory."""
+        while True:
+            try:
+                return function(tile_batch_size)
+            except model_management.OOM_EXCEPTION:
+                if tile_batch_size <= 1:
+                    raise
+                tile_batch_size = tile_batch_size // 2
+                logging.warning("Warning: Ran out of memory when tiled VAE processing, retrying with {} tiles at a time.".format(tile_batch_size))
+                model_management.soft_empty_cache()
+
+    def decode_tiled_(self, samples, tile_x=64, tile_y=64, overlap = 16, single_pass=False, tile_batch_size=1):
+        decode_fn = lambda a: self.first_stage_model.decode(a.to(self.vae_dtype).to(self.device)).float()
+        if single_pass:
+            # One pass relying on the feathered overlap alone to hide the seams, a third of the decoder compute.
+            pbar = comfy.utils.ProgressBar(samples.shape[0] * comfy.utils.get_tiled_scale_steps(samples.shape[3], samples.shape[2], tile_x, tile_y, overlap))
+            return self.process_output(comfy.utils.tiled_scale(samples, decode_fn, tile_x, tile_y, overlap, upscale_amount = self.upscale_ratio, out_channels=self.output_channels, output_device=self.output_device, pbar = pbar, tile_batch_size=tile_batch_size))
+
         steps = samples.shape[0] * comfy.utils.get_tiled_scale_steps(samples.shape[3], samples.shape[2], tile_x, tile_y, overlap)
         steps += samples.shape[0] * comfy.utils.get_tiled_scale_steps(samples.shape[3], samples.shape[2], tile_x // 2, tile_y * 2, overlap)
         steps += samples.shape[0] * comfy.utils.get_tiled_scale_steps(samples.shape[3], samples.shape[2], tile_x * 2, tile_y // 2, overlap)
         pbar = comfy.utils.ProgressBar(steps)
 
-        decode_fn = lambda a: self.first_stage_model.decode(a.to(self.vae_dtype).to(self.device)).float()
         output = self.process_output(
-            (comfy.utils.tiled_scale(samples, decode_fn, tile_x // 2, tile_y * 2, overlap, upscale_amount = self.upscale_ratio, output_device=self.output_device, pbar = pbar) +
-            comfy.utils.tiled_scale(samples, decode_fn, tile_x * 2, tile_y // 2, overlap, upscale_amount = self.upscale_ratio, output_device=self.output_device, pbar = pbar) +
-             comfy.utils.tiled_scale(samples, decode_fn, tile_x, tile_y, overlap, upscale_amount = self.upscale_ratio, output_device=self.output_device, pbar = pbar))
+            (comfy.utils.tiled_scale(samples, decode_fn, tile_x // 2, tile_y * 2, overlap, upscale_amount = self.upscale_ratio, output_device=self.output_device, pbar = pbar, tile_batch_size=tile_batch_size) +
+            comfy.utils.tiled_scale(samples, decode_fn, tile_x * 2, tile_y // 2, overlap, upscale_amount = self.upscale_ratio, output_device=self.output_device, pbar = pbar, tile_batch_size=tile_batch_size) +
+             comfy.utils.tiled_scale(samples, decode_fn, tile_x, tile_y, overlap, upscale_amount = self.upscale_ratio, output_device=self.output_device, pbar = pbar, tile_batch_size=tile_batch_size))
             / 3.0)
         return output
 
@@ -403,16 +439,20 @@ class VAE:
         decode_fn = lambda a: self.first_stage_model.decode(a.to(self.vae_dtype).to(self.device)).float()
         return self.process_output(comfy.utils.tiled_scale_multidim(samples, decode_fn, tile=(tile_t, tile_x, tile_y), overlap=overlap, upscale_amount=self.upscale_ratio, out_channels=self.output_channels, output_device=self.output_device))
 
-    def encode_tiled_(self, pixel_samples, tile_x=512, tile_y=512, overlap = 64):
+    def encode_tiled_(self, pixel_samples, tile_x=512, tile_y=512, overlap = 64, single_pass=False, tile_batch_size=1):
+        encode_fn = lambda a: self.first_stage_model.encode((self.process_input(a)).to(self.vae_dtype).to(self.device)).float()
+        if single_pass:
+            pbar = comfy.utils.ProgressBar(pixel_samples.shape[0] * comfy.utils.get_tiled_scale_steps(pixel_samples.shape[3], pixel_samples.shape[2], tile_x, tile_y, overlap))
+            return comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x, tile_y, overlap, upscale_amount = (1/self.downscale_ratio), out_channels=self.latent_channels, output_device=self.output_device, pbar=pbar, tile_batch_size=tile_batch_size)
+
         steps = pixel_samples.shape[0] * comfy.utils.get_tiled_scale_steps(pixel_samples.shape[3], pixel_samples.shape[2], tile_x, tile_y, overlap)
         steps += pixel_samples.shape[0] * comfy.utils.get_tiled_scale_steps(pixel_samples.shape[3], pixel_samples.shape[2], tile_x // 2, tile_y * 2, overlap)
         steps += pixel_samples.shape[0] * comfy.utils.get_tiled_scale_steps(pixel_samples.shape[3], pixel_samples.shape[2], tile_x * 2, tile_y // 2, overlap)
         pbar = comfy.utils.ProgressBar(steps)
 
-        encode_fn = lambda a: self.first_stage_model.encode((self.process_input(a)).to(self.vae_dtype).to(self.device)).float()
-        samples = comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x, tile_y, overlap, upscale_amount = (1/self.downscale_ratio), out_channels=self.latent_channels, output_device=self.output_device, pbar=pbar)
-        samples += comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x * 2, tile_y // 2, overlap, upscale_amount = (1/self.downscale_ratio), out_channels=self.latent_channels, output_device=self.output_device, pbar=pbar)
-        samples += comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x // 2, tile_y * 2, overlap, upscale_amount = (1/self.downscale_ratio), out_channels=self.latent_channels, output_device=self.output_device, pbar=pbar)
+        samples = comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x, tile_y, overlap, upscale_amount = (1/self.downscale_ratio), out_channels=self.latent_channels, output_device=self.output_device, pbar=pbar, tile_batch_size=tile_batch_size)
+        samples += comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x * 2, tile_y // 2, overlap, upscale_amount = (1/self.downscale_ratio), out_channels=self.latent_channels, output_device=self.output_device, pbar=pbar, tile_batch_size=tile_batch_size)
+        samples += comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x // 2, tile_y * 2, overlap, upscale_amount = (1/self.downscale_ratio), out_channels=self.latent_channels, output_device=self.output_device, pbar=pbar, tile_batch_size=tile_batch_size)
         samples /= 3.0
         return samples
 
@@ -423,7 +463,7 @@ class VAE:
     def decode(self, samples_in):
         pixel_samples = None
         try:
-            memory_used = self.memory_used_decode(samples_in.shape, self.vae_dtype)
+            memory_used = self.estimate_memory_used("decode", samples_in.shape)
             model_management.load_models_gpu([self.patcher], memory_required=memory_used)
             free_memory = model_management.get_free_memory(self.device)
             batch_number = int(free_memory / memory_used)
@@ -431,7 +471,9 @@ class VAE:
 
             for x in range(0, samples_in.shape[0], batch_number):
                 samples = samples_in[x:x+batch_number].to(self.vae_dtype).to(self.device)
-                out = self.process_output(self.first_stage_model.decode(samples).to(self.output_device).float())
+                with memory_estimates.measure(self.memory_estimate_key("decode"), samples.shape, self.device):
+                    out = self.first_stage_model.decode(samples)
+                out = self.process_output(out.to(self.output_device).float())
                 if pixel_samples is None:
                     pixel_samples = torch.empty((samples_in.shape[0],) + tuple(out.shape[1:]), device=self.output_device)
                 pixel_samples[x:x+batch_number] = out
@@ -450,7 +492,7 @@ class VAE:
         pixel_samples = pixel_samples.to(self.output_device).movedim(1,-1)
         return pixel_samples
 
-    def decode_tiled(self, samples, tile_x=None, tile_y=None, overlap=None):
+    def decode_tiled(self, samples, tile_x=None, tile_y=None, overlap=None, single_pass=False):
         memory_used = self.memory_used_decode(samples.shape, self.vae_dtype) #TODO: calculate mem required for tile
         model_management.load_models_gpu([self.patcher], memory_required=memory_used)
         dims = samples.ndim - 2
@@ -466,7 +508,9 @@ class VAE:
             args.pop("tile_y")
             output = self.decode_tiled_1d(samples, **args)
         elif dims == 2:
-            output = self.decode_tiled_(samples, **args)
+            # Decode as many tiles at once as fit in memory.
+            tile_memory = self.estimate_memory_used("decode", (1, samples.shape[1], args.get("tile_y", 64), args.get("tile_x", 64)))
+            output = self.run_tile_batches(lambda tile_batch_size: self.decode_tiled_(samples, single_pass=single_pass, tile_batch_size=tile_batch_size, **args), self.tile_batch_size(tile_memory))
         elif dims == 3:
             output = self.decode_tiled_3d(samples, **args)
         return output.movedim(1, -1)
@@ -477,7 +521,7 @@ class VAE:
         if self.latent_dim == 3:
             pixel_samples = pixel_samples.movedim(1, 0).unsqueeze(0)
         try:
-            memory_used = self.memory_used_encode(pixel_samples.shape, self.vae_dtype)
+            memory_used = self.estimate_memory_used("encode", pixel_samples.shape)
             model_management.load_models_gpu([self.patcher], memory_required=memory_used)
             free_memory = model_management.get_free_memory(self.device)
             batch_number = int(free_memory / max(1, memory_used))
@@ -485,7 +529,9 @@ class VAE:
             samples = None
             for x in range(0, pixel_samples.shape[0], batch_number):
                 pixels_in = self.process_input(pixel_samples[x:x + batch_number]).to(self.vae_dtype).to(self.device)
-                out = self.first_stage_model.encode(pixels_in).to(self.output_device).float()
+                with memory_estimates.measure(self.memory_estimate_key("encode"), pixels_in.shape, self.device):
+                    out = self.first_stage_model.encode(pixels_in)
+                out = out.to(self.output_device).float()
                 if samples is None:
                     samples = torch.empty((pixel_samples.shape[0],) + tuple(out.shape[1:]), device=self.output_device)
                 samples[x:x + batch_number] = out
@@ -499,11 +545,12 @@ class VAE:
 
         return samples
 
-    def encode_tiled(self, pixel_samples, tile_x=512, tile_y=512, overlap = 64):
+    def encode_tiled(self, pixel_samples, tile_x=512, tile_y=512, overlap = 64, single_pass=False):
         pixel_samples = self.vae_encode_crop_pixels(pixel_samples)
         model_management.load_model_gpu(self.patcher)
         pixel_samples = pixel_samples.movedim(-1,1)
-        samples = self.encode_tiled_(pixel_samples, tile_x=tile_x, tile_y=tile_y, overlap=overlap)
+        tile_memory = self.estimate_memory_used("encode", (1, pixel_samples.shape[1], tile_y, tile_x))
+        samples = self.run_tile_batches(lambda tile_batch_size: self.encode_tiled_(pixel_samples, tile_x=tile_x, tile_y=tile_y, overlap=overlap, single_pass=single_pass, tile_batch_size=tile_batch_size), self.tile_batch_size(tile_memory))
         return samples
 
     def get_sd(self):
@@ -706,14 +753,83 @@ def load_checkpoint(config_path=None, ckpt_path=None, output_vae=True, output_cl
 
     return (model, clip, vae)
 
+checkpoint_detections = {}
+
+def detect_checkpoint(ckpt_path):
+    """
+    Works out what load_checkpoint_guess_config would load from a safetensors checkpoint using only the key names and
+    shapes in its header, without reading any weights. Returns None if the model type can't be detected. What comes
+    from the header is cached until the file changes, the inference dtype and load device are worked out on each call.
+    """
+    info, unet_weight_dtype = detect_checkpoint_(ckpt_path)[1:]
+    if info is None:
+        return None
+    info = dict(info)
+    info["unet_dtype"] = model_management.unet_dtype(model_params=info["parameters"], supported_dtypes=unet_weight_dtype)
+    info["load_device"] = model_management.unet_inital_load_device(info["parameters"], info["unet_dtype"])
+    return info
+
+def is_undetectable_checkpoint(ckpt_path):
+    """
+    True if no model type matches the header of the safetensors checkpoint, so loading it would fail. False when the
+    header can't be read as meta tensors (too big, unknown dtypes): only loading it tells.
+    """
+    if not is_safetensors(ckpt_path):
+        return False
+    header_read, info = detect_checkpoint_(ckpt_path)[:2]
+    return header_read and info is None
+
+def is_safetensors(ckpt_path):
+    return ckpt_path.lower().endswith((".safetensors", ".sft"))
+
+def detect_checkpoint_(ckpt_path):
+    # (whether the header could be read, info, supported unet dtypes)
+    st = os.stat(ckpt_path)
+    key = (ckpt_path, st.st_size, st.st_mtime_ns)
+    if key in checkpoint_detections:
+        return checkpoint_detections[key]
+
+    info = None
+    unet_weight_dtype = None
+    sd = comfy.utils.safetensors_meta_state_dict(ckpt_path)
+    if sd is not None:
+        diffusion_model_prefix = model_detection.unet_prefix_from_state_dict(sd)
+        model_config = model_detection.model_config_from_unet(sd, diffusion_model_prefix)
+        if model_config is not None:
+            parameters = comfy.utils.calculate_parameters(sd, diffusion_model_prefix)
+            weight_dtype = comfy.utils.weight_dtype(sd, diffusion_model_prefix)
+            unet_weight_dtype = list(model_config.supported_inference_dtypes)
+            if weight_dtype is not None and model_config.scaled_fp8 is None:
+                unet_weight_dtype.append(weight_dtype)
+
+            def has_prefix(prefixes):
+                return any(k.startswith(p) for k in sd for p in prefixes)
+
+            info = {
+                "model_type": type(model_config).__name__,
+                "parameters": parameters,
+                "weight_dtype": weight_dtype,
+                "vae": has_prefix(model_config.vae_key_prefix),
+                "clip": has_prefix(model_config.text_encoder_key_prefix),
+                "clip_vision": model_config.clip_vision_prefix is not None and has_prefix([model_config.clip_vision_prefix]),
+            }
+
+    checkpoint_detections[key] = (sd is not None, info, unet_weight_dtype)
+    return checkpoint_detections[key]
+
 def load_checkpoint_guess_config(ckpt_path, output_vae=True, output_clip=True, output_clipvision=False, embedding_directory=None, output_model=True, model_options={}, te_model_options={}):
+    if is_undetectable_checkpoint(ckpt_path):
+        # Fail before reading gigabytes of weights.
+        raise RuntimeError("ERROR: Could not detect model type of: {}".format(ckpt_path))
+    detected = detect_checkpoint(ckpt_path) if is_safetensors(ckpt_path) else None
     sd = comfy.utils.load_torch_file(ckpt_path)
-    out = load_state_dict_guess_config(sd, output_vae, output_clip, output_clipvision, embedding_directory, output_model, model_options, te_model_options=te_model_options)
+    out = load_state_dict_guess_config(sd, output_vae, output_clip, output_clipvision, embedding_directory, output_model, model_options, te_model_options=te_model_options, detected=detected)
     if out is None:
         raise RuntimeError("ERROR: Could not detect model type of: {}".format(ckpt_path))
     return out
 
-def load_state_dict_guess_config(sd, output_vae=True, output_clip=True, output_clipvision=False, embedding_directory=None, output_model=True, model_options={}, te_model_options={}):
+def load_state_dict_guess_config(sd, output_vae=True, output_clip=True, output_clipvision=False, embedding_directory=None, output_model=True, model_options={}, te_model_options={}, detected=None):
+    # detected: detect_checkpoint() of the file sd was loaded from, so what it worked out isn't worked out again.
     clip = None
     clipvision = None
     vae = None
@@ -721,8 +837,12 @@ def load_state_dict_guess_config(sd, output_vae=True, output_clip=True, output_c
     model_patcher = None
 
     diffusion_model_prefix = model_detection.unet_prefix_from_state_dict(sd)
-    parameters = comfy.utils.calculate_parameters(sd, diffusion_model_prefix)
-    weight_dtype = comfy.utils.weight_dtype(sd, diffusion_model_prefix)
+    if detected is not None:
+        parameters = detected["parameters"]
+        weight_dtype = detected["weight_dtype"]
+    else:
+        parameters = comfy.utils.calculate_parameters(sd, diffusion_model_prefix)
+        weight_dtype = comfy.utils.weight_dtype(sd, diffusion_model_prefix)
     load_device = model_management.get_torch_device()
 
     model_config = model_detection.model_config_from_unet(sd, diffusion_model_prefix)
@@ -735,8 +855,12 @@ def load_state_dict_guess_config(sd, output_vae=True, output_clip=True, output_c
 
     model_config.custom_operations = model_options.get("custom_operations", None)
     unet_dtype = model_options.get("dtype", model_options.get("weight_dtype", None))
+    inital_load_device = None
 
-    if unet_dtype is None:
+    if unet_dtype is None and detected is not None:
+        unet_dtype = detected["unet_dtype"]
+        inital_load_device = detected["load_device"]
+    elif unet_dtype is None:
         unet_dtype = model_management.unet_dtype(model_params=parameters, supported_dtypes=unet_weight_dtype)
 
     manual_cast_dtype = model_management.unet_manual_cast(unet_dtype, load_device, model_config.supported_inference_dtypes)
@@ -747,7 +871,8 @@ def load_state_dict_guess_config(sd, output_vae=True, output_clip=True, output_c
             clipvision = clip_vision.load_clipvision_from_sd(sd, model_config.clip_vision_prefix, True)
 
     if output_model:
-        inital_load_device = model_management.unet_inital_load_device(parameters, unet_dtype)
+        if inital_load_device is None:
+            inital_load_device = model_management.unet_inital_load_device(parameters, unet_dtype)
         model = model_config.get_model(sd, diffusion_model_prefix, device=inital_load_device)
         model.load_model_weights(sd, diffusion_model_prefix)
 
@@ -19,6 +19,8 @@
 
 import torch
 import math
+import json
+import mmap
 import struct
 import comfy.checkpoint_pickle
 import safetensors.torch
@@ -26,12 +28,76 @@ import numpy as np
 from PIL import Image
 import logging
 import itertools
+from comfy.cli_args import args
+
+# safetensors dtype names -> torch dtypes. Dtypes only newer pytorch versions have are left out when missing, files using
+# them (or dtypes not listed here) are loaded with the safetensors library.
+SAFETENSORS_DTYPES = {k: v for k, v in {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U64": getattr(torch, "uint64", None),
+    "U32": getattr(torch, "uint32", None),
+    "U16": getattr(torch, "uint16", None),
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+    "F8_E4M3": getattr(torch, "float8_e4m3fn", None),
+    "F8_E5M2": getattr(torch, "float8_e5m2", None),
+    "F8_E8M0": getattr(torch, "float8_e8m0fnu", None),
+}.items() if v is not None}
+
+def load_safetensors(ckpt, device=None):
+    """
+    Loads a safetensors file as a state dict of views into a copy on write memory map of the file: nothing is read until
+    a tensor is used and the data stays in the OS file cache instead of being copied into process memory. On a device
+    other than the CPU the tensors are copied there one at a time.
+
+    The file stays mapped as long as any tensor of the state dict is alive. On Windows that keeps it open and locked:
+    it can't be deleted, renamed or overwritten while the model is loaded (--disable-mmap avoids this).
+    """
+    if device is None:
+        device = torch.device("cpu")
+    with open(ckpt, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        unsupported = set(info["dtype"] for k, info in header.items() if k != "__metadata__") - SAFETENSORS_DTYPES.keys()
+        if len(unsupported) > 0:
+            logging.debug("Loading {} with the safetensors library, unsupported dtypes: {}".format(ckpt, sorted(unsupported)))
+            return safetensors.torch.load_file(ckpt, device=device.type)
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    data_start = 8 + header_size
+    sd = {}
+    for k, info in header.items():
+        if k == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        start, end = (data_start + x for x in info["data_offsets"])
+        if start == end:
+            tensor = torch.empty(info["shape"], dtype=dtype)
+        elif start % dtype.itemsize != 0:
+            # Misaligned tensors are rare enough to just copy.
+            tensor = torch.frombuffer(bytearray(data[start:end]), dtype=dtype).view(info["shape"])
+        else:
+            tensor = torch.frombuffer(data, dtype=dtype, count=(end - start) // dtype.itemsize, offset=start).view(info["shape"])
+        if device.type != "cpu":
+            tensor = tensor.to(device)
+        sd[k] = tensor
+    return sd
 
 def load_torch_file(ckpt, safe_load=False, device=None):
     if device is None:
         device = torch.device("cpu")
     if ckpt.lower().endswith(".safetensors") or ckpt.lower().endswith(".sft"):
-        sd = safetensors.torch.load_file(ckpt, device=device.type)
+        if args.disable_mmap:
+            sd = safetensors.torch.load_file(ckpt, device=device.type)
+        else:
+            sd = load_safetensors(ckpt, device)
     else:
         if safe_load:
             if not 'weights_only' in torch.load.__code__.co_varnames:
@@ -601,6 +667,24 @@ def safetensors_header(safetensors_path, max_size=100*1024*1024):
             return None
         return f.read(length_of_header)
 
+def safetensors_meta_state_dict(safetensors_path, max_size=100*1024*1024):
+    """
+    State dict of meta tensors with the names, shapes and dtypes of the tensors in a safetensors file, from its header
+    alone, for code like model detection that doesn't need the weights. None if the header is too big.
+    """
+    header = safetensors_header(safetensors_path, max_size=max_size)
+    if header is None:
+        return None
+    sd = {}
+    for k, info in json.loads(header).items():
+        if k == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES.get(info["dtype"], None)
+        if dtype is None:
+            return None
+        sd[k] = torch.empty(info["shape"], dtype=dtype, device="meta")
+    return sd
+
 def set_attr(obj, attr, value):
     attrs = attr.split(".")
     for name in attrs[:-1]:
@@ -749,7 +833,8 @@ def get_tiled_scale_steps(width, height, tile_x, tile_y, overlap):
     return rows * cols
 
 @torch.inference_mode()
-def tiled_scale_multidim(samples, function, tile=(64, 64), overlap = 8, upscale_amount = 4, out_channels = 3, output_device="cpu", pbar = None):
+def tiled_scale_multidim(samples, function, tile=(64, 64), overlap = 8, upscale_amount = 4, out_channels = 3, output_device="cpu", pbar = None, tile_batch_size = 1):
+    # With tile_batch_size > 1, up to that many tiles of the same shape are passed to function as one batch.
     dims = len(tile)
 
     if not (isinstance(upscale_amount, (tuple, list))):
@@ -773,6 +858,24 @@ def tiled_scale_multidim(samples, function, tile=(64, 64), overlap = 8, upscale_
 
     output = torch.empty([samples.shape[0], out_channels] + mult_list_upscale(samples.shape[2:]), device=output_device)
 
+    feathers = [round(get_upscale(d, overlap[d])) for d in range(dims)]
+    masks = {}
+    def get_mask(shape, dtype):
+        # The blend mask only depends on the shape of the tile, build it once from a ramp per dimension.
+        key = (tuple(shape), dtype)
+        if key not in masks:
+            mask = torch.ones([1, 1] + [1] * dims, dtype=dtype, device=output_device)
+            for d in range(dims):
+                ramp = torch.ones(shape[d], dtype=dtype, device=output_device)
+                feather = feathers[d]
+                if feather > 0:
+                    a = torch.arange(1, feather + 1, dtype=dtype, device=output_device) / feather
+                    ramp[:feather] *= a
+                    ramp[shape[d] - feather:] *= a.flip(0)
+                mask = mask * ramp.view([1, 1] + [shape[d] if i == d else 1 for i in range(dims)])
+            masks[key] = mask
+        return masks[key]
+
     for b in range(samples.shape[0]):
         s = samples[b:b+1]
 
@@ -783,11 +886,15 @@ def tiled_scale_multidim(samples, function, tile=(64, 64), overlap = 8, upscale_
                 pbar.update(1)
             continue
 
-        out = torch.zeros([s.shape[0], out_channels] + mult_list_upscale(s.shape[2:]), device=output_device)
-        out_div = torch.zeros([s.shape[0], out_channels] + mult_list_upscale(s.shape[2:]), device=output_device)
+        # Tiles are accumulated straight into the output, the blend weights are the same for every channel.
+        out = output[b:b+1]
+        out.zero_()
+        out_div = torch.zeros([s.shape[0], 1] + mult_list_upscale(s.shape[2:]), device=output_device)
 
         positions = [range(0, s.shape[d+2], tile[d] - overlap[d]) if s.shape[d+2] > tile[d] else [0] for d in range(dims)]
 
+        # Group the tiles by shape so the ones that can be batched together are.
+        tiles = {}
         for it in itertools.product(*positions):
             s_in = s
             upscaled = []
@@ -797,34 +904,35 @@ def tiled_scale_multidim(samples, function, tile=(64, 64), overlap = 8, upscale_
                 l = min(tile[d], s.shape[d + 2] - pos)
                 s_in = s_in.narrow(d + 2, pos, l)
                 upscaled.append(round(get_upscale(d, pos)))
-
-            ps = function(s_in).to(output_device)
-            mask = torch.ones_like(ps)
-
-            for d in range(2, dims + 2):
-                feather = round(get_upscale(d - 2, overlap[d - 2]))
-                for t in range(feather):
-                    a = (t + 1) / feather
-                    mask.narrow(d, t, 1).mul_(a)
-                    mask.narrow(d, mask.shape[d] - 1 - t, 1).mul_(a)
-
-            o = out
-            o_d = out_div
-            for d in range(dims):
-                o = o.narrow(d + 2, upscaled[d], mask.shape[d + 2])
-                o_d = o_d.narrow(d + 2, upscaled[d], mask.shape[d + 2])
-
-            o.add_(ps * mask)
-            o_d.add_(mask)
-
-            if pbar is not None:
-                pbar.update(1)
-
-        output[b:b+1] = out/out_div
+            tiles.setdefault(tuple(s_in.shape), []).append((s_in, upscaled))
+
+        for group in tiles.values():
+            for i in range(0, len(group), tile_batch_size):
+                batch = group[i:i + tile_batch_size]
+                if len(batch) == 1:
+                    ps = function(batch[0][0]).to(output_device)
+                else:
+                    ps = function(torch.cat([x[0] for x in batch])).to(output_device)
+                mask = get_mask(ps.shape[2:], ps.dtype)
+
+                for j, (_, upscaled) in enumerate(batch):
+                    o = out
+                    o_d = out_div
+                    for d in range(dims):
+                        o = o.narrow(d + 2, upscaled[d], mask.shape[d + 2])
+                        o_d = o_d.narrow(d + 2, upscaled[d], mask.shape[d + 2])
+
+                    o.add_(ps[j:j + 1] * mask)
+                    o_d.add_(mask)
+
+                if pbar is not None:
+                    pbar.update(len(batch))
+
+        out.div_(out_div)
     return output
 
-def tiled_scale(samples, function, tile_x=64, tile_y=64, overlap = 8, upscale_amount = 4, out_channels = 3, output_device="cpu", pbar = None):
-    return tiled_scale_multidim(samples, function, (tile_y, tile_x), overlap, upscale_amount, out_channels, output_device, pbar)
+def tiled_scale(samples, function, tile_x=64, tile_y=64, overlap = 8, upscale_amount = 4, out_channels = 3, output_device="cpu", pbar = None, tile_batch_size = 1):
+    return tiled_scale_multidim(samples, function, (tile_y, tile_x), overlap, upscale_amount, out_channels, output_device, pbar, tile_batch_size)
 
 PROGRESS_BAR_ENABLED = True
 def set_progress_bar_enabled(enabled):
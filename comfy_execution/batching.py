@@ -0,0 +1,120 @@
+"""
+Sampling several queued prompts in one batch (--batch-prompts).
+
+Prompts that only differ in their seed or prompt text, like the same workflow submitted by many users, have a KSampler
+with the same model and settings. Its inputs are computed per prompt, the sampling runs once over all their latents
+with the conditioning of each prompt stacked along the batch, and each prompt then executes as usual with its slice of
+the result already cached.
+"""
+
+import torch
+
+import comfy.sample
+import comfy.utils
+from comfy_execution.graph_utils import is_link
+
+BATCHED_CLASS_TYPE = "KSampler"
+# Widgets that can differ between prompts sampled together: they only change the noise or the conditioning tensors.
+PER_PROMPT_INPUTS = {("KSampler", "seed"), ("CLIPTextEncode", "text")}
+# Samplers that add no noise after the initial one, so a prompt sampled in a batch gives the same result as alone.
+DETERMINISTIC_SAMPLERS = {"euler", "euler_cfg_pp", "heun", "heunpp2", "dpm_2", "lms", "dpmpp_2m", "dpmpp_2m_cfg_pp",
+                          "ipndm", "ipndm_v", "deis", "ddim", "uni_pc", "uni_pc_bh2"}
+# Tensors in the conditioning dicts that are per prompt and get stacked like the conditioning itself.
+BATCHED_COND_KEYS = {"pooled_output"}
+
+def find_sampler(prompt):
+    sampler_ids = [node_id for node_id, node in prompt.items() if node.get("class_type") == BATCHED_CLASS_TYPE]
+    if len(sampler_ids) != 1:
+        return None
+    return sampler_ids[0]
+
+def get_batch_key(prompt):
+    """
+    Prompts with equal keys can have their sampler batched: the sampler and everything it depends on are the same
+    except for PER_PROMPT_INPUTS. None if the prompt can't be batched at all.
+    """
+    sampler_id = find_sampler(prompt)
+    if sampler_id is None or prompt[sampler_id]["inputs"].get("sampler_name") not in DETERMINISTIC_SAMPLERS:
+        return None
+    key = []
+    visited = set()
+    node_ids = [sampler_id]
+    while len(node_ids) > 0:
+        node_id = node_ids.pop()
+        if node_id in visited:
+            continue
+        visited.add(node_id)
+        node = prompt[node_id]
+        class_type = node.get("class_type")
+        inputs = []
+        for name, value in sorted(node.get("inputs", {}).items()):
+            if is_link(value):
+                node_ids.append(value[0])
+            elif (class_type, name) in PER_PROMPT_INPUTS:
+                continue
+            inputs.append((name, value))
+        key.append((node_id, class_type, repr(inputs)))
+    return tuple(sorted(key))
+
+def get_cond_key(conds):
+    key = []
+    for cond, extra in conds:
+        extra_key = []
+        for name, value in sorted(extra.items()):
+            if isinstance(value, torch.Tensor):
+                if name not in BATCHED_COND_KEYS:
+                    return None
+                extra_key.append((name, tuple(value.shape[1:]), value.dtype))
+            elif value is None or isinstance(value, (bool, int, float, str)):
+                extra_key.append((name, value))
+            else:
+                # Control nets, hooks, areas and the like apply to the whole batch.
+                return None
+        key.append((tuple(cond.shape[1:]), cond.dtype, tuple(extra_key)))
+    return tuple(key)
+
+def get_job_key(inputs):
+    """Sampler jobs (the KSampler inputs of a prompt) with equal keys can be sampled by sample_batch, None if never."""
+    latent = inputs["latent_image"]
+    if inputs["sampler_name"] not in DETERMINISTIC_SAMPLERS or list(latent.keys()) != ["samples"]:
+        return None
+    positive = get_cond_key(inputs["positive"])
+    negative = get_cond_key(inputs["negative"])
+    if positive is None or negative is None:
+        return None
+    return (id(inputs["model"]), inputs["steps"], inputs["cfg"], inputs["sampler_name"], inputs["scheduler"],
+            inputs["denoise"], tuple(latent["samples"].shape[1:]), positive, negative)
+
+def concat_conds(conds_list, batch_sizes):
+    out = []
+    for entries in zip(*conds_list):
+        cond = torch.cat([comfy.utils.repeat_to_batch_size(c, b) for (c, _), b in zip(entries, batch_sizes)])
+        extra = entries[0][1].copy()
+        for name in BATCHED_COND_KEYS.intersection(extra):
+            extra[name] = torch.cat([comfy.utils.repeat_to_batch_size(e[name], b) for (_, e), b in zip(entries, batch_sizes)])
+        out.append([cond, extra])
+    return out
+
+def sample_batch(jobs, callback=None):
+    """
+    Runs the sampling of jobs with equal get_job_key at once, returns the LATENT output of each. callback gets the
+    whole batch, the latents of the jobs follow each other in order.
+    """
+    first = jobs[0]
+    model = first["model"]
+    latents = [comfy.sample.fix_empty_latent_channels(model, job["latent_image"]["samples"]) for job in jobs]
+    batch_sizes = [x.shape[0] for x in latents]
+    # Each prompt gets the exact noise it would have gotten on its own.
+    noise = torch.cat([comfy.sample.prepare_noise(latent, job["seed"]) for latent, job in zip(latents, jobs)])
+    positive = concat_conds([job["positive"] for job in jobs], batch_sizes)
+    negative = concat_conds([job["negative"] for job in jobs], batch_sizes)
+
+    samples = comfy.sample.sample(model, noise, first["steps"], first["cfg"], first["sampler_name"], first["scheduler"],
+                                  positive, negative, torch.cat(latents), denoise=first["denoise"], callback=callback,
+                                  disable_pbar=not comfy.utils.PROGRESS_BAR_ENABLED, seed=first["seed"])
+    outputs = []
+    for job, job_samples in zip(jobs, torch.split(samples, batch_sizes)):
+        out = job["latent_image"].copy()
+        out["samples"] = job_samples
+        outputs.append(out)
+    return outputs
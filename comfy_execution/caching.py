@@ -1,12 +1,21 @@
-import itertools
-from typing import Sequence, Mapping, Dict
+import os
+import sys
+import types
+import hashlib
+import inspect
+import json
+import torch
+import numpy as np
+from typing import Dict
 from comfy_execution.graph import DynamicPrompt
 
 import nodes
+import folder_paths
 
 from comfy_execution.graph_utils import is_link
 
 NODE_CLASS_CONTAINS_UNIQUE_ID: Dict[str, bool] = {}
+NODE_CLASS_CODE_VERSIONS: Dict[type, list] = {}
 
 
 def include_unique_id_in_input(class_type: str) -> bool:
@@ -16,6 +25,19 @@ def include_unique_id_in_input(class_type: str) -> bool:
     NODE_CLASS_CONTAINS_UNIQUE_ID[class_type] = "UNIQUE_ID" in class_def.INPUT_TYPES().get("hidden", {}).values()
     return NODE_CLASS_CONTAINS_UNIQUE_ID[class_type]
 
+def get_node_code_version(class_def):
+    """
+    Size and mtime of the file a node class is defined in, as it was when the class was first asked about: node code
+    only changes with a restart.
+    """
+    if class_def not in NODE_CLASS_CODE_VERSIONS:
+        try:
+            st = os.stat(inspect.getfile(class_def))
+            NODE_CLASS_CODE_VERSIONS[class_def] = [st.st_size, st.st_mtime_ns]
+        except (TypeError, OSError):
+            NODE_CLASS_CODE_VERSIONS[class_def] = None
+    return NODE_CLASS_CODE_VERSIONS[class_def]
+
 class CacheKeySet:
     def __init__(self, dynprompt, node_ids, is_changed_cache):
         self.keys = {}
@@ -43,19 +65,6 @@ class Unhashable:
     def __init__(self):
         self.value = float("NaN")
 
-def to_hashable(obj):
-    # So that we don't infinitely recurse since frozenset and tuples
-    # are Sequences.
-    if isinstance(obj, (int, float, str, bool, type(None))):
-        return obj
-    elif isinstance(obj, Mapping):
-        return frozenset([(to_hashable(k), to_hashable(v)) for k, v in sorted(obj.items())])
-    elif isinstance(obj, Sequence):
-        return frozenset(zip(itertools.count(), [to_hashable(i) for i in obj]))
-    else:
-        # TODO - Support other objects like tensors?
-        return Unhashable()
-
 class CacheKeySetID(CacheKeySet):
     def __init__(self, dynprompt, node_ids, is_changed_cache):
         super().__init__(dynprompt, node_ids, is_changed_cache)
@@ -77,6 +86,7 @@ class CacheKeySetInputSignature(CacheKeySet):
         super().__init__(dynprompt, node_ids, is_changed_cache)
         self.dynprompt = dynprompt
         self.is_changed_cache = is_changed_cache
+        self.signatures = {}
         self.add_keys(node_ids)
 
     def include_node_id_in_input(self) -> bool:
@@ -92,18 +102,39 @@ class CacheKeySetInputSignature(CacheKeySet):
             self.keys[node_id] = self.get_node_signature(self.dynprompt, node_id)
             self.subcache_keys[node_id] = (node_id, node["class_type"])
 
+    # The signature of a node is a digest of its own inputs and of the signatures of the nodes it is linked
+    # to (Merkle tree style), so each node is only hashed once no matter how many descendants it has, and
+    # an unchanged subgraph gets the same signatures in every prompt.
+    # Ancestors are visited iteratively since graphs can be far deeper than the recursion limit.
     def get_node_signature(self, dynprompt, node_id):
-        signature = []
-        ancestors, order_mapping = self.get_ordered_ancestry(dynprompt, node_id)
-        signature.append(self.get_immediate_node_signature(dynprompt, node_id, order_mapping))
-        for ancestor_id in ancestors:
-            signature.append(self.get_immediate_node_signature(dynprompt, ancestor_id, order_mapping))
-        return to_hashable(signature)
-
-    def get_immediate_node_signature(self, dynprompt, node_id, ancestor_order_mapping):
+        stack = [node_id]
+        visiting = set()
+        while len(stack) > 0:
+            current_id = stack[-1]
+            if current_id in self.signatures:
+                stack.pop()
+                continue
+            if current_id not in visiting:
+                visiting.add(current_id)
+                # Ancestors that are already being visited are part of a cycle and will be left unsigned.
+                pending = [x for x in self.get_linked_ancestors(dynprompt, current_id) if x not in self.signatures and x not in visiting]
+                if len(pending) > 0:
+                    stack.extend(pending)
+                    continue
+            stack.pop()
+            self.signatures[current_id] = self.get_immediate_node_signature(dynprompt, current_id)
+        return self.signatures[node_id]
+
+    def get_linked_ancestors(self, dynprompt, node_id):
+        if not dynprompt.has_node(node_id):
+            return []
+        inputs = dynprompt.get_node(node_id)["inputs"]
+        return [inputs[key][0] for key in sorted(inputs.keys()) if is_link(inputs[key])]
+
+    def get_immediate_node_signature(self, dynprompt, node_id):
         if not dynprompt.has_node(node_id):
             # This node doesn't exist -- we can't cache it.
-            return [float("NaN")]
+            return Unhashable()
         node = dynprompt.get_node(node_id)
         class_type = node["class_type"]
         class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
@@ -114,32 +145,19 @@ class CacheKeySetInputSignature(CacheKeySet):
         for key in sorted(inputs.keys()):
             if is_link(inputs[key]):
                 (ancestor_id, ancestor_socket) = inputs[key]
-                ancestor_index = ancestor_order_mapping[ancestor_id]
-                signature.append((key,("ANCESTOR", ancestor_index, ancestor_socket)))
+                ancestor_signature = self.signatures.get(ancestor_id, None)
+                if not isinstance(ancestor_signature, str):
+                    # Anything downstream of an uncacheable node is uncacheable too.
+                    return Unhashable()
+                signature.append((key,("ANCESTOR", ancestor_signature, ancestor_socket)))
             else:
                 signature.append((key, inputs[key]))
-        return signature
-
-    # This function returns a list of all ancestors of the given node. The order of the list is
-    # deterministic based on which specific inputs the ancestor is connected by.
-    def get_ordered_ancestry(self, dynprompt, node_id):
-        ancestors = []
-        order_mapping = {}
-        self.get_ordered_ancestry_internal(dynprompt, node_id, ancestors, order_mapping)
-        return ancestors, order_mapping
-
-    def get_ordered_ancestry_internal(self, dynprompt, node_id, ancestors, order_mapping):
-        if not dynprompt.has_node(node_id):
-            return
-        inputs = dynprompt.get_node(node_id)["inputs"]
-        input_keys = sorted(inputs.keys())
-        for key in input_keys:
-            if is_link(inputs[key]):
-                ancestor_id = inputs[key][0]
-                if ancestor_id not in order_mapping:
-                    ancestors.append(ancestor_id)
-                    order_mapping[ancestor_id] = len(ancestors) - 1
-                    self.get_ordered_ancestry_internal(dynprompt, ancestor_id, ancestors, order_mapping)
+        try:
+            # NaN (e.g. from IS_CHANGED) and arbitrary objects must never be equal to anything.
+            canonical = json.dumps(signature, sort_keys=True, allow_nan=False)
+        except (TypeError, ValueError):
+            return Unhashable()
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
 
 class BasicCache:
     def __init__(self, key_class):
@@ -218,6 +236,9 @@ class BasicCache:
         else:
             return None
 
+    def record_execution_time(self, node_id, seconds):
+        pass
+
     def recursive_debug_dump(self):
         result = []
         for key in self.cache:
@@ -316,3 +337,280 @@ class LRUCache(BasicCache):
             self.children[cache_key].append(self.cache_key_set.get_data_key(child_id))
         return self
 
+
+MAX_SIZE_DEPTH = 16
+
+def _add_object_size(obj, sizes, seen, depth=0):
+    if isinstance(obj, torch.Tensor):
+        if obj.device.type == "meta":
+            return
+        storage = obj.untyped_storage()
+        # Views share their storage, only count it once.
+        storage_id = (obj.device, storage.data_ptr())
+        if storage_id in seen:
+            return
+        seen.add(storage_id)
+        sizes[0 if obj.device.type == "cpu" else 1] += storage.nbytes()
+        return
+    if isinstance(obj, (int, float, bool, str, bytes, type(None))):
+        sizes[0] += sys.getsizeof(obj)
+        return
+    if isinstance(obj, (types.ModuleType, type, types.FunctionType, types.MethodType)):
+        return
+    # Containers and other objects can be shared or reference each other.
+    if id(obj) in seen or depth > MAX_SIZE_DEPTH:
+        return
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        sizes[0] += obj.nbytes
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        sizes[0] += sys.getsizeof(obj)
+        for x in obj:
+            _add_object_size(x, sizes, seen, depth + 1)
+    elif isinstance(obj, dict):
+        sizes[0] += sys.getsizeof(obj)
+        for k, x in obj.items():
+            _add_object_size(k, sizes, seen, depth + 1)
+            _add_object_size(x, sizes, seen, depth + 1)
+    elif hasattr(obj, "model_size") and hasattr(obj, "loaded_size"):
+        # ModelPatcher: clones share the underlying model
+        if id(obj.model) in seen:
+            return
+        seen.add(id(obj.model))
+        total = obj.model_size()
+        loaded = obj.loaded_size() if obj.load_device.type != "cpu" else 0
+        sizes[0] += max(total - loaded, 0)
+        sizes[1] += loaded
+    elif hasattr(obj, "patcher"):
+        # CLIP, VAE and friends
+        _add_object_size(obj.patcher, sizes, seen, depth + 1)
+    else:
+        sizes[0] += sys.getsizeof(obj)
+        if hasattr(obj, "__dict__"):
+            _add_object_size(vars(obj), sizes, seen, depth + 1)
+
+def get_cache_entry_size(value):
+    """
+    Returns the (RAM bytes, VRAM bytes) held by a cached value. Storage shared between tensors or models is
+    only counted once. Models are split according to how much of their weights currently sit on their load device.
+    """
+    sizes = [0, 0]
+    _add_object_size(value, sizes, set())
+    return sizes[0], sizes[1]
+
+class MemoryBudget:
+    """
+    RAM and VRAM budget shared by the MemoryBudgetCaches of a CacheSet (outputs and ui), so together they stay
+    within it. Entries are evicted from whichever of the caches they save the least recompute time per byte in.
+    """
+    def __init__(self, ram_budget, vram_budget=None):
+        self.ram_budget = ram_budget
+        self.vram_budget = vram_budget
+        self.ram_used = 0
+        self.vram_used = 0
+        self.caches = []
+
+    def ram_over(self):
+        return self.ram_budget is not None and self.ram_used > self.ram_budget
+
+    def vram_over(self):
+        return self.vram_budget is not None and self.vram_used > self.vram_budget
+
+    def evict(self):
+        if not self.ram_over() and not self.vram_over():
+            return
+        # A node's entries in the different caches go together: its outputs without its ui would be a cache hit that
+        # shows nothing.
+        entries = {}
+        for cache in self.caches:
+            for cache_key in cache.cache:
+                entries.setdefault(cache_key, []).append(cache)
+        # Anything used by the current prompt may still be needed, never evict it.
+        candidates = [(cache_key, caches) for cache_key, caches in entries.items() if all(c.used_generation[cache_key] < c.generation for c in caches)]
+        candidates.sort(key=lambda x: self._benefit(*x))
+        for cache_key, caches in candidates:
+            ram = sum(c.sizes[cache_key][0] for c in caches)
+            vram = sum(c.sizes[cache_key][1] for c in caches)
+            if (self.ram_over() and ram > 0) or (self.vram_over() and vram > 0):
+                for cache in caches:
+                    cache._remove(cache_key)
+            if not self.ram_over() and not self.vram_over():
+                break
+
+    def _benefit(self, cache_key, caches):
+        freed = 0
+        for cache in caches:
+            ram, vram = cache.sizes[cache_key]
+            freed += (ram if self.ram_over() else 0) + (vram if self.vram_over() else 0)
+        age = min(c.generation - c.used_generation[cache_key] for c in caches)
+        execution_time = sum(c.execution_times.get(cache_key, 0.0) for c in caches)
+        return execution_time / (max(freed, 1) * age)
+
+class MemoryBudgetCache(LRUCache):
+    """
+    An LRUCache that is bounded by the memory its entries hold instead of their number. RAM and VRAM are
+    budgeted separately. Once over budget, entries not used by the current prompt are evicted starting with
+    the ones that save the least recompute time per byte, with older entries weighed down further.
+    """
+    def __init__(self, key_class, budget):
+        super().__init__(key_class, max_size=0)
+        self.budget = budget
+        budget.caches.append(self)
+        self.sizes = {}
+        self.execution_times = {}
+
+    def _update_size(self, cache_key):
+        old_ram, old_vram = self.sizes.get(cache_key, (0, 0))
+        ram, vram = get_cache_entry_size(self.cache[cache_key])
+        self.sizes[cache_key] = (ram, vram)
+        self.budget.ram_used += ram - old_ram
+        self.budget.vram_used += vram - old_vram
+
+    def _remove(self, cache_key):
+        ram, vram = self.sizes.pop(cache_key, (0, 0))
+        self.budget.ram_used -= ram
+        self.budget.vram_used -= vram
+        del self.cache[cache_key]
+        del self.used_generation[cache_key]
+        self.execution_times.pop(cache_key, None)
+        self.children.pop(cache_key, None)
+
+    def clean_unused(self):
+        # Models may have been moved between RAM and VRAM since they were cached.
+        for cache_key in self.cache:
+            self._update_size(cache_key)
+        self.budget.evict()
+        self._clean_subcaches()
+
+    def set(self, node_id, value):
+        super().set(node_id, value)
+        cache_key = self.cache_key_set.get_data_key(node_id)
+        self.execution_times.pop(cache_key, None)
+        self._update_size(cache_key)
+        self.budget.evict()
+
+    def record_execution_time(self, node_id, seconds):
+        cache_key = self.cache_key_set.get_data_key(node_id)
+        if cache_key in self.cache:
+            self.execution_times[cache_key] = seconds
+
+class DiskTieredCache:
+    """
+    Puts a persistent DiskCacheStore behind an in-memory output cache. Misses in memory fall back to the
+    disk store (and are promoted back into memory), and every new output is written through to disk so it
+    survives PromptExecutor.reset() and server restarts.
+
+    Input signatures only cover widget values, so the disk key also covers what can change between runs without
+    them changing: the model files named by the node and its ancestors (size and mtime) and the code of their classes.
+    Writes happen in the background.
+    """
+    def __init__(self, cache, store):
+        self.cache = cache
+        self.store = store
+        self.dependency_keys = {}
+        self.model_file_stats = {}
+
+    def set_prompt(self, dynprompt, node_ids, is_changed_cache):
+        self.cache.set_prompt(dynprompt, node_ids, is_changed_cache)
+        # Model files can be replaced between prompts.
+        self.dependency_keys = {}
+        self.model_file_stats = {}
+
+    def clean_unused(self):
+        self.cache.clean_unused()
+
+    def all_node_ids(self):
+        return self.cache.all_node_ids()
+
+    def ensure_subcache_for(self, node_id, children_ids):
+        return self.cache.ensure_subcache_for(node_id, children_ids)
+
+    def record_execution_time(self, node_id, seconds):
+        self.cache.record_execution_time(node_id, seconds)
+
+    def recursive_debug_dump(self):
+        return self.cache.recursive_debug_dump()
+
+    def _get_disk_key(self, node_id):
+        dynprompt = self.cache.dynprompt
+        if not dynprompt.has_node(node_id):
+            return None
+        class_def = nodes.NODE_CLASS_MAPPINGS[dynprompt.get_node(node_id)["class_type"]]
+        if getattr(class_def, "OUTPUT_NODE", False):
+            # Output nodes are run for their side effects and UI, which the disk tier doesn't keep.
+            return None
+        cache = self.cache
+        if isinstance(cache, HierarchicalCache):
+            cache = cache._get_cache_for(node_id)
+            if cache is None:
+                return None
+        signature = cache.cache_key_set.get_data_key(node_id)
+        # Input signatures are process-stable digests, anything else (Unhashable) can never hit.
+        if not isinstance(signature, str):
+            return None
+        dependencies = self._get_dependency_key(dynprompt, node_id)
+        return hashlib.sha256(json.dumps([signature, dependencies]).encode("utf-8")).hexdigest()
+
+    def _get_linked_ancestors(self, dynprompt, node_id):
+        inputs = dynprompt.get_node(node_id)["inputs"]
+        return [inputs[key][0] for key in sorted(inputs.keys()) if is_link(inputs[key]) and dynprompt.has_node(inputs[key][0])]
+
+    # Merkle style like the input signatures, and iterative for the same reason.
+    def _get_dependency_key(self, dynprompt, node_id):
+        stack = [node_id]
+        visiting = set()
+        while len(stack) > 0:
+            current_id = stack[-1]
+            if current_id in self.dependency_keys:
+                stack.pop()
+                continue
+            ancestors = self._get_linked_ancestors(dynprompt, current_id)
+            if current_id not in visiting:
+                visiting.add(current_id)
+                pending = [x for x in ancestors if x not in self.dependency_keys and x not in visiting]
+                if len(pending) > 0:
+                    stack.extend(pending)
+                    continue
+            stack.pop()
+            node = dynprompt.get_node(current_id)
+            key = [get_node_code_version(nodes.NODE_CLASS_MAPPINGS[node["class_type"]])]
+            for name, value in sorted(node["inputs"].items()):
+                if isinstance(value, str) and os.path.splitext(value)[1].lower() in folder_paths.supported_pt_extensions:
+                    key.append([name, self._get_model_file_stats(value)])
+            key.extend(self.dependency_keys.get(x) for x in ancestors)
+            self.dependency_keys[current_id] = hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()
+        return self.dependency_keys[node_id]
+
+    def _get_model_file_stats(self, filename):
+        # Which folder a loader reads from isn't known here, so every model folder with such a file counts.
+        if filename not in self.model_file_stats:
+            stats = []
+            for folder_name in sorted(folder_paths.folder_names_and_paths.keys()):
+                path = folder_paths.get_full_path(folder_name, filename)
+                if path is None:
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                stats.append([folder_name, st.st_size, st.st_mtime_ns])
+            self.model_file_stats[filename] = stats
+        return self.model_file_stats[filename]
+
+    def get(self, node_id):
+        value = self.cache.get(node_id)
+        if value is not None:
+            return value
+        key = self._get_disk_key(node_id)
+        if key is None or key not in self.store:
+            return None
+        value = self.store.get(key)
+        if value is not None:
+            self.cache.set(node_id, value)
+        return value
+
+    def set(self, node_id, value):
+        self.cache.set(node_id, value)
+        key = self._get_disk_key(node_id)
+        if key is not None:
+            self.store.set_async(key, value)
@@ -0,0 +1,196 @@
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+import safetensors.torch
+from safetensors import safe_open
+
+# Bump this whenever the on-disk layout changes so stale entries are ignored.
+DISK_CACHE_FORMAT = "1"
+DISK_CACHE_EXTENSION = ".safetensors"
+
+class NotSerializableError(Exception):
+    pass
+
+def _pack(obj, tensors):
+    # Only exact builtin containers are accepted so that we never silently turn a
+    # NamedTuple or a dict subclass into something the consumer doesn't expect.
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, torch.Tensor):
+        name = str(len(tensors))
+        tensors[name] = obj.detach().to("cpu").contiguous().clone()
+        return {"type": "tensor", "name": name}
+    if type(obj) is list:
+        return {"type": "list", "items": [_pack(x, tensors) for x in obj]}
+    if type(obj) is tuple:
+        return {"type": "tuple", "items": [_pack(x, tensors) for x in obj]}
+    if type(obj) is dict:
+        return {"type": "dict", "items": [[_pack(k, tensors), _pack(v, tensors)] for k, v in obj.items()]}
+    raise NotSerializableError(f"Can't store objects of type {type(obj).__name__} in the disk cache")
+
+def _unpack(obj, tensors):
+    if not isinstance(obj, dict):
+        return obj
+    obj_type = obj["type"]
+    if obj_type == "tensor":
+        return tensors(obj["name"])
+    if obj_type == "list":
+        return [_unpack(x, tensors) for x in obj["items"]]
+    if obj_type == "tuple":
+        return tuple(_unpack(x, tensors) for x in obj["items"])
+    if obj_type == "dict":
+        return {_unpack(k, tensors): _unpack(v, tensors) for k, v in obj["items"]}
+    raise ValueError(f"Unknown disk cache entry type {obj_type}")
+
+def serialize_value(value):
+    """
+    Splits a node output into a JSON structure and a dict of tensors suitable for safetensors.
+    Raises NotSerializableError for outputs holding anything other than tensors, primitives and
+    builtin containers (models, CLIP objects, etc. -- those are cheap to reload from their files anyway).
+    """
+    tensors = {}
+    structure = _pack(value, tensors)
+    return json.dumps(structure), tensors
+
+def deserialize_value(structure, get_tensor):
+    return _unpack(json.loads(structure), get_tensor)
+
+class DiskCacheStore:
+    """
+    A size-bounded, LRU evicted store of node outputs on disk. Each entry is a single safetensors
+    file named after the node's disk key (see DiskTieredCache), so tensors are memory mapped when read
+    back and entries survive a restart of the server.
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        self.entries = OrderedDict() # key -> size in bytes, least recently used first
+        self.total_bytes = 0
+        # keys being written by set_async
+        self.pending = set()
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk_cache")
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + DISK_CACHE_EXTENSION)
+
+    def _scan(self):
+        found = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(DISK_CACHE_EXTENSION):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, filename))
+            except OSError:
+                continue
+            found.append((stat.st_mtime, filename[:-len(DISK_CACHE_EXTENSION)], stat.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.total_bytes += size
+        logging.info("Disk cache: {} entries ({:.1f} MB) in {}".format(len(self.entries), self.total_bytes / (1024 * 1024), self.directory))
+        self.evict()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            path = self._path(key)
+            try:
+                with safe_open(path, framework="pt", device="cpu") as f:
+                    metadata = f.metadata() or {}
+                    if metadata.get("format") != DISK_CACHE_FORMAT:
+                        raise ValueError("format mismatch")
+                    value = deserialize_value(metadata["structure"], f.get_tensor)
+            except Exception as e:
+                logging.warning("Disk cache: dropping unreadable entry {}: {}".format(path, e))
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            try:
+                # The mtime is the LRU order used when the index is rebuilt on startup.
+                os.utime(path)
+            except OSError:
+                pass
+            return value
+
+    def set(self, key, value):
+        try:
+            structure, tensors = serialize_value(value)
+        except NotSerializableError:
+            return False
+        if len(tensors) == 0:
+            # Nothing expensive to recompute, not worth a file.
+            return False
+
+        path = self._path(key)
+        temp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        try:
+            safetensors.torch.save_file(tensors, temp_path, metadata={"format": DISK_CACHE_FORMAT, "structure": structure})
+            os.replace(temp_path, path)
+            size = os.path.getsize(path)
+        except Exception as e:
+            logging.warning("Disk cache: failed to write {}: {}".format(path, e))
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+
+        with self.lock:
+            self.total_bytes -= self.entries.pop(key, 0)
+            self.entries[key] = size
+            self.total_bytes += size
+            self.evict()
+        return True
+
+    def set_async(self, key, value):
+        """
+        set() on the store's writer thread, unless the key is stored or being written already: copying the tensors
+        to the CPU and writing them shouldn't hold up the prompt. Node outputs aren't modified once returned, so the
+        value can be read later.
+        """
+        with self.lock:
+            if key in self.entries or key in self.pending:
+                return
+            self.pending.add(key)
+        self.writer.submit(self._write, key, value)
+
+    def _write(self, key, value):
+        try:
+            self.set(key, value)
+        except Exception as e:
+            logging.warning("Disk cache: failed to store {}: {}".format(key, e))
+        finally:
+            with self.lock:
+                self.pending.discard(key)
+
+    def flush(self):
+        """Waits for the writes started by set_async so far."""
+        self.writer.submit(lambda: None).result()
+
+    def _remove(self, key):
+        self.total_bytes -= self.entries.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        with self.lock:
+            while self.total_bytes > self.max_bytes and len(self.entries) > 0:
+                key = next(iter(self.entries))
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries.keys()):
+                self._remove(key)
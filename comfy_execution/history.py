@@ -0,0 +1,82 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    prompt_id TEXT NOT NULL UNIQUE,
+    completed_at REAL NOT NULL,
+    status TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_completed_at ON history (completed_at);
+CREATE INDEX IF NOT EXISTS history_status ON history (status, completed_at);
+"""
+
+class HistoryStore:
+    """
+    Prompt history kept in a SQLite database so it survives restarts without being held in RAM.
+    Entries are stored as JSON; the prompt queue keeps the most recent ones in memory as well.
+    """
+    def __init__(self, path, max_items):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.max_items = max_items
+        self.mutex = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(HISTORY_SCHEMA)
+        self.connection.commit()
+
+    def add(self, prompt_id, entry):
+        try:
+            data = json.dumps(entry)
+        except (TypeError, ValueError) as e:
+            logging.warning("Not saving the history of prompt {} to the database: {}".format(prompt_id, e))
+            return False
+        status = entry.get("status") or {}
+        with self.mutex:
+            self.connection.execute("INSERT OR REPLACE INTO history (prompt_id, completed_at, status, data) VALUES (?, ?, ?, ?)",
+                                    (prompt_id, time.time(), status.get("status_str", None), data))
+            # Drop the oldest entries past the limit.
+            self.connection.execute("DELETE FROM history WHERE id <= (SELECT id FROM history ORDER BY id DESC LIMIT 1 OFFSET ?)", (self.max_items,))
+            self.connection.commit()
+        return True
+
+    def get(self, prompt_id):
+        with self.mutex:
+            row = self.connection.execute("SELECT data FROM history WHERE prompt_id = ?", (prompt_id,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def count(self, status=None):
+        with self.mutex:
+            if status is None:
+                return self.connection.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+            return self.connection.execute("SELECT COUNT(*) FROM history WHERE status = ?", (status,)).fetchone()[0]
+
+    def page(self, offset=0, max_items=None, status=None):
+        """Returns {prompt_id: entry} for max_items entries from offset, oldest first."""
+        limit = -1 if max_items is None else max_items
+        with self.mutex:
+            if status is None:
+                rows = self.connection.execute("SELECT prompt_id, data FROM history ORDER BY completed_at, id LIMIT ? OFFSET ?", (limit, offset)).fetchall()
+            else:
+                rows = self.connection.execute("SELECT prompt_id, data FROM history WHERE status = ? ORDER BY completed_at, id LIMIT ? OFFSET ?", (status, limit, offset)).fetchall()
+        return {prompt_id: json.loads(data) for prompt_id, data in rows}
+
+    def delete(self, prompt_id):
+        with self.mutex:
+            self.connection.execute("DELETE FROM history WHERE prompt_id = ?", (prompt_id,))
+            self.connection.commit()
+
+    def clear(self):
+        with self.mutex:
+            self.connection.execute("DELETE FROM history")
+            self.connection.commit()
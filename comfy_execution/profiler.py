@@ -0,0 +1,98 @@
+import os
+import json
+import time
+import logging
+
+import psutil
+import comfy.model_management
+from comfy.memory_estimates import PeakMemoryScope
+from comfy_execution.caching import get_cache_entry_size
+
+class ExecutionProfiler:
+    """
+    Records, for every node execution of a prompt, wall and CPU time, the change in process RAM, the peak VRAM
+    allocated on top of what was in use before, whether the result came from the cache and how big it is.
+
+    The peak is measured with a PeakMemoryScope, so it also counts what other prompt workers allocate on the device
+    while the node runs.
+    """
+    def __init__(self, prompt_id):
+        self.prompt_id = prompt_id
+        self.start_time = time.perf_counter()
+        self.process = psutil.Process()
+        self.device = comfy.model_management.get_torch_device()
+        self.track_vram = self.device.type == "cuda"
+        self.nodes = {}
+        self.events = []
+        self.current = None
+
+    def start_node(self, node_id):
+        vram_scope = None
+        if self.track_vram:
+            vram_scope = PeakMemoryScope(self.device)
+            vram_scope.start()
+        self.current = (node_id, time.perf_counter(), time.thread_time(), self.process.memory_info().rss, vram_scope)
+
+    def end_node(self, node_id, class_type, cached, outputs):
+        _, wall_start, cpu_start, ram_start, vram_scope = self.current
+        self.current = None
+        wall_end = time.perf_counter()
+        event = {
+            "node_id": node_id,
+            "class_type": class_type,
+            "cached": cached,
+            "start": wall_start - self.start_time,
+            "wall_time": wall_end - wall_start,
+            "cpu_time": time.thread_time() - cpu_start,
+            "ram_delta": self.process.memory_info().rss - ram_start,
+            "vram_peak_delta": 0,
+            "output_ram": 0,
+            "output_vram": 0,
+        }
+        if vram_scope is not None:
+            event["vram_peak_delta"] = vram_scope.stop()
+        if outputs is not None:
+            event["output_ram"], event["output_vram"] = get_cache_entry_size(outputs)
+        self.events.append(event)
+
+        # A node returning PENDING (lazy inputs, subgraph expansion) runs several times, sum them up.
+        node = self.nodes.get(node_id, None)
+        if node is None:
+            self.nodes[node_id] = dict(event)
+            del self.nodes[node_id]["start"]
+        else:
+            for key in ("wall_time", "cpu_time", "ram_delta"):
+                node[key] += event[key]
+            for key in ("vram_peak_delta", "output_ram", "output_vram"):
+                node[key] = max(node[key], event[key])
+            node["cached"] = node["cached"] and cached
+
+    def get_profile(self):
+        return {
+            "total_time": time.perf_counter() - self.start_time,
+            "nodes": self.nodes,
+        }
+
+    def get_chrome_trace(self):
+        trace_events = []
+        for event in self.events:
+            trace_events.append({
+                "name": event["class_type"],
+                "cat": "cached" if event["cached"] else "executed",
+                "ph": "X",
+                "ts": event["start"] * 1e6,
+                "dur": event["wall_time"] * 1e6,
+                "pid": 0,
+                "tid": 0,
+                "args": {k: v for k, v in event.items() if k not in ("class_type", "start", "wall_time")},
+            })
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms", "otherData": {"prompt_id": self.prompt_id}}
+
+    def save_chrome_trace(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "{}.json".format(self.prompt_id))
+        try:
+            with open(path, "w") as f:
+                json.dump(self.get_chrome_trace(), f)
+        except OSError as e:
+            logging.warning("Failed to write execution trace {}: {}".format(path, e))
@@ -1,13 +1,14 @@
 import torchaudio
 import torch
 import comfy.model_management
+import comfy.file_digests
+import comfy.output_writer
 import folder_paths
 import os
 import io
 import json
 import struct
 import random
-import hashlib
 from comfy.cli_args import args
 
 class EmptyLatentAudio:
@@ -156,13 +157,7 @@ class SaveAudio:
             filename_with_batch_num = filename.replace("%batch_num%", str(batch_number))
             file = f"{filename_with_batch_num}_{counter:05}_.flac"
 
-            buff = io.BytesIO()
-            torchaudio.save(buff, waveform, audio["sample_rate"], format="FLAC")
-
-            buff = insert_or_replace_vorbis_comment(buff, metadata)
-
-            with open(os.path.join(full_output_folder, file), 'wb') as f:
-                f.write(buff.getbuffer())
+            comfy.output_writer.output_writer.write(os.path.join(full_output_folder, file), self.save_flac, waveform, audio["sample_rate"], metadata)
 
             results.append({
                 "filename": file,
@@ -173,6 +168,14 @@ class SaveAudio:
 
         return { "ui": { "audio": results } }
 
+    @staticmethod
+    def save_flac(f, waveform, sample_rate, metadata):
+        buff = io.BytesIO()
+        torchaudio.save(buff, waveform, sample_rate, format="FLAC")
+
+        buff = insert_or_replace_vorbis_comment(buff, metadata)
+        f.write(buff.getbuffer())
+
 class PreviewAudio(SaveAudio):
     def __init__(self):
         self.output_dir = folder_paths.get_temp_directory()
@@ -207,10 +210,7 @@ class LoadAudio:
     @classmethod
     def IS_CHANGED(s, audio):
         image_path = folder_paths.get_annotated_filepath(audio)
-        m = hashlib.sha256()
-        with open(image_path, 'rb') as f:
-            m.update(f.read())
-        return m.digest().hex()
+        return comfy.file_digests.file_digest(image_path)
 
     @classmethod
     def VALIDATE_INPUTS(s, audio):
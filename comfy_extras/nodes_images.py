@@ -1,5 +1,6 @@
 import nodes
 import folder_paths
+import comfy.output_writer
 from comfy.cli_args import args
 
 from PIL import Image
@@ -67,6 +68,10 @@ class ImageFromBatch:
         s = s_in[batch_index:batch_index + length].clone()
         return (s,)
 
+def to_pil_images(images):
+    i = 255. * images.numpy()
+    return [Image.fromarray(x) for x in np.clip(i, 0, 255).astype(np.uint8)]
+
 class SaveAnimatedWEBP:
     def __init__(self):
         self.output_dir = folder_paths.get_output_directory()
@@ -100,13 +105,9 @@ class SaveAnimatedWEBP:
         filename_prefix += self.prefix_append
         full_output_folder, filename, counter, subfolder, filename_prefix = folder_paths.get_save_image_path(filename_prefix, self.output_dir, images[0].shape[1], images[0].shape[0])
         results = list()
-        pil_images = []
-        for image in images:
-            i = 255. * image.cpu().numpy()
-            img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
-            pil_images.append(img)
+        images = images.cpu()
 
-        metadata = pil_images[0].getexif()
+        metadata = Image.Exif()
         if not args.disable_metadata:
             if prompt is not None:
                 metadata[0x0110] = "prompt:{}".format(json.dumps(prompt))
@@ -117,12 +118,12 @@ class SaveAnimatedWEBP:
                     inital_exif -= 1
 
         if num_frames == 0:
-            num_frames = len(pil_images)
+            num_frames = len(images)
 
-        c = len(pil_images)
+        c = len(images)
         for i in range(0, c, num_frames):
             file = f"{filename}_{counter:05}_.webp"
-            pil_images[i].save(os.path.join(full_output_folder, file), save_all=True, duration=int(1000.0/fps), append_images=pil_images[i + 1:i + num_frames], exif=metadata, lossless=lossless, quality=quality, method=method)
+            comfy.output_writer.output_writer.write(os.path.join(full_output_folder, file), self.save_webp, images[i:i + num_frames], metadata, fps, lossless, quality, method)
             results.append({
                 "filename": file,
                 "subfolder": subfolder,
@@ -133,6 +134,11 @@ class SaveAnimatedWEBP:
         animated = num_frames != 1
         return { "ui": { "images": results, "animated": (animated,) } }
 
+    @staticmethod
+    def save_webp(f, images, metadata, fps, lossless, quality, method):
+        pil_images = to_pil_images(images)
+        pil_images[0].save(f, format="WEBP", save_all=True, duration=int(1000.0/fps), append_images=pil_images[1:], exif=metadata, lossless=lossless, quality=quality, method=method)
+
 class SaveAnimatedPNG:
     def __init__(self):
         self.output_dir = folder_paths.get_output_directory()
@@ -161,11 +167,6 @@ class SaveAnimatedPNG:
         filename_prefix += self.prefix_append
         full_output_folder, filename, counter, subfolder, filename_prefix = folder_paths.get_save_image_path(filename_prefix, self.output_dir, images[0].shape[1], images[0].shape[0])
         results = list()
-        pil_images = []
-        for image in images:
-            i = 255. * image.cpu().numpy()
-            img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
-            pil_images.append(img)
 
         metadata = None
         if not args.disable_metadata:
@@ -177,7 +178,7 @@ class SaveAnimatedPNG:
                     metadata.add(b"comf", x.encode("latin-1", "strict") + b"\0" + json.dumps(extra_pnginfo[x]).encode("latin-1", "strict"), after_idat=True)
 
         file = f"{filename}_{counter:05}_.png"
-        pil_images[0].save(os.path.join(full_output_folder, file), pnginfo=metadata, compress_level=compress_level, save_all=True, duration=int(1000.0/fps), append_images=pil_images[1:])
+        comfy.output_writer.output_writer.write(os.path.join(full_output_folder, file), self.save_apng, images.cpu(), metadata, fps, compress_level)
         results.append({
             "filename": file,
             "subfolder": subfolder,
@@ -186,6 +187,11 @@ class SaveAnimatedPNG:
 
         return { "ui": { "images": results, "animated": (True,)} }
 
+    @staticmethod
+    def save_apng(f, images, metadata, fps, compress_level):
+        pil_images = to_pil_images(images)
+        pil_images[0].save(f, format="PNG", pnginfo=metadata, compress_level=compress_level, save_all=True, duration=int(1000.0/fps), append_images=pil_images[1:])
+
 NODE_CLASS_MAPPINGS = {
     "ImageCrop": ImageCrop,
     "RepeatImageBatch": RepeatImageBatch,
@@ -1,21 +1,32 @@
+import os
 import sys
 import copy
 import logging
 import threading
+import contextvars
 import heapq
+import itertools
 import time
 import traceback
 from enum import Enum
 import inspect
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import List, Literal, NamedTuple, Optional
 
 import torch
 import nodes
+import latent_preview
 
+import folder_paths
 import comfy.model_management
+import comfy.metrics
+import comfy.utils
+from comfy.cli_args import args
 from comfy_execution.graph import get_input_info, ExecutionList, DynamicPrompt, ExecutionBlocker
 from comfy_execution.graph_utils import is_link, GraphBuilder
-from comfy_execution.caching import HierarchicalCache, LRUCache, CacheKeySetInputSignature, CacheKeySetID
+from comfy_execution.caching import HierarchicalCache, LRUCache, MemoryBudget, MemoryBudgetCache, DiskTieredCache, CacheKeySetInputSignature, CacheKeySetID
+from comfy_execution.profiler import ExecutionProfiler
+from comfy_execution.batching import find_sampler, get_batch_key, get_job_key, sample_batch
 from comfy_execution.validation import validate_node_input
 
 class ExecutionResult(Enum):
@@ -60,11 +71,15 @@ class IsChangedCache:
         return self.is_changed[node_id]
 
 class CacheSet:
-    def __init__(self, lru_size=None):
-        if lru_size is None or lru_size == 0:
+    def __init__(self, lru_size=None, disk_store=None, ram_budget=None, vram_budget=None):
+        if ram_budget is not None:
+            self.init_memory_budget_cache(ram_budget, vram_budget)
+        elif lru_size is None or lru_size == 0:
             self.init_classic_cache() 
         else:
             self.init_lru_cache(lru_size)
+        if disk_store is not None:
+            self.outputs = DiskTieredCache(self.outputs, disk_store)
         self.all = [self.outputs, self.ui, self.objects]
 
     # Useful for those with ample RAM/VRAM -- allows experimenting without
@@ -74,6 +89,13 @@ class CacheSet:
         self.ui = LRUCache(CacheKeySetInputSignature, max_size=cache_size)
         self.objects = HierarchicalCache(CacheKeySetID)
 
+    # Like the LRU cache, but bounded by the bytes the cached results hold, outputs and ui together
+    def init_memory_budget_cache(self, ram_budget, vram_budget):
+        budget = MemoryBudget(ram_budget, vram_budget)
+        self.outputs = MemoryBudgetCache(CacheKeySetInputSignature, budget)
+        self.ui = MemoryBudgetCache(CacheKeySetInputSignature, budget)
+        self.objects = HierarchicalCache(CacheKeySetID)
+
     # Performs like the old cache -- dump data ASAP
     def init_classic_cache(self):
         self.outputs = HierarchicalCache(CacheKeySetInputSignature)
@@ -241,7 +263,39 @@ def format_value(x):
     else:
         return str(x)
 
-def execute(server, dynprompt, caches, current_item, extra_data, executed, prompt_id, execution_list, pending_subgraph_results):
+def block_execution(server, prompt_id, unique_id, class_type, executed, block):
+    if block.message is not None:
+        mes = {
+            "prompt_id": prompt_id,
+            "node_id": unique_id,
+            "node_type": class_type,
+            "executed": list(executed),
+
+            "exception_message": f"Execution Blocked: {block.message}",
+            "exception_type": "ExecutionBlocked",
+            "traceback": [],
+            "current_inputs": [],
+            "current_outputs": [],
+        }
+        server.send_sync("execution_error", mes, server.client_id)
+        return ExecutionBlocker(None)
+    else:
+        return block
+
+def is_thread_safe(class_def):
+    # Nodes opt in with THREAD_SAFE = True. Lazy nodes are left out since they may ask for more inputs first.
+    return getattr(class_def, "THREAD_SAFE", False) == True and not hasattr(class_def, "check_lazy_status")
+
+def get_output_data_in_thread(obj, input_data_all, device, execution_block_cb):
+    comfy.model_management.set_thread_torch_device(device)
+    # inference_mode is thread local. The GraphBuilder prefix is global so it isn't set here, thread safe nodes
+    # shouldn't expand into subgraphs.
+    with torch.inference_mode():
+        execution_start_time = time.perf_counter()
+        output_data, output_ui, has_subgraph = get_output_data(obj, input_data_all, execution_block_cb=execution_block_cb)
+        return output_data, output_ui, has_subgraph, time.perf_counter() - execution_start_time
+
+def execute(server, dynprompt, caches, current_item, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, node_futures=None):
     unique_id = current_item
     real_node_id = dynprompt.get_real_node_id(unique_id)
     display_node_id = dynprompt.get_display_node_id(unique_id)
@@ -278,8 +332,15 @@ def execute(server, dynprompt, caches, current_item, extra_data, executed, promp
             output_data = merge_result_data(resolved_outputs, class_def)
             output_ui = []
             has_subgraph = False
+            execution_time = None
         else:
-            input_data_all, missing_keys = get_input_data(inputs, class_def, unique_id, caches.outputs, dynprompt, extra_data)
+            future = None
+            if node_futures is not None and unique_id in node_futures:
+                # Started in the pool with all its inputs resolved, see PromptExecutor.start_parallel_nodes.
+                input_data_all, future = node_futures.pop(unique_id)
+                missing_keys = {}
+            else:
+                input_data_all, missing_keys = get_input_data(inputs, class_def, unique_id, caches.outputs, dynprompt, extra_data)
             if server.client_id is not None:
                 server.last_node_id = display_node_id
                 server.send_sync("executing", { "node": unique_id, "display_node": display_node_id, "prompt_id": prompt_id }, server.client_id)
@@ -301,26 +362,15 @@ def execute(server, dynprompt, caches, current_item, extra_data, executed, promp
                     return (ExecutionResult.PENDING, None, None)
 
             def execution_block_cb(block):
-                if block.message is not None:
-                    mes = {
-                        "prompt_id": prompt_id,
-                        "node_id": unique_id,
-                        "node_type": class_type,
-                        "executed": list(executed),
-
-                        "exception_message": f"Execution Blocked: {block.message}",
-                        "exception_type": "ExecutionBlocked",
-                        "traceback": [],
-                        "current_inputs": [],
-                        "current_outputs": [],
-                    }
-                    server.send_sync("execution_error", mes, server.client_id)
-                    return ExecutionBlocker(None)
-                else:
-                    return block
+                return block_execution(server, prompt_id, unique_id, class_type, executed, block)
             def pre_execute_cb(call_index):
                 GraphBuilder.set_default_prefix(unique_id, call_index, 0)
-            output_data, output_ui, has_subgraph = get_output_data(obj, input_data_all, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb)
+            if future is not None:
+                output_data, output_ui, has_subgraph, execution_time = future.result()
+            else:
+                execution_start_time = time.perf_counter()
+                output_data, output_ui, has_subgraph = get_output_data(obj, input_data_all, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb)
+                execution_time = time.perf_counter() - execution_start_time
         if len(output_ui) > 0:
             caches.ui.set(unique_id, {
                 "meta": {
@@ -371,6 +421,8 @@ def execute(server, dynprompt, caches, current_item, extra_data, executed, promp
             pending_subgraph_results[unique_id] = cached_outputs
             return (ExecutionResult.PENDING, None, None)
         caches.outputs.set(unique_id, output_data)
+        if execution_time is not None:
+            caches.outputs.record_execution_time(unique_id, execution_time)
     except comfy.model_management.InterruptProcessingException as iex:
         logging.info("Processing interrupted")
 
@@ -410,13 +462,23 @@ def execute(server, dynprompt, caches, current_item, extra_data, executed, promp
     return (ExecutionResult.SUCCESS, None, None)
 
 class PromptExecutor:
-    def __init__(self, server, lru_size=None):
+    def __init__(self, server, lru_size=None, disk_store=None, ram_cache_size=None, vram_cache_size=None, profile=False, trace_dir=None, parallel_nodes=0):
         self.lru_size = lru_size
+        self.node_pool = None
+        if parallel_nodes > 0:
+            self.node_pool = ThreadPoolExecutor(max_workers=parallel_nodes, thread_name_prefix="node")
+        self.profile = profile or trace_dir is not None
+        self.trace_dir = trace_dir
+        self.ram_cache_size = ram_cache_size
+        self.vram_cache_size = vram_cache_size
         self.server = server
+        # The disk store outlives reset() on purpose: that's the whole point of persisting outputs. It's shared by the
+        # executors of all the prompt workers.
+        self.disk_store = disk_store
         self.reset()
 
     def reset(self):
-        self.caches = CacheSet(self.lru_size)
+        self.caches = CacheSet(self.lru_size, self.disk_store, self.ram_cache_size, self.vram_cache_size)
         self.status_messages = []
         self.success = True
 
@@ -457,8 +519,40 @@ class PromptExecutor:
             }
             self.add_message("execution_error", mes, broadcast=False)
 
-    def execute(self, prompt, prompt_id, extra_data={}, execute_outputs=[]):
-        nodes.interrupt_processing(False)
+    def start_parallel_nodes(self, dynamic_prompt, execution_list, staged_node_id, extra_data, executed, prompt_id, pending_subgraph_results, node_futures):
+        # Start computing the outputs of ready thread safe nodes in the pool. Everything else about their execution
+        # (caching, messages, errors) still happens in order on this thread when execute() reaches them.
+        device = comfy.model_management.get_torch_device()
+        for node_id in execution_list.get_ready_nodes():
+            if node_id == staged_node_id or node_id in node_futures or node_id in pending_subgraph_results:
+                continue
+            class_type = dynamic_prompt.get_node(node_id)["class_type"]
+            class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
+            if not is_thread_safe(class_def) or self.caches.outputs.get(node_id) is not None:
+                continue
+            input_data_all, missing_keys = get_input_data(dynamic_prompt.get_node(node_id)["inputs"], class_def, node_id, self.caches.outputs, dynamic_prompt, extra_data)
+            if len(missing_keys) > 0:
+                continue
+            obj = self.caches.objects.get(node_id)
+            if obj is None:
+                obj = class_def()
+                self.caches.objects.set(node_id, obj)
+            def execution_block_cb(block, node_id=node_id, class_type=class_type):
+                return block_execution(self.server, prompt_id, node_id, class_type, executed, block)
+            # Run in a copy of the context so the node sees the current prompt (interrupts) and worker state.
+            context = contextvars.copy_context()
+            node_futures[node_id] = (input_data_all, self.node_pool.submit(context.run, get_output_data_in_thread, obj, input_data_all, device, execution_block_cb))
+
+    def execute(self, prompt, prompt_id, extra_data={}, execute_outputs=[], injected_outputs=None, pre_run=False):
+        """
+        Executes execute_outputs of the prompt. pre_run executes part of a prompt ahead of the prompt itself (see
+        sample_batched), without counting it in the metrics and the profile.
+        """
+        # Only this prompt's flag: the global one would drop interrupts meant for the other workers' prompts. After a
+        # pre-run (injected_outputs), an interrupt received since must still stop the prompt.
+        if injected_outputs is None:
+            nodes.interrupt_processing(False, prompt_id)
+        comfy.model_management.set_current_prompt(prompt_id)
 
         if "client_id" in extra_data:
             self.server.client_id = extra_data["client_id"]
@@ -467,6 +561,8 @@ class PromptExecutor:
 
         self.status_messages = []
         self.add_message("execution_start", { "prompt_id": prompt_id}, broadcast=False)
+        execution_start_time = time.perf_counter()
+        profiler = ExecutionProfiler(prompt_id) if self.profile and not pre_run else None
 
         with torch.inference_mode():
             dynamic_prompt = DynamicPrompt(prompt)
@@ -474,6 +570,10 @@ class PromptExecutor:
             for cache in self.caches.all:
                 cache.set_prompt(dynamic_prompt, prompt.keys(), is_changed_cache)
                 cache.clean_unused()
+            if injected_outputs is not None:
+                # Outputs already computed together with other prompts, see sample_batched.
+                for node_id, output in injected_outputs.items():
+                    self.caches.outputs.set(node_id, output)
 
             cached_nodes = []
             for node_id in prompt:
@@ -485,6 +585,8 @@ class PromptExecutor:
                           { "nodes": cached_nodes, "prompt_id": prompt_id},
                           broadcast=False)
             pending_subgraph_results = {}
+            # node id -> (input data, future) of the nodes started in the pool
+            node_futures = {}
             executed = set()
             execution_list = ExecutionList(dynamic_prompt, self.caches.outputs)
             current_outputs = self.caches.outputs.all_node_ids()
@@ -497,7 +599,17 @@ class PromptExecutor:
                     self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
                     break
 
-                result, error, ex = execute(self.server, dynamic_prompt, self.caches, node_id, extra_data, executed, prompt_id, execution_list, pending_subgraph_results)
+                if self.node_pool is not None:
+                    self.start_parallel_nodes(dynamic_prompt, execution_list, node_id, extra_data, executed, prompt_id, pending_subgraph_results, node_futures)
+                if profiler is not None:
+                    profiler.start_node(node_id)
+                result, error, ex = execute(self.server, dynamic_prompt, self.caches, node_id, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, node_futures)
+                cached = result == ExecutionResult.SUCCESS and node_id not in executed
+                if result == ExecutionResult.SUCCESS and not pre_run:
+                    comfy.metrics.node_executions_total.inc(cached="true" if cached else "false")
+                if profiler is not None:
+                    outputs = self.caches.outputs.get(node_id) if result == ExecutionResult.SUCCESS else None
+                    profiler.end_node(node_id, dynamic_prompt.get_node(node_id)["class_type"], cached, outputs)
                 self.success = result != ExecutionResult.FAILURE
                 if result == ExecutionResult.FAILURE:
                     self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
@@ -510,6 +622,12 @@ class PromptExecutor:
                 # Only execute when the while-loop ends without break
                 self.add_message("execution_success", { "prompt_id": prompt_id }, broadcast=False)
 
+            # After an error, don't let nodes of this prompt still running in the pool overlap with the next one.
+            futures = [future for _, future in node_futures.values()]
+            for future in futures:
+                future.cancel()
+            wait(futures)
+
             ui_outputs = {}
             meta_outputs = {}
             all_node_ids = self.caches.ui.all_node_ids()
@@ -522,10 +640,121 @@ class PromptExecutor:
                 "outputs": ui_outputs,
                 "meta": meta_outputs,
             }
+            if profiler is not None:
+                profile = profiler.get_profile()
+                self.history_result["profile"] = profile
+                if self.server.client_id is not None:
+                    self.server.send_sync("execution_profile", { "prompt_id": prompt_id, **profile }, self.server.client_id)
+                if self.trace_dir is not None:
+                    profiler.save_chrome_trace(self.trace_dir)
             self.server.last_node_id = None
+            if not pre_run:
+                nodes.interrupt_processing(False, prompt_id)
+            comfy.model_management.set_current_prompt(None)
+            if not pre_run:
+                comfy.metrics.prompt_execution_seconds.observe(time.perf_counter() - execution_start_time)
             if comfy.model_management.DISABLE_SMART_MEMORY:
                 comfy.model_management.unload_all_models()
 
+    def sample_batched(self, items):
+        """
+        Samples the KSampler of queue items with the same get_batch_key in as few batches as possible. Returns the
+        outputs to pass to execute() as injected_outputs by prompt id: the sampler output of the prompts sampled in a
+        batch and the outputs the sampler inputs were computed from. Prompts that turn out not to be batchable after
+        all are sampled on their own when executed, interrupted ones stop when executed.
+        """
+        jobs = {}
+        injected = {}
+        for item in items:
+            prompt_id, prompt, extra_data = item[1], item[2], item[3]
+            sampler_id = find_sampler(prompt)
+            inputs = prompt[sampler_id]["inputs"]
+            # Only run what the sampler needs, without reporting to the client: that happens when the prompt executes.
+            upstream = [x[0] for x in inputs.values() if is_link(x)]
+            self.execute(prompt, prompt_id, {k: v for k, v in extra_data.items() if k != "client_id"}, upstream, pre_run=True)
+            injected[prompt_id] = {}
+            if not self.success:
+                if any(event == "execution_interrupted" for event, _ in self.status_messages):
+                    # Stopping the pre-run consumed the interrupt, it must still stop the prompt itself.
+                    nodes.interrupt_processing(True, prompt_id)
+                continue
+            if prompt_id in comfy.model_management.interrupted_prompts:
+                continue
+            # Pre-running the next prompts can evict these outputs from the cache (--cache-classic keeps a single
+            # prompt), hold on to them until the prompt executes.
+            for node_id in prompt:
+                output = self.caches.outputs.get(node_id)
+                if output is not None:
+                    injected[prompt_id][node_id] = output
+            class_def = nodes.NODE_CLASS_MAPPINGS[prompt[sampler_id]["class_type"]]
+            input_data_all, missing_keys = get_input_data(inputs, class_def, sampler_id, self.caches.outputs, DynamicPrompt(prompt), extra_data)
+            if len(missing_keys) > 0 or any(len(x) != 1 for x in input_data_all.values()):
+                continue
+            job = {k: v[0] for k, v in input_data_all.items()}
+            key = get_job_key(job)
+            if key is not None:
+                jobs.setdefault(key, []).append((prompt_id, sampler_id, job, extra_data.get("client_id")))
+
+        for group in jobs.values():
+            if len(group) < 2:
+                continue
+            try:
+                with torch.inference_mode():
+                    outputs = sample_batch([x[2] for x in group], callback=self.batch_progress_callback(group))
+            except comfy.model_management.InterruptProcessingException:
+                # The prompts that weren't interrupted are sampled on their own when executed.
+                continue
+            except Exception as e:
+                logging.warning("Batched sampling of {} prompts failed, sampling them one by one: {}".format(len(group), e))
+                comfy.model_management.soft_empty_cache()
+                continue
+            finally:
+                self.server.client_id = None
+                self.server.last_prompt_id = None
+                self.server.last_node_id = None
+            logging.info("Sampled {} prompts in one batch".format(len(group)))
+            for (prompt_id, sampler_id, _, _), output in zip(group, outputs):
+                injected[prompt_id][sampler_id] = [[output]]
+        return injected
+
+    def batch_progress_callback(self, group):
+        """
+        The sampling callback of a batch of sample_batched: reports the progress and preview of each prompt to its own
+        client, through the progress bar hook with the server state set to that prompt.
+        """
+        model = group[0][2]["model"]
+        previewer = latent_preview.get_previewer(model.load_device, model.model.latent_format)
+        offsets = [0]
+        for _, _, job, _ in group:
+            offsets.append(offsets[-1] + job["latent_image"]["samples"].shape[0])
+        last_preview = [None]
+
+        def callback(step, x0, x, total_steps):
+            # Interrupting one of the prompts stops the batch, it stays interrupted to stop the prompt itself too.
+            if any(x[0] in comfy.model_management.interrupted_prompts for x in group):
+                raise comfy.model_management.InterruptProcessingException()
+            comfy.model_management.throw_exception_if_processing_interrupted()
+            hook = comfy.utils.PROGRESS_BAR_HOOK
+            if hook is None:
+                return
+            preview = False
+            if previewer is not None:
+                now = time.monotonic()
+                if args.preview_rate <= 0 or last_preview[0] is None or now - last_preview[0] >= 1.0 / args.preview_rate:
+                    last_preview[0] = now
+                    preview = True
+            for (prompt_id, sampler_id, _, client_id), offset in zip(group, offsets):
+                if client_id is None:
+                    continue
+                preview_bytes = None
+                if preview:
+                    preview_bytes = previewer.decode_latent_to_preview_image("JPEG", x0[offset:offset + 1])
+                self.server.client_id = client_id
+                self.server.last_prompt_id = prompt_id
+                self.server.last_node_id = sampler_id
+                hook(step + 1, total_steps, preview_bytes)
+        return callback
+
 
 def validate_inputs(prompt, item, validated):
     unique_id = item
@@ -863,9 +1092,39 @@ def validate_prompt(prompt):
     return (True, None, list(good_outputs), node_errors)
 
 MAXIMUM_HISTORY_SIZE = 10000
+# With a history store, the number of recent history entries also kept in memory.
+HISTORY_HOT_SIZE = 100
+# How far past the head of the queue a worker may look for a prompt it has affinity with.
+AFFINITY_WINDOW = 8
+# How far down the queue to look for prompts to sample together with the one about to run.
+BATCH_WINDOW = 32
+
+def get_prompt_model_files(prompt):
+    """
+    Returns the model files (checkpoints, loras, vaes...) a prompt loads, going by the widget values that
+    look like model filenames so that custom loader nodes are covered too.
+    """
+    files = set()
+    for node in prompt.values():
+        for value in node.get("inputs", {}).values():
+            if isinstance(value, str) and os.path.splitext(value)[1].lower() in folder_paths.supported_pt_extensions:
+                files.add(value)
+    return files
+
+def get_prompt_resources(prompt):
+    """
+    What running a prompt leaves loaded or cached that another prompt could reuse: its model files and its
+    source nodes (loaders, image loads... anything without linked inputs), identified by type and inputs.
+    """
+    resources = set(("model", x) for x in get_prompt_model_files(prompt))
+    for node in prompt.values():
+        inputs = node.get("inputs", {})
+        if not any(is_link(x) for x in inputs.values()):
+            resources.add(("node", node.get("class_type"), repr(sorted(inputs.items()))))
+    return resources
 
 class PromptQueue:
-    def __init__(self, server):
+    def __init__(self, server, schedule_window=0, history_store=None):
         self.server = server
         self.mutex = threading.RLock()
         self.not_empty = threading.Condition(self.mutex)
@@ -873,27 +1132,119 @@ class PromptQueue:
         self.queue = []
         self.currently_running = {}
         self.history = {}
+        self.history_store = history_store
         self.flags = {}
+        # Reordering of queued prompts to reuse loaded models, see _pop_scheduled
+        self.schedule_window = schedule_window
+        self.last_resources = set()
+        self.times_skipped = {}
+        self.prompts_reordered = 0
+        self.model_loads_avoided = 0
+        self.put_times = {}
+        # Queue items and history entries are never modified once added, so readers get shared references instead of
+        # copies. The snapshot of the queue is rebuilt on the first read after a change.
+        self.queue_snapshot = None
+        comfy.metrics.queue_pending.set_function(lambda: len(self.queue))
+        comfy.metrics.queue_running.set_function(lambda: len(self.currently_running))
         server.prompt_queue = self
 
     def put(self, item):
         with self.mutex:
             heapq.heappush(self.queue, item)
+            self.put_times[item[1]] = time.perf_counter()
+            self.queue_snapshot = None
             self.server.queue_updated()
             self.not_empty.notify()
 
-    def get(self, timeout=None):
+    def _pop(self, affinity=None):
+        if affinity is not None:
+            # Take the first of the next few prompts the caller would rather run, if any.
+            for item in heapq.nsmallest(AFFINITY_WINDOW, self.queue):
+                if affinity(item):
+                    self.times_skipped.pop(item[1], None)
+                    self.queue.remove(item)
+                    heapq.heapify(self.queue)
+                    return item
+        if self.schedule_window > 1:
+            item = self._pop_scheduled()
+            self.last_resources = get_prompt_resources(item[2])
+            return item
+        return heapq.heappop(self.queue)
+
+    def _pop_scheduled(self):
+        # Among the next schedule_window prompts, run the one sharing the most models (then source nodes) with the
+        # prompt that ran last. A prompt can only be passed over schedule_window times, which bounds the unfairness.
+        head = self.queue[0]
+        if len(self.last_resources) == 0 or self.times_skipped.get(head[1], 0) >= self.schedule_window:
+            self.times_skipped.pop(head[1], None)
+            return heapq.heappop(self.queue)
+
+        def shared(item):
+            common = self.last_resources.intersection(get_prompt_resources(item[2]))
+            return (sum(1 for x in common if x[0] == "model"), len(common))
+
+        candidates = heapq.nsmallest(self.schedule_window, self.queue)
+        scores = [shared(x) for x in candidates]
+        best = scores.index(max(scores))
+        if best > 0:
+            for item in candidates[:best]:
+                self.times_skipped[item[1]] = self.times_skipped.get(item[1], 0) + 1
+            self.prompts_reordered += 1
+            self.model_loads_avoided += max(scores[best][0] - scores[0][0], 0)
+            logging.debug("Running prompt {} ahead of {} to reuse loaded models".format(candidates[best][1], head[1]))
+        item = candidates[best]
+        self.times_skipped.pop(item[1], None)
+        self.queue.remove(item)
+        heapq.heapify(self.queue)
+        return item
+
+    def get_scheduler_stats(self):
+        with self.mutex:
+            return {
+                "window": self.schedule_window,
+                "prompts_reordered": self.prompts_reordered,
+                "model_loads_avoided": self.model_loads_avoided,
+            }
+
+    def get(self, timeout=None, affinity=None):
         with self.not_empty:
             while len(self.queue) == 0:
                 self.not_empty.wait(timeout=timeout)
                 if timeout is not None and len(self.queue) == 0:
                     return None
-            item = heapq.heappop(self.queue)
-            i = self.task_counter
-            self.currently_running[i] = copy.deepcopy(item)
-            self.task_counter += 1
+            item = self._pop(affinity)
+            i = self._start(item)
             self.server.queue_updated()
-            return (item, i)
+        # The executor gets its own copy so the item kept for the queue and history stays untouched,
+        # made outside the lock so it doesn't hold up clients reading the queue.
+        return (copy.deepcopy(item), i)
+
+    def _start(self, item):
+        put_time = self.put_times.pop(item[1], None)
+        if put_time is not None:
+            comfy.metrics.prompt_queue_seconds.observe(time.perf_counter() - put_time)
+        i = self.task_counter
+        self.currently_running[i] = item
+        self.task_counter += 1
+        self.queue_snapshot = None
+        return i
+
+    def get_batch(self, item, max_items):
+        """Also takes up to max_items of the next queued prompts whose sampling can be batched with item's."""
+        key = get_batch_key(item[2])
+        if key is None or max_items <= 0:
+            return []
+        with self.mutex:
+            batch = [x for x in heapq.nsmallest(BATCH_WINDOW, self.queue) if get_batch_key(x[2]) == key][:max_items]
+            if len(batch) == 0:
+                return []
+            for x in batch:
+                self.queue.remove(x)
+                self.times_skipped.pop(x[1], None)
+            heapq.heapify(self.queue)
+            ids = [self._start(x) for x in batch]
+            self.server.queue_updated()
+        return [(copy.deepcopy(x), i) for x, i in zip(batch, ids)]
 
     class ExecutionStatus(NamedTuple):
         status_str: Literal['success', 'error']
@@ -904,12 +1255,15 @@ class PromptQueue:
                   status: Optional['PromptQueue.ExecutionStatus']):
         with self.mutex:
             prompt = self.currently_running.pop(item_id)
-            if len(self.history) > MAXIMUM_HISTORY_SIZE:
+            self.queue_snapshot = None
+            max_history_size = MAXIMUM_HISTORY_SIZE if self.history_store is None else HISTORY_HOT_SIZE
+            if len(self.history) > max_history_size:
                 self.history.pop(next(iter(self.history)))
 
             status_dict: Optional[dict] = None
             if status is not None:
                 status_dict = copy.deepcopy(status._asdict())
+                comfy.metrics.prompts_total.inc(status=status.status_str)
 
             self.history[prompt[1]] = {
                 "prompt": prompt,
@@ -917,14 +1271,20 @@ class PromptQueue:
                 'status': status_dict,
             }
             self.history[prompt[1]].update(history_result)
+            entry = self.history[prompt[1]]
             self.server.queue_updated()
+        if self.history_store is not None:
+            self.history_store.add(prompt[1], entry)
 
-    def get_current_queue(self):
+    def get_current_queue(self, max_items=None, offset=0):
         with self.mutex:
-            out = []
-            for x in self.currently_running.values():
-                out += [x]
-            return (out, copy.deepcopy(self.queue))
+            if self.queue_snapshot is None:
+                self.queue_snapshot = (tuple(self.currently_running.values()), tuple(sorted(self.queue)))
+            running, pending = self.queue_snapshot
+        if offset > 0 or max_items is not None:
+            end = None if max_items is None else offset + max_items
+            pending = pending[offset:end]
+        return (running, pending)
 
     def get_tasks_remaining(self):
         with self.mutex:
@@ -933,6 +1293,9 @@ class PromptQueue:
     def wipe_queue(self):
         with self.mutex:
             self.queue = []
+            self.put_times = {}
+            self.times_skipped = {}
+            self.queue_snapshot = None
             self.server.queue_updated()
 
     def delete_queue_item(self, function):
@@ -942,38 +1305,57 @@ class PromptQueue:
                     if len(self.queue) == 1:
                         self.wipe_queue()
                     else:
-                        self.queue.pop(x)
+                        prompt_id = self.queue.pop(x)[1]
+                        self.put_times.pop(prompt_id, None)
+                        self.times_skipped.pop(prompt_id, None)
                         heapq.heapify(self.queue)
+                        self.queue_snapshot = None
                     self.server.queue_updated()
                     return True
         return False
 
-    def get_history(self, prompt_id=None, max_items=None, offset=-1):
+    def get_history(self, prompt_id=None, max_items=None, offset=-1, status=None):
+        if self.history_store is not None:
+            return self.get_stored_history(prompt_id, max_items, offset, status)
         with self.mutex:
             if prompt_id is None:
-                out = {}
-                i = 0
+                history = self.history
+                if status is not None:
+                    history = {k: v for k, v in history.items() if (v["status"] or {}).get("status_str") == status}
                 if offset < 0 and max_items is not None:
-                    offset = len(self.history) - max_items
-                for k in self.history:
-                    if i >= offset:
-                        out[k] = self.history[k]
-                        if max_items is not None and len(out) >= max_items:
-                            break
-                    i += 1
-                return out
+                    offset = len(history) - max_items
+                offset = max(offset, 0)
+                end = None if max_items is None else offset + max_items
+                return dict(itertools.islice(history.items(), offset, end))
             elif prompt_id in self.history:
-                return {prompt_id: copy.deepcopy(self.history[prompt_id])}
+                return {prompt_id: self.history[prompt_id]}
             else:
                 return {}
 
+    def get_stored_history(self, prompt_id=None, max_items=None, offset=-1, status=None):
+        if prompt_id is None:
+            if offset < 0 and max_items is not None:
+                offset = self.history_store.count(status) - max_items
+            return self.history_store.page(max(offset, 0), max_items, status)
+        with self.mutex:
+            if prompt_id in self.history:
+                return {prompt_id: self.history[prompt_id]}
+        entry = self.history_store.get(prompt_id)
+        if entry is None:
+            return {}
+        return {prompt_id: entry}
+
     def wipe_history(self):
         with self.mutex:
             self.history = {}
+            if self.history_store is not None:
+                self.history_store.clear()
 
     def delete_history_item(self, id_to_delete):
         with self.mutex:
             self.history.pop(id_to_delete, None)
+            if self.history_store is not None:
+                self.history_store.delete(id_to_delete)
 
     def set_flag(self, name, data):
         with self.mutex:
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import os
 import time
+import threading
 import mimetypes
 import logging
 from typing import Literal
@@ -76,6 +77,10 @@ class CacheHelper:
 
 cache_helper = CacheHelper()
 
+# app.model_index.ModelIndex set by main.py with --model-index, used instead of walking the model folders.
+model_index = None
+indexed_filename_list_cache: dict[str, tuple[list[str], tuple, float]] = {}
+
 extension_mimetypes_cache = {
     "webp" : "image",
 }
@@ -264,6 +269,10 @@ def get_full_path(folder_name: str, filename: str) -> str | None:
         return None
     folders = folder_names_and_paths[folder_name]
     filename = os.path.relpath(os.path.join("/", filename), "/")
+    if model_index is not None:
+        for x in folders[0]:
+            if model_index.contains(x, filename):
+                return os.path.join(x, filename)
     for x in folders[0]:
         full_path = os.path.join(x, filename)
         if os.path.isfile(full_path):
@@ -320,8 +329,23 @@ def cached_filename_list_(folder_name: str) -> tuple[list[str], dict[str, float]
 
     return out
 
+def indexed_filename_list_(folder_name: str) -> tuple[list[str], tuple, float]:
+    folders = folder_names_and_paths[folder_name]
+    key = (model_index.version, tuple(folders[0]))
+    out = indexed_filename_list_cache.get(folder_name)
+    if out is not None and out[1] == key:
+        return out
+    output_list = set()
+    for x in folders[0]:
+        output_list.update(filter_files_extensions(model_index.get_files(x)[0], folders[1]))
+    out = (sorted(output_list), key, time.perf_counter())
+    indexed_filename_list_cache[folder_name] = out
+    return out
+
 def get_filename_list(folder_name: str) -> list[str]:
     folder_name = map_legacy(folder_name)
+    if model_index is not None:
+        return list(indexed_filename_list_(folder_name)[0])
     out = cached_filename_list_(folder_name)
     if out is None:
         out = get_filename_list_(folder_name)
@@ -330,16 +354,105 @@ def get_filename_list(folder_name: str) -> list[str]:
     cache_helper.set(folder_name, out)
     return list(out[0])
 
-def get_save_image_path(filename_prefix: str, output_dir: str, image_width=0, image_height=0) -> tuple[str, str, int, str, str]:
-    def map_filename(filename: str) -> tuple[int, str]:
-        prefix_len = len(os.path.basename(filename_prefix))
-        prefix = filename[:prefix_len + 1]
+def get_folders_version() -> tuple:
+    """
+    Changes whenever the file lists node definitions show could have: a model folder file list or the input directory
+    listing. Only stats directories, so it's cheap to check before rebuilding anything made from them.
+    """
+    def mtime(path):
         try:
-            digits = int(filename[prefix_len + 1:].split('_')[0])
-        except:
-            digits = 0
-        return digits, prefix
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    if model_index is not None:
+        return (model_index.version, mtime(input_directory))
+    # Called from executor threads while the prompt worker updates these dicts: iterate over snapshots.
+    folders = [input_directory] + [x for paths, _ in list(folder_names_and_paths.values()) for x in paths]
+    version = [(x, mtime(x)) for x in folders]
+    for out in list(filename_list_cache.values()):
+        version.extend((x, mtime(x)) for x in out[1])
+    return tuple(version)
+
+class SaveCounterIndex:
+    """
+    Next counter for the files saved as "<prefix>_<counter>_<suffix>" per output folder and prefix, so a save doesn't
+    list and parse the whole folder. A folder is listed once; afterwards the next counter is checked by probing for
+    the names with the suffixes seen for that prefix, so only the files saved since the last save are looked at.
+    Folders that changed are listed again for new prefixes, otherwise at most every RESCAN_INTERVAL seconds.
+    """
+    RESCAN_INTERVAL = 60.0
+    MAX_SUFFIXES = 8
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        # normcased folder path -> (mtime_ns, time listed, {normcased prefix: [next counter, suffixes, handed out]})
+        self.folders: dict[str, tuple[int, float, dict[str, list]]] = {}
+
+    def scan(self, folder: str) -> dict[str, list]:
+        counters = {}
+        for name in os.listdir(folder):
+            name = os.path.normcase(name)
+            i = name.find("_")
+            while i >= 0:
+                digits, sep, suffix = name[i + 1:].partition("_")
+                try:
+                    counter = int(digits)
+                except ValueError:
+                    counter = None
+                if counter is not None:
+                    entry = counters.setdefault(name[:i], [1, set(), False])
+                    entry[0] = max(entry[0], counter + 1)
+                    if sep and len(entry[1]) <= self.MAX_SUFFIXES:
+                        entry[1].add(suffix[:-4] if suffix.endswith(".tmp") else suffix)
+                i = name.find("_", i + 1)
+        return counters
+
+    def rescan(self, key: str, folder: str, mtime: int) -> dict[str, list]:
+        counters = self.scan(folder)
+        old = self.folders.get(key)
+        if old is not None:
+            # Counters handed out since the last listing might not be saved yet.
+            for prefix, entry in old[2].items():
+                if entry[2] and entry[0] > counters.get(prefix, [1])[0]:
+                    new = counters.setdefault(prefix, [1, set(), False])
+                    new[0] = entry[0]
+                    new[2] = True
+        self.folders[key] = (mtime, time.monotonic(), counters)
+        return counters
+
+    def next_counter(self, folder: str, filename: str) -> int:
+        """Raises FileNotFoundError when the folder doesn't exist."""
+        key = os.path.normcase(os.path.abspath(folder))
+        prefix = os.path.normcase(filename)
+        mtime = os.stat(folder).st_mtime_ns
+        with self.mutex:
+            state = self.folders.get(key)
+            if state is None or (state[0] != mtime and time.monotonic() - state[1] > self.RESCAN_INTERVAL):
+                counters = self.rescan(key, folder, mtime)
+            else:
+                counters = state[2]
+            entry = counters.get(prefix)
+            if entry is None and self.folders[key][0] != mtime:
+                counters = self.rescan(key, folder, mtime)
+                entry = counters.get(prefix)
+            elif entry is not None and entry[2] and (len(entry[1]) == 0 or len(entry[1]) > self.MAX_SUFFIXES):
+                # Can't tell what the files saved with the last counter are named.
+                counters = self.rescan(key, folder, mtime)
+                entry = counters.get(prefix)
+            if entry is None:
+                entry = counters[prefix] = [1, set(), False]
+
+            counter = entry[0]
+            while any(os.path.exists(os.path.join(folder, "{}_{:05}_{}".format(filename, counter, s) + t)) for s in entry[1] for t in ("", ".tmp")):
+                counter += 1
+            entry[0] = counter + 1
+            entry[2] = True
+            return counter
+
+save_counter_index = SaveCounterIndex()
 
+def get_save_image_path(filename_prefix: str, output_dir: str, image_width=0, image_height=0) -> tuple[str, str, int, str, str]:
     def compute_vars(input: str, image_width: int, image_height: int) -> str:
         input = input.replace("%width%", str(image_width))
         input = input.replace("%height%", str(image_height))
@@ -369,10 +482,8 @@ def get_save_image_path(filename_prefix: str, output_dir: str, image_width=0, im
         raise Exception(err)
 
     try:
-        counter = max(filter(lambda a: os.path.normcase(a[1][:-1]) == os.path.normcase(filename) and a[1][-1] == "_", map(map_filename, os.listdir(full_output_folder))))[0] + 1
-    except ValueError:
-        counter = 1
+        counter = save_counter_index.next_counter(full_output_folder, filename)
     except FileNotFoundError:
         os.makedirs(full_output_folder, exist_ok=True)
-        counter = 1
+        counter = save_counter_index.next_counter(full_output_folder, filename)
     return full_output_folder, filename, counter, subfolder, filename_prefix
@@ -6,9 +6,15 @@ import comfy.model_management
 import folder_paths
 import comfy.utils
 import logging
+import threading
+import time
 
 MAX_PREVIEW_RESOLUTION = args.preview_size
 
+# (method, latent format, taesd decoder path, device) -> previewer, so the TAESD weights are loaded once per device.
+previewers = {}
+previewers_lock = threading.Lock()
+
 def preview_to_image(latent_image):
         latents_ubyte = (((latent_image + 1.0) / 2.0).clamp(0, 1)  # change scale from -1..1 to 0..1
                             .mul(0xFF)  # to 0..255
@@ -57,32 +63,41 @@ class Latent2RGBPreviewer(LatentPreviewer):
 
 
 def get_previewer(device, latent_format):
-    previewer = None
     method = args.preview_method
-    if method != LatentPreviewMethod.NoPreviews:
-        # TODO previewer methods
-        taesd_decoder_path = None
-        if latent_format.taesd_decoder_name is not None:
-            taesd_decoder_path = next(
-                (fn for fn in folder_paths.get_filename_list("vae_approx")
-                    if fn.startswith(latent_format.taesd_decoder_name)),
-                ""
-            )
-            taesd_decoder_path = folder_paths.get_full_path("vae_approx", taesd_decoder_path)
-
-        if method == LatentPreviewMethod.Auto:
-            method = LatentPreviewMethod.Latent2RGB
-
-        if method == LatentPreviewMethod.TAESD:
-            if taesd_decoder_path:
-                taesd = TAESD(None, taesd_decoder_path, latent_channels=latent_format.latent_channels).to(device)
-                previewer = TAESDPreviewerImpl(taesd)
-            else:
-                logging.warning("Warning: TAESD previews enabled, but could not find models/vae_approx/{}".format(latent_format.taesd_decoder_name))
-
-        if previewer is None:
-            if latent_format.latent_rgb_factors is not None:
-                previewer = Latent2RGBPreviewer(latent_format.latent_rgb_factors, latent_format.latent_rgb_factors_bias)
+    if method == LatentPreviewMethod.NoPreviews:
+        return None
+
+    taesd_decoder_path = None
+    if latent_format.taesd_decoder_name is not None:
+        taesd_decoder_path = next(
+            (fn for fn in folder_paths.get_filename_list("vae_approx")
+                if fn.startswith(latent_format.taesd_decoder_name)),
+            ""
+        )
+        taesd_decoder_path = folder_paths.get_full_path("vae_approx", taesd_decoder_path)
+
+    key = (method, type(latent_format), taesd_decoder_path, str(device))
+    with previewers_lock:
+        if key not in previewers:
+            previewers[key] = create_previewer(device, latent_format, method, taesd_decoder_path)
+        return previewers[key]
+
+def create_previewer(device, latent_format, method, taesd_decoder_path):
+    previewer = None
+    # TODO previewer methods
+    if method == LatentPreviewMethod.Auto:
+        method = LatentPreviewMethod.Latent2RGB
+
+    if method == LatentPreviewMethod.TAESD:
+        if taesd_decoder_path:
+            taesd = TAESD(None, taesd_decoder_path, latent_channels=latent_format.latent_channels).to(device)
+            previewer = TAESDPreviewerImpl(taesd)
+        else:
+            logging.warning("Warning: TAESD previews enabled, but could not find models/vae_approx/{}".format(latent_format.taesd_decoder_name))
+
+    if previewer is None:
+        if latent_format.latent_rgb_factors is not None:
+            previewer = Latent2RGBPreviewer(latent_format.latent_rgb_factors, latent_format.latent_rgb_factors_bias)
     return previewer
 
 def prepare_callback(model, steps, x0_output_dict=None):
@@ -93,13 +108,17 @@ def prepare_callback(model, steps, x0_output_dict=None):
     previewer = get_previewer(model.load_device, model.model.latent_format)
 
     pbar = comfy.utils.ProgressBar(steps)
+    last_preview = [None]
     def callback(step, x0, x, total_steps):
         if x0_output_dict is not None:
             x0_output_dict["x0"] = x0
 
         preview_bytes = None
         if previewer:
-            preview_bytes = previewer.decode_latent_to_preview_image(preview_format, x0)
+            now = time.monotonic()
+            if args.preview_rate <= 0 or last_preview[0] is None or now - last_preview[0] >= 1.0 / args.preview_rate:
+                last_preview[0] = now
+                preview_bytes = previewer.decode_latent_to_preview_image(preview_format, x0)
         pbar.update_absolute(step + 1, total_steps, preview_bytes)
     return callback
 
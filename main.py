@@ -98,6 +98,9 @@ import execution
 import server
 from server import BinaryEventTypes
 import nodes
+from comfy_execution.history import HistoryStore
+from comfy_execution.disk_cache import DiskCacheStore
+from app.model_index import ModelIndex
 import comfy.model_management
 
 def cuda_malloc_warning():
@@ -111,9 +114,44 @@ def cuda_malloc_warning():
         if cuda_malloc_warning:
             logging.warning("\nWARNING: this card most likely does not support cuda-malloc, if you get \"CUDA error\" please run ComfyUI with: --disable-cuda-malloc\n")
 
-def prompt_worker(q, server):
+class PromptWorker:
+    def __init__(self, device):
+        self.device = device
+        self.model_files = set()
+        self.flags = {}
+        self.mutex = threading.Lock()
+
+    def add_flags(self, flags):
+        with self.mutex:
+            self.flags.update(flags)
+
+    def get_flags(self):
+        with self.mutex:
+            flags = self.flags
+            self.flags = {}
+            return flags
+
+    def has_affinity(self, item):
+        # Prefer prompts using a model this worker loaded for its last prompt.
+        return not self.model_files.isdisjoint(execution.get_prompt_model_files(item[2]))
+
+def gb_to_bytes(size):
+    if size is None:
+        return None
+    return round(size * 1024 * 1024 * 1024)
+
+def prompt_worker(q, server, worker=None, workers=(), disk_store=None):
     current_time: float = 0.0
-    e = execution.PromptExecutor(server, lru_size=args.cache_lru)
+    affinity = None
+    if worker is not None:
+        comfy.model_management.set_thread_torch_device(worker.device)
+        server.use_worker_state()
+        affinity = worker.has_affinity
+        logging.info("Starting prompt worker on {}".format(worker.device))
+
+    e = execution.PromptExecutor(server, lru_size=args.cache_lru, disk_store=disk_store,
+                                 ram_cache_size=gb_to_bytes(args.cache_ram), vram_cache_size=gb_to_bytes(args.cache_vram),
+                                 profile=args.profile_nodes, trace_dir=args.profile_trace_dir, parallel_nodes=args.parallel_nodes)
     last_gc_collect = 0
     need_gc = False
     gc_collect_interval = 10.0
@@ -122,34 +160,56 @@ def prompt_worker(q, server):
         timeout = 1000.0
         if need_gc:
             timeout = max(gc_collect_interval - (current_time - last_gc_collect), 0.0)
+        if worker is not None:
+            # Don't sleep through flags another worker picked up for everyone.
+            timeout = min(timeout, 1.0)
 
-        queue_item = q.get(timeout=timeout)
+        queue_item = q.get(timeout=timeout, affinity=affinity)
         if queue_item is not None:
-            item, item_id = queue_item
-            execution_start_time = time.perf_counter()
-            prompt_id = item[1]
-            server.last_prompt_id = prompt_id
-
-            e.execute(item[2], prompt_id, item[3], item[4])
-            need_gc = True
-            q.task_done(item_id,
-                        e.history_result,
-                        status=execution.PromptQueue.ExecutionStatus(
-                            status_str='success' if e.success else 'error',
-                            completed=e.success,
-                            messages=e.status_messages))
-            if server.client_id is not None:
-                server.send_sync("executing", { "node": None, "prompt_id": prompt_id }, server.client_id)
-
-            current_time = time.perf_counter()
-            execution_time = current_time - execution_start_time
-            logging.info("Prompt executed in {:.2f} seconds".format(execution_time))
+            batch = [queue_item]
+            if args.batch_prompts > 1:
+                batch += q.get_batch(queue_item[0], args.batch_prompts - 1)
+            injected_outputs = {}
+            if len(batch) > 1:
+                server.executing_prompt_id = queue_item[0][1]
+                injected_outputs = e.sample_batched([x[0] for x in batch])
+
+            for item, item_id in batch:
+                execution_start_time = time.perf_counter()
+                prompt_id = item[1]
+                server.last_prompt_id = prompt_id
+                server.executing_prompt_id = prompt_id
+
+                e.execute(item[2], prompt_id, item[3], item[4], injected_outputs=injected_outputs.get(prompt_id))
+                need_gc = True
+                q.task_done(item_id,
+                            e.history_result,
+                            status=execution.PromptQueue.ExecutionStatus(
+                                status_str='success' if e.success else 'error',
+                                completed=e.success,
+                                messages=e.status_messages))
+                if server.client_id is not None:
+                    server.send_sync("executing", { "node": None, "prompt_id": prompt_id }, server.client_id)
+                if worker is not None:
+                    worker.model_files = execution.get_prompt_model_files(item[2])
+
+                current_time = time.perf_counter()
+                execution_time = current_time - execution_start_time
+                logging.info("Prompt executed in {:.2f} seconds".format(execution_time))
+            server.executing_prompt_id = None
 
         flags = q.get_flags()
+        if worker is not None:
+            # Flags apply to every worker, not just the one that happened to read them.
+            for w in workers:
+                w.add_flags(flags)
+            flags = worker.get_flags()
         free_memory = flags.get("free_memory", False)
 
         if flags.get("unload_models", free_memory):
             comfy.model_management.unload_all_models()
+            if worker is not None:
+                worker.model_files = set()
             need_gc = True
             last_gc_collect = 0
 
@@ -207,7 +267,10 @@ if __name__ == "__main__":
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     server = server.PromptServer(loop)
-    q = execution.PromptQueue(server)
+    history_store = None
+    if args.history_db is not None:
+        history_store = HistoryStore(args.history_db, execution.MAXIMUM_HISTORY_SIZE)
+    q = execution.PromptQueue(server, schedule_window=args.schedule_window, history_store=history_store)
 
     extra_model_paths_config_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "extra_model_paths.yaml")
     if os.path.isfile(extra_model_paths_config_path):
@@ -217,14 +280,33 @@ if __name__ == "__main__":
         for config_path in itertools.chain(*args.extra_model_paths_config):
             utils.extra_config.load_extra_path_config(config_path)
 
+    if args.model_index is not None:
+        folder_paths.model_index = ModelIndex(args.model_index, args.model_index_poll)
+        folder_paths.model_index.start()
+
     nodes.init_extra_nodes(init_custom_nodes=not args.disable_all_custom_nodes)
 
     cuda_malloc_warning()
 
     server.add_routes()
     hijack_progress(server)
-
-    threading.Thread(target=prompt_worker, daemon=True, args=(q, server,)).start()
+    # Precompute /object_info so the first frontend load doesn't wait for it.
+    def object_info_done(future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.warning("Failed to precompute /object_info: {}".format(future.exception()))
+    loop.run_in_executor(None, server.get_object_info_cached).add_done_callback(object_info_done)
+
+    # One store for all the workers, so its size limit and index hold for the whole directory.
+    disk_store = None
+    if args.cache_disk is not None:
+        disk_store = DiskCacheStore(args.cache_disk, gb_to_bytes(args.cache_disk_size))
+
+    if args.worker_devices:
+        workers = [PromptWorker(device) for device in args.worker_devices]
+        for worker in workers:
+            threading.Thread(target=prompt_worker, daemon=True, args=(q, server, worker, workers, disk_store)).start()
+    else:
+        threading.Thread(target=prompt_worker, daemon=True, args=(q, server, None, (), disk_store)).start()
 
     if args.output_directory:
         output_dir = os.path.abspath(args.output_directory)
@@ -4,7 +4,6 @@ import torch
 import os
 import sys
 import json
-import hashlib
 import traceback
 import math
 import time
@@ -30,6 +29,8 @@ from comfy.comfy_types import IO, ComfyNodeABC, InputTypeDict
 import comfy.clip_vision
 
 import comfy.model_management
+import comfy.file_digests
+import comfy.output_writer
 from comfy.cli_args import args
 
 import importlib
@@ -41,8 +42,8 @@ import node_helpers
 def before_node_execution():
     comfy.model_management.throw_exception_if_processing_interrupted()
 
-def interrupt_processing(value=True):
-    comfy.model_management.interrupt_current_processing(value)
+def interrupt_processing(value=True, prompt_id=None):
+    comfy.model_management.interrupt_current_processing(value, prompt_id)
 
 MAX_RESOLUTION=16384
 
@@ -293,17 +294,19 @@ class VAEDecodeTiled:
         return {"required": {"samples": ("LATENT", ), "vae": ("VAE", ),
                              "tile_size": ("INT", {"default": 512, "min": 128, "max": 4096, "step": 32}),
                              "overlap": ("INT", {"default": 64, "min": 0, "max": 4096, "step": 32}),
+                            },
+                "optional": {"single_pass": ("BOOLEAN", {"default": False, "tooltip": "Decode every tile once and blend the overlaps instead of averaging three passes with different tile shapes. About 3 times faster, seams may be more visible with small overlaps."}),
                             }}
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "decode"
 
     CATEGORY = "_for_testing"
 
-    def decode(self, vae, samples, tile_size, overlap=64):
+    def decode(self, vae, samples, tile_size, overlap=64, single_pass=False):
         if tile_size < overlap * 4:
             overlap = tile_size // 4
         compression = vae.spacial_compression_decode()
-        images = vae.decode_tiled(samples["samples"], tile_x=tile_size // compression, tile_y=tile_size // compression, overlap=overlap // compression)
+        images = vae.decode_tiled(samples["samples"], tile_x=tile_size // compression, tile_y=tile_size // compression, overlap=overlap // compression, single_pass=single_pass)
         if len(images.shape) == 5: #Combine batches
             images = images.reshape(-1, images.shape[-3], images.shape[-2], images.shape[-1])
         return (images, )
@@ -326,14 +329,16 @@ class VAEEncodeTiled:
     def INPUT_TYPES(s):
         return {"required": {"pixels": ("IMAGE", ), "vae": ("VAE", ),
                              "tile_size": ("INT", {"default": 512, "min": 320, "max": 4096, "step": 64})
+                            },
+                "optional": {"single_pass": ("BOOLEAN", {"default": False, "tooltip": "Encode every tile once and blend the overlaps instead of averaging three passes with different tile shapes. About 3 times faster."}),
                             }}
     RETURN_TYPES = ("LATENT",)
     FUNCTION = "encode"
 
     CATEGORY = "_for_testing"
 
-    def encode(self, vae, pixels, tile_size):
-        t = vae.encode_tiled(pixels[:,:,:,:3], tile_x=tile_size, tile_y=tile_size, )
+    def encode(self, vae, pixels, tile_size, single_pass=False):
+        t = vae.encode_tiled(pixels[:,:,:,:3], tile_x=tile_size, tile_y=tile_size, single_pass=single_pass)
         return ({"samples":t}, )
 
 class VAEEncodeForInpaint:
@@ -490,6 +495,7 @@ class LoadLatent:
 
     RETURN_TYPES = ("LATENT", )
     FUNCTION = "load"
+    THREAD_SAFE = True
 
     def load(self, latent):
         latent_path = folder_paths.get_annotated_filepath(latent)
@@ -503,10 +509,7 @@ class LoadLatent:
     @classmethod
     def IS_CHANGED(s, latent):
         image_path = folder_paths.get_annotated_filepath(latent)
-        m = hashlib.sha256()
-        with open(image_path, 'rb') as f:
-            m.update(f.read())
-        return m.digest().hex()
+        return comfy.file_digests.file_digest(image_path)
 
     @classmethod
     def VALIDATE_INPUTS(s, latent):
@@ -1530,8 +1533,6 @@ class SaveImage:
         full_output_folder, filename, counter, subfolder, filename_prefix = folder_paths.get_save_image_path(filename_prefix, self.output_dir, images[0].shape[1], images[0].shape[0])
         results = list()
         for (batch_number, image) in enumerate(images):
-            i = 255. * image.cpu().numpy()
-            img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
             metadata = None
             if not args.disable_metadata:
                 metadata = PngInfo()
@@ -1543,7 +1544,7 @@ class SaveImage:
 
             filename_with_batch_num = filename.replace("%batch_num%", str(batch_number))
             file = f"{filename_with_batch_num}_{counter:05}_.png"
-            img.save(os.path.join(full_output_folder, file), pnginfo=metadata, compress_level=self.compress_level)
+            comfy.output_writer.output_writer.write(os.path.join(full_output_folder, file), self.save_png, image.cpu(), metadata, self.compress_level)
             results.append({
                 "filename": file,
                 "subfolder": subfolder,
@@ -1553,6 +1554,12 @@ class SaveImage:
 
         return { "ui": { "images": results } }
 
+    @staticmethod
+    def save_png(f, image, metadata, compress_level):
+        i = 255. * image.numpy()
+        img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
+        img.save(f, format="PNG", pnginfo=metadata, compress_level=compress_level)
+
 class PreviewImage(SaveImage):
     def __init__(self):
         self.output_dir = folder_paths.get_temp_directory()
@@ -1580,6 +1587,7 @@ class LoadImage:
 
     RETURN_TYPES = ("IMAGE", "MASK")
     FUNCTION = "load_image"
+    THREAD_SAFE = True
     def load_image(self, image):
         image_path = folder_paths.get_annotated_filepath(image)
         
@@ -1627,10 +1635,7 @@ class LoadImage:
     @classmethod
     def IS_CHANGED(s, image):
         image_path = folder_paths.get_annotated_filepath(image)
-        m = hashlib.sha256()
-        with open(image_path, 'rb') as f:
-            m.update(f.read())
-        return m.digest().hex()
+        return comfy.file_digests.file_digest(image_path)
 
     @classmethod
     def VALIDATE_INPUTS(s, image):
@@ -1654,6 +1659,7 @@ class LoadImageMask:
 
     RETURN_TYPES = ("MASK",)
     FUNCTION = "load_image"
+    THREAD_SAFE = True
     def load_image(self, image, channel):
         image_path = folder_paths.get_annotated_filepath(image)
         i = node_helpers.pillow(Image.open, image_path)
@@ -1676,10 +1682,7 @@ class LoadImageMask:
     @classmethod
     def IS_CHANGED(s, image, channel):
         image_path = folder_paths.get_annotated_filepath(image)
-        m = hashlib.sha256()
-        with open(image_path, 'rb') as f:
-            m.update(f.read())
-        return m.digest().hex()
+        return comfy.file_digests.file_digest(image_path)
 
     @classmethod
     def VALIDATE_INPUTS(s, image):
@@ -1700,6 +1703,7 @@ class ImageScale:
                               "crop": (s.crop_methods,)}}
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "upscale"
+    THREAD_SAFE = True
 
     CATEGORY = "image/upscaling"
 
@@ -1727,6 +1731,7 @@ class ImageScaleBy:
                               "scale_by": ("FLOAT", {"default": 1.0, "min": 0.01, "max": 8.0, "step": 0.01}),}}
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "upscale"
+    THREAD_SAFE = True
 
     CATEGORY = "image/upscaling"
 
@@ -1746,6 +1751,7 @@ class ImageInvert:
 
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "invert"
+    THREAD_SAFE = True
 
     CATEGORY = "image"
 
@@ -1809,6 +1815,7 @@ class ImagePadForOutpaint:
 
     RETURN_TYPES = ("IMAGE", "MASK")
     FUNCTION = "expand_image"
+    THREAD_SAFE = True
 
     CATEGORY = "image"
 
@@ -1,6 +1,8 @@
 import os
 import sys
 import asyncio
+import collections
+import concurrent.futures
 import traceback
 
 import nodes
@@ -13,7 +15,12 @@ import glob
 import struct
 import ssl
 import socket
+import time
 import ipaddress
+import gzip
+import hashlib
+import threading
+import contextvars
 from PIL import Image, ImageOps
 from PIL.PngImagePlugin import PngInfo
 from io import BytesIO
@@ -25,11 +32,16 @@ import logging
 import mimetypes
 from comfy.cli_args import args
 import comfy.utils
+import comfy.sd
 import comfy.model_management
+import comfy.metrics
+import comfy.file_digests
+import comfy.output_writer
 import node_helpers
 from app.frontend_management import FrontendManager
 from app.user_manager import UserManager
 from app.model_manager import ModelFileManager
+import app.view_cache
 from typing import Optional
 from api_server.routes.internal.internal_routes import InternalRoutes
 
@@ -37,6 +49,152 @@ class BinaryEventTypes:
     PREVIEW_IMAGE = 1
     UNENCODED_PREVIEW_IMAGE = 2
 
+def encode_preview_image(image_data):
+    image_type = image_data[0]
+    image = image_data[1]
+    max_size = image_data[2]
+    if max_size is not None:
+        if hasattr(Image, 'Resampling'):
+            resampling = Image.Resampling.BILINEAR
+        else:
+            resampling = Image.ANTIALIAS
+
+        image = ImageOps.contain(image, (max_size, max_size), resampling)
+    type_num = 1
+    if image_type == "JPEG":
+        type_num = 1
+    elif image_type == "PNG":
+        type_num = 2
+
+    bytesIO = BytesIO()
+    header = struct.pack(">I", type_num)
+    bytesIO.write(header)
+    image.save(bytesIO, format=image_type, quality=95, compress_level=1)
+    return bytesIO.getvalue()
+
+class PreviewEncoder:
+    """
+    Resizes and encodes sampler previews on its own thread instead of the event loop. Only the latest preview of each
+    client is kept: previews that come in while the previous one is encoded or still being sent to a slow client are
+    dropped.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.cond = threading.Condition()
+        # sid -> latest unencoded preview
+        self.latest = {}
+        # sids with an encoded preview that wasn't sent yet
+        self.in_flight = set()
+        self.thread = None
+
+    def put(self, image_data, sid):
+        with self.cond:
+            if sid in self.latest:
+                comfy.metrics.previews_dropped_total.inc()
+            self.latest[sid] = image_data
+            self.cond.notify()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.encode_loop, daemon=True, name="preview_encoder")
+                self.thread.start()
+
+    def sent(self, sid):
+        with self.cond:
+            self.in_flight.discard(sid)
+            self.cond.notify()
+
+    def next_preview(self):
+        with self.cond:
+            while True:
+                for sid in self.latest:
+                    if sid not in self.in_flight:
+                        self.in_flight.add(sid)
+                        return sid, self.latest.pop(sid)
+                self.cond.wait()
+
+    def encode_loop(self):
+        while True:
+            sid, image_data = self.next_preview()
+            try:
+                preview = encode_preview_image(image_data)
+            except Exception:
+                logging.exception("Error encoding preview image")
+                self.sent(sid)
+                continue
+            self.server.send_sync(BinaryEventTypes.PREVIEW_IMAGE, preview, sid)
+
+class WebSocketClient:
+    """
+    The outbound messages of one websocket, sent by their own task so a slow client only delays itself. Progress and
+    preview messages that weren't sent yet are replaced by newer ones. A client that falls more than MAX_QUEUE other
+    messages behind is disconnected, it gets the current state again when it reconnects.
+
+    on_done(drop_key) is called once a replaceable message is sent, replaced or dropped, so whatever produces them can
+    go on with the next one.
+    """
+    MAX_QUEUE = 1000
+
+    def __init__(self, ws, on_done=None):
+        self.ws = ws
+        self.on_done = on_done
+        self.queue = collections.deque()
+        # drop keys of the queued messages that can be replaced
+        self.droppable = set()
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.task = asyncio.create_task(self.send_loop())
+
+    def put(self, message, drop_key=None):
+        if self.closed:
+            if drop_key is not None:
+                self.done(drop_key)
+            return
+        if drop_key is not None and drop_key in self.droppable:
+            for i, queued in enumerate(self.queue):
+                if queued[1] == drop_key:
+                    del self.queue[i]
+                    break
+            comfy.metrics.websocket_messages_dropped_total.inc(kind=drop_key)
+            self.done(drop_key)
+        elif len(self.queue) >= self.MAX_QUEUE:
+            logging.warning("websocket client is {} messages behind, disconnecting it".format(len(self.queue)))
+            self.close()
+            asyncio.create_task(self.ws.close())
+            if drop_key is not None:
+                self.done(drop_key)
+            return
+        if drop_key is not None:
+            self.droppable.add(drop_key)
+        self.queue.append((message, drop_key))
+        self.ready.set()
+
+    async def send_loop(self):
+        while True:
+            while len(self.queue) == 0:
+                self.ready.clear()
+                await self.ready.wait()
+            message, drop_key = self.queue.popleft()
+            self.droppable.discard(drop_key)
+            try:
+                if isinstance(message, str):
+                    await send_socket_catch_exception(self.ws.send_str, message)
+                else:
+                    await send_socket_catch_exception(self.ws.send_bytes, message)
+            finally:
+                if drop_key is not None:
+                    self.done(drop_key)
+
+    def done(self, drop_key):
+        if self.on_done is not None:
+            self.on_done(drop_key)
+
+    def close(self):
+        self.closed = True
+        for drop_key in self.droppable:
+            self.done(drop_key)
+        self.droppable.clear()
+        self.queue.clear()
+        self.task.cancel()
+
 async def send_socket_catch_exception(function, message):
     try:
         await function(message)
@@ -144,9 +302,15 @@ def create_origin_only_middleware():
 
     return origin_only_middleware
 
+# The execution state (client, node and prompt executing) of the prompt worker running in the current context, see
+# PromptServer.use_worker_state. None outside of prompt workers started with --worker-devices.
+worker_state = contextvars.ContextVar("worker_state", default=None)
+
 class PromptServer():
     def __init__(self, loop):
         PromptServer.instance = self
+        self.execution_state = {"client_id": None, "last_node_id": None, "last_prompt_id": None, "executing_prompt_id": None}
+        self.worker_states = []
 
         mimetypes.init()
         mimetypes.types_map['.js'] = 'application/javascript; charset=utf-8'
@@ -158,8 +322,17 @@ class PromptServer():
         self.prompt_queue = None
         self.loop = loop
         self.messages = asyncio.Queue()
+        self.preview_encoder = PreviewEncoder(self)
         self.client_session:Optional[aiohttp.ClientSession] = None
         self.number = 0
+        # (version, etag, json, gzipped json) of /object_info, see get_object_info_cached
+        self.object_info = None
+        self.object_info_lock = threading.Lock()
+        # /view image transforms run on this pool, their results are cached in view_cache
+        self.view_executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="view")
+        self.view_cache = None
+        if args.view_cache_size > 0:
+            self.view_cache = app.view_cache.ViewCache(os.path.join(folder_paths.get_temp_directory(), "view_cache"), round(args.view_cache_size * 1024 * 1024))
 
         middlewares = [cache_control]
         if args.enable_cors_header:
@@ -170,6 +343,9 @@ class PromptServer():
         max_upload_size = round(args.max_upload_size * 1024 * 1024)
         self.app = web.Application(client_max_size=max_upload_size, middlewares=middlewares)
         self.sockets = dict()
+        # sid -> WebSocketClient queueing the messages for self.sockets[sid]
+        self.clients = dict()
+        comfy.metrics.websocket_clients.set_function(lambda: len(self.sockets))
         self.web_root = (
             FrontendManager.init_frontend(args.front_end_version)
             if args.front_end_root is None
@@ -185,29 +361,41 @@ class PromptServer():
 
         @routes.get('/ws')
         async def websocket_handler(request):
-            ws = web.WebSocketResponse()
+            ws = web.WebSocketResponse(compress=args.websocket_compress)
             await ws.prepare(request)
             sid = request.rel_url.query.get('clientId', '')
             if sid:
                 # Reusing existing session, remove old
                 self.sockets.pop(sid, None)
+                old_client = self.clients.pop(sid, None)
+                if old_client is not None:
+                    old_client.close()
             else:
                 sid = uuid.uuid4().hex
 
+            def message_done(drop_key, sid=sid):
+                if drop_key == "preview":
+                    self.preview_encoder.sent(sid)
+            client = WebSocketClient(ws, message_done)
             self.sockets[sid] = ws
+            self.clients[sid] = client
 
             try:
                 # Send initial state to the new client
                 await self.send("status", { "status": self.get_queue_info(), 'sid': sid }, sid)
                 # On reconnect if we are the currently executing client send the current node
-                if self.client_id == sid and self.last_node_id is not None:
-                    await self.send("executing", { "node": self.last_node_id }, sid)
+                for state in [self.execution_state] + self.worker_states:
+                    if state["client_id"] == sid and state["last_node_id"] is not None:
+                        await self.send("executing", { "node": state["last_node_id"] }, sid)
 
                 async for msg in ws:
                     if msg.type == aiohttp.WSMsgType.ERROR:
                         logging.warning('ws connection closed with exception %s' % ws.exception())
             finally:
-                self.sockets.pop(sid, None)
+                if self.sockets.get(sid) is ws:
+                    self.sockets.pop(sid)
+                    self.clients.pop(sid)
+                client.close()
             return ws
 
         @routes.get("/")
@@ -266,17 +454,14 @@ class PromptServer():
 
         def compare_image_hash(filepath, image):
             hasher = node_helpers.hasher()
-            
+
             # function to compare hashes of two images to see if it already exists, fix to #3465
+            # the existing file's digest is cached, so it's only read again when it changed on disk
             if os.path.exists(filepath):
-                a = hasher()
                 b = hasher()
-                with open(filepath, "rb") as f:
-                    a.update(f.read())
-                    b.update(image.file.read())
-                    image.file.seek(0)
-                    f.close()
-                return a.hexdigest() == b.hexdigest()
+                b.update(image.file.read())
+                image.file.seek(0)
+                return comfy.file_digests.file_digest(filepath, b.name) == b.hexdigest()
             return False
 
         def image_upload(post, image_save_function=None):
@@ -402,65 +587,36 @@ class PromptServer():
                 filename = os.path.basename(filename)
                 file = os.path.join(output_dir, filename)
 
+                pending = comfy.output_writer.output_writer.get_pending(file)
+                if pending is not None:
+                    try:
+                        await asyncio.wrap_future(pending)
+                    except Exception:
+                        pass
+
                 if os.path.isfile(file):
-                    if 'preview' in request.rel_url.query:
-                        with Image.open(file) as img:
-                            preview_info = request.rel_url.query['preview'].split(';')
-                            image_format = preview_info[0]
-                            if image_format not in ['webp', 'jpeg'] or 'a' in request.rel_url.query.get('channel', ''):
-                                image_format = 'webp'
-
-                            quality = 90
-                            if preview_info[-1].isdigit():
-                                quality = int(preview_info[-1])
-
-                            buffer = BytesIO()
-                            if image_format in ['jpeg'] or request.rel_url.query.get('channel', '') == 'rgb':
-                                img = img.convert("RGB")
-                            img.save(buffer, format=image_format, quality=quality)
-                            buffer.seek(0)
-
-                            return web.Response(body=buffer.read(), content_type=f'image/{image_format}',
-                                                headers={"Content-Disposition": f"filename=\"{filename}\""})
-
-                    if 'channel' not in request.rel_url.query:
-                        channel = 'rgba'
+                    headers = {"Content-Disposition": f"filename=\"{filename}\""}
+                    transform = app.view_cache.get_transform(request.rel_url.query)
+                    if transform is None:
+                        return web.FileResponse(file, headers=headers)
+
+                    stat = os.stat(file)
+                    key = app.view_cache.get_key(file, stat, transform)
+                    if request.if_none_match is not None:
+                        not_modified = any(etag.value == key for etag in request.if_none_match)
                     else:
-                        channel = request.rel_url.query["channel"]
-
-                    if channel == 'rgb':
-                        with Image.open(file) as img:
-                            if img.mode == "RGBA":
-                                r, g, b, a = img.split()
-                                new_img = Image.merge('RGB', (r, g, b))
-                            else:
-                                new_img = img.convert("RGB")
-
-                            buffer = BytesIO()
-                            new_img.save(buffer, format='PNG')
-                            buffer.seek(0)
-
-                            return web.Response(body=buffer.read(), content_type='image/png',
-                                                headers={"Content-Disposition": f"filename=\"{filename}\""})
-
-                    elif channel == 'a':
-                        with Image.open(file) as img:
-                            if img.mode == "RGBA":
-                                _, _, _, a = img.split()
-                            else:
-                                a = Image.new('L', img.size, 255)
-
-                            # alpha img
-                            alpha_img = Image.new('RGBA', img.size)
-                            alpha_img.putalpha(a)
-                            alpha_buffer = BytesIO()
-                            alpha_img.save(alpha_buffer, format='PNG')
-                            alpha_buffer.seek(0)
-
-                            return web.Response(body=alpha_buffer.read(), content_type='image/png',
-                                                headers={"Content-Disposition": f"filename=\"{filename}\""})
+                        not_modified = request.if_modified_since is not None and int(stat.st_mtime) <= request.if_modified_since.timestamp()
+                    if not_modified:
+                        response = web.Response(status=304, headers=headers)
                     else:
-                        return web.FileResponse(file, headers={"Content-Disposition": f"filename=\"{filename}\""})
+                        if self.view_cache is not None:
+                            body = await self.loop.run_in_executor(self.view_executor, self.view_cache.get_image, file, key, transform)
+                        else:
+                            body = await self.loop.run_in_executor(self.view_executor, app.view_cache.apply_transform, file, transform)
+                        response = web.Response(body=body, content_type=app.view_cache.get_content_type(transform), headers=headers)
+                    response.etag = key
+                    response.last_modified = stat.st_mtime
+                    return response
 
             return web.Response(status=404)
 
@@ -487,6 +643,22 @@ class PromptServer():
                 return web.Response(status=404)
             return web.json_response(dt["__metadata__"])
 
+        @routes.get("/model_info/{folder_name}")
+        async def model_info(request):
+            folder_name = request.match_info.get("folder_name", None)
+            filename = request.rel_url.query.get("filename", None)
+            if folder_name is None or filename is None or not filename.endswith(".safetensors"):
+                return web.Response(status=404)
+
+            safetensors_path = folder_paths.get_full_path(folder_name, filename)
+            if safetensors_path is None:
+                return web.Response(status=404)
+            info = await self.loop.run_in_executor(None, comfy.sd.detect_checkpoint, safetensors_path)
+            if info is None:
+                return web.Response(status=404)
+            # dtypes and devices as their names
+            return web.json_response({k: v if v is None or isinstance(v, (bool, int, str)) else str(v) for k, v in info.items()})
+
         @routes.get("/system_stats")
         async def system_stats(request):
             device = comfy.model_management.get_torch_device()
@@ -522,6 +694,10 @@ class PromptServer():
             }
             return web.json_response(system_stats)
 
+        @routes.get("/metrics")
+        async def get_metrics(request):
+            return web.Response(body=comfy.metrics.render().encode("utf-8"), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
         @routes.get("/prompt")
         async def get_prompt(request):
             return web.json_response(self.get_queue_info())
@@ -556,8 +732,7 @@ class PromptServer():
                 info['experimental'] = True
             return info
 
-        @routes.get("/object_info")
-        async def get_object_info(request):
+        def build_object_info():
             with folder_paths.cache_helper:
                 out = {}
                 for x in nodes.NODE_CLASS_MAPPINGS:
@@ -566,7 +741,19 @@ class PromptServer():
                     except Exception:
                         logging.error(f"[ERROR] An error occurred while retrieving information for the '{x}' node.")
                         logging.error(traceback.format_exc())
-                return web.json_response(out)
+                return out
+        self.build_object_info = build_object_info
+
+        @routes.get("/object_info")
+        async def get_object_info(request):
+            _, etag, body, gzip_body = await self.loop.run_in_executor(None, self.get_object_info_cached)
+            headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+            if etag in [x.strip() for x in request.headers.get("If-None-Match", "").split(",")]:
+                return web.Response(status=304, headers=headers)
+            if "gzip" in request.headers.get("Accept-Encoding", ""):
+                headers["Content-Encoding"] = "gzip"
+                body = gzip_body
+            return web.Response(body=body, content_type="application/json", headers=headers)
 
         @routes.get("/object_info/{node_class}")
         async def get_object_info_node(request):
@@ -581,7 +768,9 @@ class PromptServer():
             max_items = request.rel_url.query.get("max_items", None)
             if max_items is not None:
                 max_items = int(max_items)
-            return web.json_response(self.prompt_queue.get_history(max_items=max_items))
+            offset = int(request.rel_url.query.get("offset", -1))
+            status = request.rel_url.query.get("status", None)
+            return web.json_response(self.prompt_queue.get_history(max_items=max_items, offset=offset, status=status))
 
         @routes.get("/history/{prompt_id}")
         async def get_history_prompt_id(request):
@@ -591,9 +780,14 @@ class PromptServer():
         @routes.get("/queue")
         async def get_queue(request):
             queue_info = {}
-            current_queue = self.prompt_queue.get_current_queue()
+            max_items = request.rel_url.query.get("max_items", None)
+            if max_items is not None:
+                max_items = int(max_items)
+            offset = int(request.rel_url.query.get("offset", 0))
+            current_queue = self.prompt_queue.get_current_queue(max_items=max_items, offset=offset)
             queue_info['queue_running'] = current_queue[0]
             queue_info['queue_pending'] = current_queue[1]
+            queue_info['scheduler'] = self.prompt_queue.get_scheduler_stats()
             return web.json_response(queue_info)
 
         @routes.post("/prompt")
@@ -649,7 +843,22 @@ class PromptServer():
 
         @routes.post("/interrupt")
         async def post_interrupt(request):
-            nodes.interrupt_processing()
+            json_data = {}
+            if request.can_read_body:
+                json_data = await request.json()
+            if "prompt_id" in json_data:
+                prompt_ids = [json_data["prompt_id"]]
+            elif "client_id" in json_data:
+                # Every running prompt of that client, including the ones waiting in a batch (--batch-prompts).
+                running, _ = self.prompt_queue.get_current_queue()
+                prompt_ids = [x[1] for x in running if x[3].get("client_id") == json_data["client_id"]]
+            else:
+                # The prompt each prompt worker is executing, not the others taken with it for a batch: those can
+                # belong to other clients.
+                states = [self.execution_state] + self.worker_states
+                prompt_ids = [x["executing_prompt_id"] for x in states if x["executing_prompt_id"] is not None]
+            for prompt_id in prompt_ids:
+                nodes.interrupt_processing(True, prompt_id)
             return web.Response(status=200)
 
         @routes.post("/free")
@@ -680,6 +889,19 @@ class PromptServer():
         timeout = aiohttp.ClientTimeout(total=None) # no timeout
         self.client_session = aiohttp.ClientSession(timeout=timeout)
 
+    def get_object_info_cached(self):
+        """
+        The /object_info response as (version, etag, json, gzipped json). Only rebuilt when the node classes or the
+        folders their inputs list files from changed, which is cheap to check compared to calling every INPUT_TYPES.
+        """
+        version = (tuple((k, id(v)) for k, v in nodes.NODE_CLASS_MAPPINGS.items()), folder_paths.get_folders_version())
+        with self.object_info_lock:
+            if self.object_info is None or self.object_info[0] != version:
+                body = json.dumps(self.build_object_info()).encode("utf-8")
+                etag = '"{}"'.format(hashlib.sha256(body).hexdigest()[:32])
+                self.object_info = (version, etag, body, gzip.compress(body, compresslevel=6))
+            return self.object_info
+
     def add_routes(self):
         self.user_manager.add_routes(self.routes)
         self.model_file_manager.add_routes(self.routes)
@@ -708,6 +930,52 @@ class PromptServer():
             web.static('/', self.web_root),
         ])
 
+    def use_worker_state(self):
+        """
+        Tracks the client, node and prompt executing separately for the prompt worker running in the current context,
+        so concurrent workers (and custom nodes reading PromptServer.instance.client_id) don't see each other's.
+        """
+        state = {"client_id": None, "last_node_id": None, "last_prompt_id": None, "executing_prompt_id": None}
+        self.worker_states.append(state)
+        worker_state.set(state)
+
+    def get_execution_state(self):
+        state = worker_state.get()
+        return self.execution_state if state is None else state
+
+    @property
+    def client_id(self):
+        return self.get_execution_state()["client_id"]
+
+    @client_id.setter
+    def client_id(self, value):
+        self.get_execution_state()["client_id"] = value
+
+    @property
+    def last_node_id(self):
+        return self.get_execution_state()["last_node_id"]
+
+    @last_node_id.setter
+    def last_node_id(self, value):
+        self.get_execution_state()["last_node_id"] = value
+
+    @property
+    def last_prompt_id(self):
+        return self.get_execution_state()["last_prompt_id"]
+
+    @last_prompt_id.setter
+    def last_prompt_id(self, value):
+        self.get_execution_state()["last_prompt_id"] = value
+
+    @property
+    def executing_prompt_id(self):
+        # The prompt the worker took from the queue and is executing, or batching (last_prompt_id follows the progress).
+        return self.get_execution_state()["executing_prompt_id"]
+
+    @executing_prompt_id.setter
+    def executing_prompt_id(self, value):
+        self.get_execution_state()["executing_prompt_id"] = value
+
     def get_queue_info(self):
         prompt_info = {}
         exec_info = {}
@@ -733,50 +1001,31 @@ class PromptServer():
         return message
 
     async def send_image(self, image_data, sid=None):
-        image_type = image_data[0]
-        image = image_data[1]
-        max_size = image_data[2]
-        if max_size is not None:
-            if hasattr(Image, 'Resampling'):
-                resampling = Image.Resampling.BILINEAR
-            else:
-                resampling = Image.ANTIALIAS
-
-            image = ImageOps.contain(image, (max_size, max_size), resampling)
-        type_num = 1
-        if image_type == "JPEG":
-            type_num = 1
-        elif image_type == "PNG":
-            type_num = 2
-
-        bytesIO = BytesIO()
-        header = struct.pack(">I", type_num)
-        bytesIO.write(header)
-        image.save(bytesIO, format=image_type, quality=95, compress_level=1)
-        preview_bytes = bytesIO.getvalue()
-        await self.send_bytes(BinaryEventTypes.PREVIEW_IMAGE, preview_bytes, sid=sid)
+        await self.send_bytes(BinaryEventTypes.PREVIEW_IMAGE, encode_preview_image(image_data), sid=sid)
 
     async def send_bytes(self, event, data, sid=None):
-        message = self.encode_bytes(event, data)
-
-        if sid is None:
-            sockets = list(self.sockets.values())
-            for ws in sockets:
-                await send_socket_catch_exception(ws.send_bytes, message)
-        elif sid in self.sockets:
-            await send_socket_catch_exception(self.sockets[sid].send_bytes, message)
+        message = bytes(self.encode_bytes(event, data))
+        self.send_message(message, "preview" if event == BinaryEventTypes.PREVIEW_IMAGE else None, sid)
 
     async def send_json(self, event, data, sid=None):
-        message = {"type": event, "data": data}
+        message = json.dumps({"type": event, "data": data})
+        self.send_message(message, "progress" if event == "progress" else None, sid)
 
+    def send_message(self, message, drop_key, sid):
+        """Queues an encoded message for one client or all of them, it is shared by all recipients."""
         if sid is None:
-            sockets = list(self.sockets.values())
-            for ws in sockets:
-                await send_socket_catch_exception(ws.send_json, message)
-        elif sid in self.sockets:
-            await send_socket_catch_exception(self.sockets[sid].send_json, message)
+            clients = list(self.clients.values())
+        elif sid in self.clients:
+            clients = [self.clients[sid]]
+        else:
+            clients = []
+        for client in clients:
+            client.put(message, drop_key)
 
     def send_sync(self, event, data, sid=None):
+        if event == BinaryEventTypes.UNENCODED_PREVIEW_IMAGE:
+            self.preview_encoder.put(data, sid)
+            return
         self.loop.call_soon_threadsafe(
             self.messages.put_nowait, (event, data, sid))
 
@@ -786,7 +1035,12 @@ class PromptServer():
     async def publish_loop(self):
         while True:
             msg = await self.messages.get()
+            send_start = time.perf_counter()
             await self.send(*msg)
+            if msg[0] == BinaryEventTypes.PREVIEW_IMAGE and msg[2] not in self.clients:
+                # Broadcast or the client is gone: no WebSocketClient reports this preview as sent.
+                self.preview_encoder.sent(msg[2])
+            comfy.metrics.websocket_send_seconds.observe(time.perf_counter() - send_start)
 
     async def start(self, address, port, verbose=True, call_on_start=None):
         await self.start_multi_address([(address, port)], call_on_start=call_on_start)
@@ -0,0 +1,79 @@
+import json
+import struct
+import pytest
+import torch
+
+
+@pytest.fixture(scope="module")
+def comfy_modules():
+    from comfy.cli_args import args
+    args.cpu = True
+    import comfy.sd
+    import comfy.ops
+    import comfy.model_detection
+    from comfy.ldm.modules.diffusionmodules.openaimodel import UNetModel
+    return comfy.sd, comfy.ops, comfy.model_detection, UNetModel
+
+
+def write_header_only(path, sd):
+    # Only the header: detection must not need any of the data.
+    header = {}
+    offset = 0
+    for k, v in sd.items():
+        size = v.numel() * v.element_size()
+        header[k] = {"dtype": {torch.float16: "F16", torch.float32: "F32"}[v.dtype], "shape": list(v.shape), "data_offsets": [offset, offset + size]}
+        offset += size
+    header["__metadata__"] = {"format": "pt"}
+    data = json.dumps(header).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(data)))
+        f.write(data)
+
+
+def test_detects_checkpoint_from_header(comfy_modules, tmp_path):
+    sd_module, ops, model_detection, UNetModel = comfy_modules
+    sd15 = {'use_checkpoint': False, 'image_size': 32, 'out_channels': 4, 'use_spatial_transformer': True, 'legacy': False, 'adm_in_channels': None,
+            'dtype': torch.float16, 'in_channels': 4, 'model_channels': 320, 'num_res_blocks': [2, 2, 2, 2], 'transformer_depth': [1, 1, 1, 1, 1, 1, 0, 0],
+            'channel_mult': [1, 2, 4, 4], 'transformer_depth_middle': 1, 'use_linear_in_transformer': False, 'context_dim': 768, 'num_heads': 8,
+            'transformer_depth_output': [1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0],
+            'use_temporal_attention': False, 'use_temporal_resblock': False}
+    unet = UNetModel(**model_detection.convert_config(sd15), device="meta", operations=ops.disable_weight_init)
+    sd = {"model.diffusion_model." + k: v.half() for k, v in unet.state_dict().items()}
+    sd["first_stage_model.decoder.conv_out.weight"] = torch.empty(3, 128, 3, 3, device="meta")
+
+    path = str(tmp_path / "model.safetensors")
+    write_header_only(path, sd)
+    info = sd_module.detect_checkpoint(path)
+    assert info["model_type"] == "SD15"
+    assert info["weight_dtype"] == torch.float16
+    assert info["parameters"] == sum(v.numel() for k, v in sd.items() if k.startswith("model.diffusion_model."))
+    assert info["vae"] and not info["clip"] and not info["clip_vision"]
+    # What the loader uses instead of working it out again.
+    assert info["load_device"] == torch.device("cpu")
+    assert info["unet_dtype"] in (torch.float16, torch.float32)
+
+
+def test_unknown_checkpoint_fails_before_loading(comfy_modules, tmp_path):
+    sd_module = comfy_modules[0]
+    path = str(tmp_path / "other.safetensors")
+    write_header_only(path, {"some.weight": torch.empty(4, 4, device="meta")})
+    assert sd_module.detect_checkpoint(path) is None
+    with pytest.raises(RuntimeError, match="Could not detect model type"):
+        sd_module.load_checkpoint_guess_config(path)
+
+
+def test_unreadable_header_falls_through_to_loading(comfy_modules, tmp_path):
+    sd_module = comfy_modules[0]
+    path = str(tmp_path / "other.safetensors")
+    write_header_only(path, {"some.weight": torch.empty(4, 4, device="meta")})
+    assert sd_module.is_undetectable_checkpoint(path)
+
+    # A dtype the header can't be read as meta tensors with: only loading the weights tells.
+    data = json.dumps({"some.weight": {"dtype": "F4", "shape": [4, 4], "data_offsets": [0, 8]}}).encode("utf-8")
+    unknown_path = str(tmp_path / "unknown_dtype.safetensors")
+    with open(unknown_path, "wb") as f:
+        f.write(struct.pack("<Q", len(data)))
+        f.write(data)
+    assert sd_module.detect_checkpoint(unknown_path) is None
+    assert not sd_module.is_undetectable_checkpoint(unknown_path)
+    assert not sd_module.is_undetectable_checkpoint(str(tmp_path / "model.ckpt"))
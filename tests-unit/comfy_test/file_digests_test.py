@@ -0,0 +1,42 @@
+import os
+import hashlib
+
+from comfy.file_digests import FileDigestCache
+
+
+def test_unchanged_file_is_hashed_once(tmp_path):
+    path = tmp_path / "image.png"
+    path.write_bytes(b"first")
+    cache = FileDigestCache()
+    assert cache.digest(str(path)) == hashlib.sha256(b"first").hexdigest()
+    assert cache.digest(str(path)) == hashlib.sha256(b"first").hexdigest()
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    path.write_bytes(b"second!")
+    assert cache.digest(str(path)) == hashlib.sha256(b"second!").hexdigest()
+    assert cache.digest(str(path), "md5") == hashlib.md5(b"second!").hexdigest()
+    assert cache.misses == 3
+
+
+def test_same_size_rewrite_is_detected(tmp_path):
+    path = tmp_path / "image.png"
+    path.write_bytes(b"aaaa")
+    cache = FileDigestCache()
+    cache.digest(str(path))
+    st = os.stat(path)
+    path.write_bytes(b"bbbb")
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+    assert cache.digest(str(path)) == hashlib.sha256(b"bbbb").hexdigest()
+
+
+def test_digests_persist(tmp_path):
+    path = tmp_path / "image.png"
+    path.write_bytes(b"data")
+    cache_path = str(tmp_path / "digests.json")
+    cache = FileDigestCache(cache_path)
+    cache.digest(str(path))
+    cache.save()
+
+    cache = FileDigestCache(cache_path)
+    assert cache.digest(str(path)) == hashlib.sha256(b"data").hexdigest()
+    assert (cache.hits, cache.misses) == (1, 0)
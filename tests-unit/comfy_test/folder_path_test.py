@@ -63,4 +63,35 @@ def test_get_save_image_path(temp_dir):
         assert filename == "test"
         assert counter == 1
         assert subfolder == ""
-        assert filename_prefix == "test"
\ No newline at end of file
+        assert filename_prefix == "test"
+
+
+def test_save_counters_without_listing(temp_dir):
+    for name in ["test_00007_.png", "test_00002_.latent", "test_sub_00040_.png", "Other_00003_.png"]:
+        open(os.path.join(temp_dir, name), "w").close()
+    index = folder_paths.SaveCounterIndex()
+    assert index.next_counter(temp_dir, "test") == 8
+    assert index.next_counter(temp_dir, "test_sub") == 41
+
+    # A batch of 3 images saved with the counter: the next save probes past them.
+    for i in range(8, 11):
+        open(os.path.join(temp_dir, "test_{:05}_.png".format(i)), "w").close()
+    open(os.path.join(temp_dir, "test_00011_.latent.tmp"), "w").close()
+    with patch("os.listdir", side_effect=AssertionError("listed")):
+        assert index.next_counter(temp_dir, "test") == 12
+        assert index.next_counter(temp_dir, "test") == 13
+
+    # Unknown names: the folder is listed again.
+    open(os.path.join(temp_dir, "new_00001_.webp"), "w").close()
+    assert index.next_counter(temp_dir, "new") == 2
+    assert index.next_counter(temp_dir, "new") == 3
+    open(os.path.join(temp_dir, "new_00003_.webp"), "w").close()
+    assert index.next_counter(temp_dir, "new") == 4
+
+    # A fresh prefix in a folder that changed externally is listed again after the interval.
+    open(os.path.join(temp_dir, "ext_00005_.png"), "w").close()
+    with patch.object(folder_paths.SaveCounterIndex, "RESCAN_INTERVAL", 0.0):
+        os.utime(temp_dir, ns=(0, 1))
+        assert index.next_counter(temp_dir, "ext") == 6
+        # Counters handed out but not saved yet are kept.
+        assert index.next_counter(temp_dir, "test") == 14
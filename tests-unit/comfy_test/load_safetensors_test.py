@@ -0,0 +1,69 @@
+import torch
+import safetensors.torch
+
+import comfy.utils
+
+
+def rss_anon_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1])
+    return None
+
+
+def test_matches_safetensors(tmp_path):
+    path = str(tmp_path / "model.safetensors")
+    sd = {
+        "a": torch.randn(3, 5),
+        "b": torch.randn(7).to(torch.bfloat16),
+        "c": torch.arange(3, dtype=torch.int64),
+        "d": torch.ones(3, dtype=torch.uint8),
+        "e": torch.zeros(0, 4),
+        "f": torch.tensor([True, False, True]),
+        "g": torch.randn(2, 2).half(),
+    }
+    safetensors.torch.save_file(sd, path, metadata={"format": "pt"})
+    expected = safetensors.torch.load_file(path)
+    loaded = comfy.utils.load_safetensors(path)
+    assert loaded.keys() == expected.keys()
+    for k in expected:
+        assert loaded[k].dtype == expected[k].dtype
+        assert torch.equal(loaded[k], expected[k])
+
+    # Copy on write: changing a loaded tensor doesn't touch the file.
+    loaded["a"] += 1
+    assert torch.equal(comfy.utils.load_torch_file(path)["a"], sd["a"])
+
+
+def test_tensors_are_not_copied_into_process_memory(tmp_path):
+    path = str(tmp_path / "big.safetensors")
+    safetensors.torch.save_file({"w": torch.zeros(64, 1024, 1024)}, path)
+    before = rss_anon_kb()
+    sd = comfy.utils.load_torch_file(path)
+    sd["w"].sum()
+    if before is not None:
+        assert rss_anon_kb() - before < 64 * 1024
+
+
+def test_unsupported_dtypes_fall_back_to_safetensors(tmp_path, monkeypatch):
+    path = str(tmp_path / "model.safetensors")
+    sd = {"a": torch.randn(3, 5), "b": torch.randn(4).half()}
+    safetensors.torch.save_file(sd, path)
+    monkeypatch.setattr(comfy.utils, "SAFETENSORS_DTYPES", {k: v for k, v in comfy.utils.SAFETENSORS_DTYPES.items() if k != "F16"})
+    loaded = comfy.utils.load_safetensors(path)
+    for k in sd:
+        assert torch.equal(loaded[k], sd[k])
+    # Nothing to load the header as meta tensors with.
+    assert comfy.utils.safetensors_meta_state_dict(path) is None
+
+
+def test_unsigned_dtypes(tmp_path):
+    path = str(tmp_path / "model.safetensors")
+    values = torch.tensor([1, 2, 65535], dtype=torch.int64)
+    sd = {"u16": values.to(torch.uint16), "u32": values.to(torch.uint32), "u64": values.to(torch.uint64)}
+    safetensors.torch.save_file(sd, path)
+    loaded = comfy.utils.load_safetensors(path)
+    for k in sd:
+        assert loaded[k].dtype == sd[k].dtype
+        assert torch.equal(loaded[k].to(torch.int64), values)
@@ -0,0 +1,100 @@
+import json
+import pytest
+import torch
+
+from comfy.memory_estimates import MemoryEstimates, PeakMemoryScope, SAFETY_MARGIN
+
+
+def test_disabled_without_path():
+    estimates = MemoryEstimates()
+    estimates.record("model", (2, 4, 64, 64), 1000)
+    assert estimates.estimate("model", (2, 4, 64, 64)) is None
+
+
+def test_estimates_scale_with_batch_and_keep_the_peak(tmp_path):
+    path = str(tmp_path / "estimates.json")
+    estimates = MemoryEstimates(path)
+    estimates.record("model", (2, 4, 64, 64), 2000)
+    estimates.record("model", (1, 4, 64, 64), 500)
+    assert estimates.estimate("model", (4, 4, 64, 64)) == 4000 * SAFETY_MARGIN
+    assert estimates.estimate("other", (1, 4, 64, 64)) is None
+
+    estimates.save()
+    with open(path) as f:
+        assert json.load(f) == {"model|4x64x64": 1000}
+    assert MemoryEstimates(path).estimate("model", (1, 4, 64, 64)) == 1000 * SAFETY_MARGIN
+
+
+def test_unseen_shapes_use_the_bytes_per_element(tmp_path):
+    path = str(tmp_path / "estimates.json")
+    estimates = MemoryEstimates(path)
+    estimates.record("model", (1, 4, 64, 64), 4 * 64 * 64 * 2)
+    estimates.record("model", (1, 4, 32, 32), 4 * 32 * 32 * 3)
+    # The most bytes per element measured, times the elements of the new shape.
+    assert estimates.estimate("model", (2, 4, 128, 128)) == 2 * 4 * 128 * 128 * 3 * SAFETY_MARGIN
+    assert estimates.estimate("model", (1, 4, 64, 64)) == 4 * 64 * 64 * 2 * SAFETY_MARGIN
+
+    estimates.save()
+    assert MemoryEstimates(path).estimate("model", (1, 4, 16, 16)) == 4 * 16 * 16 * 3 * SAFETY_MARGIN
+
+
+def test_measure_skips_devices_without_stats(tmp_path):
+    estimates = MemoryEstimates(str(tmp_path / "estimates.json"))
+    with estimates.measure("model", (1, 4), torch.device("cpu")):
+        torch.ones(1000)
+    assert estimates.estimates == {}
+
+
+def test_corrupt_file_is_ignored(tmp_path):
+    path = tmp_path / "estimates.json"
+    path.write_text("{not json")
+    estimates = MemoryEstimates(str(path))
+    assert estimates.estimates == {}
+
+
+class FakeAllocator:
+    def __init__(self, monkeypatch):
+        self.allocated = 100
+        self.peak = 1000
+        monkeypatch.setattr(torch.cuda, "memory_allocated", lambda device=None: self.allocated)
+        monkeypatch.setattr(torch.cuda, "max_memory_allocated", lambda device=None: self.peak)
+        monkeypatch.setattr(torch.cuda, "reset_peak_memory_stats", self.reset)
+
+    def reset(self, device=None):
+        self.peak = self.allocated
+
+    def allocate(self, size):
+        self.allocated += size
+        self.peak = max(self.peak, self.allocated)
+
+
+def test_measure_is_scoped_to_the_block(tmp_path, monkeypatch):
+    allocator = FakeAllocator(monkeypatch)
+    estimates = MemoryEstimates(str(tmp_path / "estimates.json"))
+    device = torch.device("cuda")
+
+    # Measured even though the process peak so far is higher.
+    with estimates.measure("model", (1, 4), device):
+        allocator.allocate(300)
+        allocator.allocate(-300)
+    assert estimates.estimates == {"model|4": 300}
+
+    with estimates.measure("model", (2, 8), device):
+        allocator.allocate(500)
+    assert estimates.estimates["model|8"] == 250
+
+
+def test_nested_scopes_keep_the_outer_peak(monkeypatch):
+    allocator = FakeAllocator(monkeypatch)
+    device = torch.device("cuda")
+    outer = PeakMemoryScope(device)
+    outer.start()
+    allocator.allocate(400)
+    allocator.allocate(-400)
+
+    inner = PeakMemoryScope(device)
+    inner.start()
+    allocator.allocate(100)
+    assert inner.stop() == 100
+    # The inner scope reset the peak stats, the outer one still saw the 400.
+    assert outer.stop() == 400
@@ -0,0 +1,51 @@
+import math
+import pytest
+
+import comfy.metrics
+from comfy.metrics import Counter, Gauge, Histogram
+
+
+@pytest.fixture
+def registry():
+    # Keep the test metrics out of the module registry served by /metrics.
+    registry = []
+    yield registry
+    assert not any(metric in comfy.metrics.registry for metric in registry)
+
+
+def test_counter_labels(registry):
+    counter = Counter("test_counter_total", "A counter.", registry=registry)
+    counter.inc(status="success")
+    counter.inc(2, status="success")
+    counter.inc(status="error")
+    lines = counter.render().splitlines()
+    assert lines[:2] == ["# HELP test_counter_total A counter.", "# TYPE test_counter_total counter"]
+    assert 'test_counter_total{status="success"} 3' in lines
+    assert 'test_counter_total{status="error"} 1' in lines
+
+
+def test_gauge_function(registry):
+    items = [1, 2, 3]
+    gauge = Gauge("test_gauge", "A gauge.", function=lambda: len(items), registry=registry)
+    assert "test_gauge 3" in gauge.render().splitlines()
+    items.pop()
+    assert "test_gauge 2" in gauge.render().splitlines()
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = Histogram("test_seconds", "A histogram.", buckets=(0.1, 1.0), registry=registry)
+    assert histogram.buckets[-1] == math.inf
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value)
+    lines = histogram.render().splitlines()
+    assert 'test_seconds_bucket{le="0.1"} 2' in lines
+    assert 'test_seconds_bucket{le="1.0"} 3' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 4' in lines
+    assert "test_seconds_count 4" in lines
+    assert "test_seconds_sum 5.65" in lines
+
+
+def test_render_registry(registry):
+    Counter("test_counter_total", "A counter.", registry=registry).inc()
+    assert comfy.metrics.render(registry).splitlines()[-1] == "test_counter_total 1"
+    assert "test_counter_total" not in comfy.metrics.render()
@@ -0,0 +1,67 @@
+import os
+import threading
+import pytest
+
+import folder_paths
+from comfy.output_writer import OutputWriter
+
+
+def test_pending_write_reserves_name(tmp_path):
+    writer = OutputWriter(2)
+    started = threading.Event()
+    release = threading.Event()
+
+    def save(f, data):
+        started.set()
+        release.wait()
+        f.write(data)
+
+    path = str(tmp_path / "ComfyUI_00001_.png")
+    writer.write(path, save, b"png")
+    started.wait()
+    assert writer.get_pending(path) is not None
+    assert not os.path.exists(path)
+    # The next save gets the next counter while the first one is still written.
+    assert folder_paths.get_save_image_path("ComfyUI", str(tmp_path))[2] == 2
+
+    release.set()
+    writer.flush()
+    assert writer.get_pending(path) is None
+    assert os.listdir(tmp_path) == ["ComfyUI_00001_.png"]
+    with open(path, "rb") as f:
+        assert f.read() == b"png"
+
+
+def test_failed_write_leaves_no_file(tmp_path):
+    def save(f):
+        f.write(b"partial")
+        raise ValueError("encoding failed")
+
+    writer = OutputWriter(1)
+    writer.write(str(tmp_path / "a.png"), save)
+    writer.flush()
+    with pytest.raises(ValueError):
+        OutputWriter(0).write(str(tmp_path / "b.png"), save)
+    assert os.listdir(tmp_path) == []
+
+
+def test_write_blocks_when_too_many_are_pending(tmp_path):
+    from comfy.output_writer import MAX_PENDING_PER_WORKER
+    writer = OutputWriter(1)
+    release = threading.Event()
+
+    def save(f):
+        release.wait()
+
+    for i in range(MAX_PENDING_PER_WORKER):
+        writer.write(str(tmp_path / "{}.png".format(i)), save)
+    blocked = threading.Thread(target=writer.write, args=(str(tmp_path / "last.png"), save))
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()
+
+    release.set()
+    blocked.join(5)
+    assert not blocked.is_alive()
+    writer.flush()
+    assert len(os.listdir(tmp_path)) == MAX_PENDING_PER_WORKER + 1
@@ -0,0 +1,40 @@
+import pytest
+import torch
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    from comfy.cli_args import args
+    args.cpu = True
+    import comfy.model_management
+    pool = comfy.model_management.PinnedModelPool(budget=1000)
+    # No CUDA here: plain CPU buffers stand in for pinned memory.
+    monkeypatch.setattr(pool, "allocate", lambda shape, dtype: torch.empty(shape, dtype=dtype))
+    return pool
+
+
+def test_buffers_are_reused(pool):
+    linear = torch.nn.Linear(10, 10)
+    buffer = pool.get_buffer(linear, "weight", linear.weight)
+    assert buffer.shape == linear.weight.shape
+    assert pool.get_buffer(linear, "weight", linear.weight) is buffer
+    assert pool.size == 400
+
+
+def test_least_recently_used_idle_buffers_are_released(pool):
+    a = torch.nn.Linear(10, 10, bias=False)
+    b = torch.nn.Linear(10, 10, bias=False)
+    c = torch.nn.Linear(10, 10, bias=False)
+    buffer_a = pool.get_buffer(a, "weight", a.weight)
+    pool.get_buffer(b, "weight", b.weight)
+    # a's weight is offloaded into its buffer: that one has to stay.
+    a.weight.data = buffer_a
+    assert pool.get_buffer(c, "weight", c.weight) is not None
+    assert set(k[0] for k in pool.buffers) == {id(a), id(c)}
+    assert pool.size == 800
+
+    # Nothing left that can be released: the weight isn't pooled.
+    c.weight.data = pool.buffers[(id(c), "weight")][1]
+    d = torch.nn.Linear(10, 10, bias=False)
+    assert pool.get_buffer(d, "weight", d.weight) is None
+    assert pool.get_buffer(d, "weight", torch.empty(1000)) is None
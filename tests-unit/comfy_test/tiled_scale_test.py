@@ -0,0 +1,45 @@
+import pytest
+import torch
+
+
+@pytest.fixture(scope="module")
+def utils():
+    from comfy.cli_args import args
+    args.cpu = True
+    import comfy.utils
+    return comfy.utils
+
+
+class CountingConv:
+    def __init__(self):
+        torch.manual_seed(0)
+        self.conv = torch.nn.Conv2d(3, 3, 3, padding=1)
+        self.batch_sizes = []
+
+    def __call__(self, x):
+        self.batch_sizes.append(x.shape[0])
+        with torch.no_grad():
+            return torch.nn.functional.interpolate(self.conv(x), scale_factor=2, mode="nearest")
+
+
+def test_batched_tiles_match_sequential(utils):
+    samples = torch.rand(2, 3, 100, 75)
+    function = CountingConv()
+    sequential = utils.tiled_scale(samples, function, tile_x=32, tile_y=32, overlap=8, upscale_amount=2)
+    assert max(function.batch_sizes) == 1
+    calls = len(function.batch_sizes)
+
+    function.batch_sizes.clear()
+    batched = utils.tiled_scale(samples, function, tile_x=32, tile_y=32, overlap=8, upscale_amount=2, tile_batch_size=4)
+    assert max(function.batch_sizes) == 4
+    assert sum(function.batch_sizes) == calls
+    assert len(function.batch_sizes) < calls
+    assert torch.allclose(sequential, batched, atol=1e-5)
+
+
+def test_batched_tiles_3d(utils):
+    samples = torch.rand(1, 2, 9, 20, 20)
+    function = lambda x: x * 2
+    out = utils.tiled_scale_multidim(samples, function, tile=(4, 8, 8), overlap=(1, 2, 2), upscale_amount=1, out_channels=2, tile_batch_size=8)
+    assert torch.allclose(out, samples * 2, atol=1e-5)
+
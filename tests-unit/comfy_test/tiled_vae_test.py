@@ -0,0 +1,86 @@
+import pytest
+import torch
+
+
+@pytest.fixture(scope="module")
+def comfy_modules():
+    from comfy.cli_args import args
+    args.cpu = True
+    import comfy.sd
+    import comfy.utils
+    return comfy.sd, comfy.utils
+
+
+@pytest.fixture(scope="module")
+def vae(comfy_modules):
+    sd_module, _ = comfy_modules
+    ddconfig = {'double_z': True, 'z_channels': 4, 'resolution': 256, 'in_channels': 3, 'out_ch': 3, 'ch': 32, 'ch_mult': [1, 2, 4, 4], 'num_res_blocks': 1, 'attn_resolutions': [], 'dropout': 0.0}
+    vae = sd_module.VAE(sd={}, config={"params": {"embed_dim": 4, "ddconfig": ddconfig}}, dtype=torch.float32)
+    torch.manual_seed(0)
+    with torch.no_grad():
+        for p in vae.first_stage_model.parameters():
+            p.normal_(0, 0.05)
+    return vae
+
+
+def upscale(x):
+    return torch.nn.functional.interpolate(x, scale_factor=2, mode="nearest")
+
+
+def test_tiled_scale_blends_to_exact_result(comfy_modules):
+    _, utils = comfy_modules
+    samples = torch.rand(2, 3, 50, 70)
+    out = utils.tiled_scale(samples, upscale, tile_x=24, tile_y=16, overlap=4, upscale_amount=2)
+    assert torch.allclose(out, upscale(samples), atol=1e-5)
+
+
+def test_single_pass_runs_decoder_once_per_tile(vae):
+    calls = []
+    decode = vae.first_stage_model.decode
+    vae.first_stage_model.decode = lambda x: calls.append(x.shape[0]) or decode(x)
+    try:
+        latent = torch.randn(1, 4, 48, 48)
+        vae.decode_tiled(latent, tile_x=24, tile_y=24, overlap=6, single_pass=True)
+        single = sum(calls)
+        calls.clear()
+        vae.decode_tiled(latent, tile_x=24, tile_y=24, overlap=6)
+        assert single * 2 < sum(calls)
+    finally:
+        del vae.first_stage_model.decode
+
+
+@pytest.mark.parametrize("size", [32, 48])
+def test_single_pass_matches_triple_pass(vae, size):
+    torch.manual_seed(1)
+    latent = torch.randn(1, 4, size, size)
+    with torch.inference_mode():
+        reference = vae.decode(latent)
+        triple = vae.decode_tiled(latent, tile_x=16, tile_y=16, overlap=4)
+        single = vae.decode_tiled(latent, tile_x=16, tile_y=16, overlap=4, single_pass=True)
+
+    # Tiles only differ from the full decode near their seams, where they are blended.
+    assert torch.allclose(single, triple, atol=0.02)
+    assert torch.allclose(single, reference, atol=0.05)
+
+
+def test_tile_batches_are_halved_on_oom(vae, comfy_modules, monkeypatch):
+    import comfy.model_management
+    batch_sizes = []
+    decode = vae.first_stage_model.decode
+    def decode_small_batches(x):
+        batch_sizes.append(x.shape[0])
+        if x.shape[0] > 2:
+            raise comfy.model_management.OOM_EXCEPTION()
+        return decode(x)
+    monkeypatch.setattr(vae.first_stage_model, "decode", decode_small_batches)
+    monkeypatch.setattr(vae, "tile_batch_size", lambda memory_used: 8)
+
+    latent = torch.randn(1, 4, 48, 48)
+    with torch.inference_mode():
+        images = vae.decode_tiled(latent, tile_x=16, tile_y=16, overlap=4, single_pass=True)
+        monkeypatch.setattr(vae.first_stage_model, "decode", decode)
+        monkeypatch.setattr(vae, "tile_batch_size", lambda memory_used: 1)
+        reference = vae.decode_tiled(latent, tile_x=16, tile_y=16, overlap=4, single_pass=True)
+    assert batch_sizes[:2] == [8, 4]
+    assert max(batch_sizes[2:]) == 2
+    assert torch.allclose(images, reference, atol=1e-5)
@@ -0,0 +1,91 @@
+import time
+import pytest
+
+
+class NoChanges:
+    def get(self, node_id):
+        return False
+
+
+@pytest.fixture(scope="module")
+def signatures():
+    # Imported here rather than at collection time: importing the node definitions initializes the
+    # device and puts comfy/ on sys.path, which would shadow the top level utils package.
+    from comfy.cli_args import args
+    args.cpu = True
+    from comfy_execution.graph import DynamicPrompt
+    from comfy_execution.caching import CacheKeySetInputSignature
+
+    def signatures(prompt):
+        return CacheKeySetInputSignature(DynamicPrompt(prompt), prompt.keys(), NoChanges())
+    return signatures
+
+
+def empty_latent(width=64):
+    return {"class_type": "EmptyLatentImage", "inputs": {"width": width, "height": 64, "batch_size": 1}}
+
+
+def upscale(source, scale_by=1.5):
+    return {"class_type": "LatentUpscaleBy", "inputs": {"samples": [source, 0], "upscale_method": "nearest-exact", "scale_by": scale_by}}
+
+
+def composite(to_id, from_id):
+    return {"class_type": "LatentComposite", "inputs": {"samples_to": [to_id, 0], "samples_from": [from_id, 0], "x": 0, "y": 0, "feather": 0}}
+
+
+def make_graph(size):
+    """A deep chain with a composite every few nodes pulling in a second, shared branch."""
+    prompt = {"0": empty_latent(), "side": empty_latent(128)}
+    for i in range(1, size - 1):
+        if i % 4 == 0:
+            prompt[str(i)] = composite(str(i - 1), "side")
+        else:
+            prompt[str(i)] = upscale(str(i - 1))
+    return prompt
+
+
+def test_identical_subgraphs_share_signatures(signatures):
+    prompt = {"1": empty_latent(), "2": upscale("1"), "3": empty_latent(), "4": upscale("3")}
+    keys = signatures(prompt)
+    assert keys.get_data_key("2") == keys.get_data_key("4")
+    assert keys.get_data_key("1") != keys.get_data_key("2")
+
+
+def test_upstream_change_only_invalidates_descendants(signatures):
+    prompt = {"1": empty_latent(), "2": upscale("1"), "3": empty_latent(96), "4": composite("2", "3")}
+    before = signatures(prompt)
+    prompt["1"] = empty_latent(128)
+    after = signatures(prompt)
+    assert before.get_data_key("3") == after.get_data_key("3")
+    for node_id in ("1", "2", "4"):
+        assert before.get_data_key(node_id) != after.get_data_key(node_id)
+
+
+def test_input_order_matters(signatures):
+    prompt = {"1": empty_latent(), "2": empty_latent(96), "3": composite("1", "2"), "4": composite("2", "1")}
+    keys = signatures(prompt)
+    assert keys.get_data_key("3") != keys.get_data_key("4")
+
+
+def test_missing_ancestor_is_uncacheable(signatures):
+    prompt = {"1": upscale("missing"), "2": upscale("1")}
+    keys = signatures(prompt)
+    assert not isinstance(keys.get_data_key("1"), str)
+    assert not isinstance(keys.get_data_key("2"), str)
+    assert keys.get_data_key("2") != signatures(prompt).get_data_key("2")
+
+
+@pytest.mark.parametrize("size", [100, 1000, 10000])
+def test_signature_benchmark(signatures, size):
+    prompt = make_graph(size)
+    start = time.perf_counter()
+    keys = signatures(prompt)
+    elapsed = time.perf_counter() - start
+    assert len(keys.all_node_ids()) == len(prompt)
+    assert all(isinstance(keys.get_data_key(node_id), str) for node_id in prompt)
+
+    print(f"\ncache signatures for {size} nodes: {elapsed * 1000:.1f}ms")
+
+    # Signatures are stable across prompts, so an unchanged graph hits the cache.
+    again = signatures(make_graph(size))
+    assert all(keys.get_data_key(node_id) == again.get_data_key(node_id) for node_id in prompt)
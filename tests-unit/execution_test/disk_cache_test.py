@@ -0,0 +1,109 @@
+import os
+import pytest
+import torch
+
+from comfy_execution.disk_cache import DiskCacheStore, serialize_value, deserialize_value, NotSerializableError
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / "cache")
+
+
+def test_serialize_roundtrip():
+    value = [[{"samples": torch.ones(1, 4, 8, 8)}], [[[torch.zeros(1, 77, 16), {"pooled_output": torch.ones(1, 16)}]]], [3, 0.5, "text", None, (1, 2)]]
+    structure, tensors = serialize_value(value)
+    out = deserialize_value(structure, tensors.__getitem__)
+    assert torch.equal(out[0][0]["samples"], value[0][0]["samples"])
+    assert torch.equal(out[1][0][0][1]["pooled_output"], value[1][0][0][1]["pooled_output"])
+    assert out[2] == [3, 0.5, "text", None, (1, 2)]
+
+
+def test_serialize_rejects_objects():
+    with pytest.raises(NotSerializableError):
+        serialize_value([[object()]])
+
+
+def test_store_persists_across_instances(cache_dir):
+    store = DiskCacheStore(cache_dir, max_bytes=1024 * 1024)
+    assert store.set("abc", [[torch.arange(10)]])
+    assert not store.set("primitives_only", [[1, 2, 3]])
+
+    reopened = DiskCacheStore(cache_dir, max_bytes=1024 * 1024)
+    assert "abc" in reopened
+    assert torch.equal(reopened.get("abc")[0][0], torch.arange(10))
+    assert reopened.get("missing") is None
+
+
+def test_store_evicts_least_recently_used(cache_dir):
+    store = DiskCacheStore(cache_dir, max_bytes=3 * 4096 + 2048)
+    for key in ("a", "b", "c"):
+        store.set(key, [[torch.zeros(1024)]])
+    store.get("a")
+    store.set("d", [[torch.zeros(1024)]])
+    assert "a" in store
+    assert "b" not in store
+    assert not os.path.exists(os.path.join(cache_dir, "b.safetensors"))
+    assert store.total_bytes <= store.max_bytes
+
+
+def test_store_drops_corrupt_entries(cache_dir):
+    store = DiskCacheStore(cache_dir, max_bytes=1024 * 1024)
+    store.set("abc", [[torch.ones(4)]])
+    with open(os.path.join(cache_dir, "abc.safetensors"), "wb") as f:
+        f.write(b"garbage")
+    assert store.get("abc") is None
+    assert "abc" not in store
+
+
+class TestLoader:
+    RETURN_TYPES = ("LATENT",)
+    FUNCTION = "run"
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"ckpt_name": ("STRING",)}}
+
+
+class TestScale:
+    RETURN_TYPES = ("LATENT",)
+    FUNCTION = "run"
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"samples": ("LATENT",)}}
+
+
+def test_tiered_cache_key_covers_model_files(cache_dir, tmp_path, monkeypatch):
+    # See cache_signature_test.py for why these are imported here.
+    from comfy.cli_args import args
+    args.cpu = True
+    import nodes
+    import folder_paths
+    from comfy_execution.caching import DiskTieredCache, LRUCache, CacheKeySetInputSignature
+    from comfy_execution.graph import DynamicPrompt
+    models = tmp_path / "models"
+    models.mkdir()
+    model = models / "model.safetensors"
+    model.write_bytes(b"weights")
+    monkeypatch.setattr(folder_paths, "folder_names_and_paths", {"checkpoints": ([str(models)], {".safetensors"})})
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "TestLoader", TestLoader)
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "TestScale", TestScale)
+    prompt = {"1": {"class_type": "TestLoader", "inputs": {"ckpt_name": "model.safetensors"}},
+              "2": {"class_type": "TestScale", "inputs": {"samples": ["1", 0]}}}
+    store = DiskCacheStore(cache_dir, max_bytes=1024 * 1024)
+
+    def start_prompt():
+        # A new in-memory cache every time, as after a restart.
+        cache = DiskTieredCache(LRUCache(CacheKeySetInputSignature), store)
+        cache.set_prompt(DynamicPrompt(prompt), ["1", "2"], {})
+        return cache
+
+    start_prompt().set("2", [[torch.ones(4)]])
+    store.flush()
+    assert len(store.entries) == 1 and len(store.pending) == 0
+    assert torch.equal(start_prompt().get("2")[0][0], torch.ones(4))
+
+    # The loader's model file changed: so did the output of every node downstream of it.
+    os.utime(model, ns=(0, 1))
+    assert start_prompt().get("2") is None
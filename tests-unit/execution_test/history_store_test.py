@@ -0,0 +1,70 @@
+import pytest
+
+from comfy_execution.history import HistoryStore
+
+
+def make_entry(number, status="success"):
+    return {"prompt": [number, "prompt-{}".format(number), {}, {}, []], "outputs": {}, "status": {"status_str": status, "completed": True, "messages": []}}
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "history.db")
+
+
+def test_store_persists_and_pages(db_path):
+    store = HistoryStore(db_path, max_items=100)
+    for i in range(5):
+        store.add("prompt-{}".format(i), make_entry(i, "error" if i == 2 else "success"))
+
+    reopened = HistoryStore(db_path, max_items=100)
+    assert reopened.get("prompt-3") == make_entry(3)
+    assert reopened.get("missing") is None
+    assert list(reopened.page()) == ["prompt-{}".format(i) for i in range(5)]
+    assert list(reopened.page(offset=1, max_items=2)) == ["prompt-1", "prompt-2"]
+    assert list(reopened.page(status="error")) == ["prompt-2"]
+    assert reopened.count() == 5
+    assert reopened.count("success") == 4
+
+
+def test_store_drops_oldest_entries(db_path):
+    store = HistoryStore(db_path, max_items=3)
+    for i in range(5):
+        store.add("prompt-{}".format(i), make_entry(i))
+    assert list(store.page()) == ["prompt-2", "prompt-3", "prompt-4"]
+
+    store.delete("prompt-3")
+    assert store.get("prompt-3") is None
+    store.clear()
+    assert store.count() == 0
+
+
+def test_store_skips_unserializable_entries(db_path):
+    store = HistoryStore(db_path, max_items=3)
+    assert not store.add("bad", {"outputs": object()})
+    assert store.count() == 0
+
+
+def test_queue_serves_history_from_store(db_path):
+    from comfy.cli_args import args
+    args.cpu = True
+    import execution
+
+    class DummyServer:
+        def queue_updated(self):
+            pass
+
+    queue = execution.PromptQueue(DummyServer(), history_store=HistoryStore(db_path, max_items=1000))
+    count = execution.HISTORY_HOT_SIZE + 10
+    for i in range(count):
+        queue.put((i, "prompt-{}".format(i), {}, {}, []))
+        _, item_id = queue.get()
+        queue.task_done(item_id, {}, execution.PromptQueue.ExecutionStatus("success", True, []))
+
+    assert len(queue.history) <= execution.HISTORY_HOT_SIZE + 1
+    assert queue.get_history(prompt_id="prompt-0")["prompt-0"]["status"]["status_str"] == "success"
+    assert list(queue.get_history(max_items=2)) == ["prompt-{}".format(count - 2), "prompt-{}".format(count - 1)]
+    assert len(queue.get_history()) == count
+
+    queue.delete_history_item("prompt-0")
+    assert queue.get_history(prompt_id="prompt-0") == {}
@@ -0,0 +1,84 @@
+import pytest
+import torch
+
+
+@pytest.fixture(scope="module")
+def caching():
+    # See cache_signature_test.py for why these are imported here.
+    from comfy.cli_args import args
+    args.cpu = True
+    from comfy_execution.graph import DynamicPrompt
+    import comfy_execution.caching as caching
+    return caching, DynamicPrompt
+
+
+class Latent:
+    def __init__(self, samples):
+        self.samples = {"samples": samples}
+
+
+def start_prompt(caching, DynamicPrompt, caches, node_ids):
+    prompt = {node_id: {"class_type": "EmptyLatentImage", "inputs": {}} for node_id in node_ids}
+    for cache in caches:
+        cache.set_prompt(DynamicPrompt(prompt), node_ids, None)
+
+
+def test_entry_sizes_include_containers_and_objects(caching):
+    caching, _ = caching
+    t = torch.zeros(1000)
+    ram, vram = caching.get_cache_entry_size([[t, t[10:]], {"x": Latent(t)}])
+    assert vram == 0
+    assert 4000 < ram < 6000
+    assert caching.get_cache_entry_size([Latent(torch.zeros(1000))])[0] > 4000
+
+
+def test_budget_is_shared_and_enforced(caching):
+    caching, DynamicPrompt = caching
+    budget = caching.MemoryBudget(ram_budget=5000)
+    outputs = caching.MemoryBudgetCache(caching.CacheKeySetID, budget)
+    ui = caching.MemoryBudgetCache(caching.CacheKeySetID, budget)
+
+    start_prompt(caching, DynamicPrompt, [outputs, ui], ["1", "2", "3"])
+    outputs.set("1", [torch.zeros(1000)])
+    outputs.set("2", [torch.zeros(1000)])
+    ui.set("3", {"images": [torch.zeros(1000)]})
+    # Used by the running prompt: kept even when over budget.
+    assert budget.ram_used > 12000 and len(outputs.cache) == 2 and len(ui.cache) == 1
+    outputs.record_execution_time("1", 10.0)
+    outputs.record_execution_time("2", 0.1)
+    ui.record_execution_time("3", 1.0)
+
+    start_prompt(caching, DynamicPrompt, [outputs, ui], ["4"])
+    outputs.clean_unused()
+    # The cheapest entry to recompute goes first, then the ui one, until within the shared budget.
+    key = lambda node_id: (node_id, "EmptyLatentImage")
+    assert key("1") in outputs.cache and key("2") not in outputs.cache
+    assert key("3") not in ui.cache
+    assert budget.ram_used <= 5000
+    assert budget.ram_used == sum(sum(x) for c in (outputs, ui) for x in c.sizes.values())
+
+
+def test_outputs_and_ui_are_evicted_together(caching):
+    caching, DynamicPrompt = caching
+    budget = caching.MemoryBudget(ram_budget=6000)
+    outputs = caching.MemoryBudgetCache(caching.CacheKeySetID, budget)
+    ui = caching.MemoryBudgetCache(caching.CacheKeySetID, budget)
+
+    start_prompt(caching, DynamicPrompt, [outputs, ui], ["1", "2"])
+    # Only the outputs entry has an execution time, the ui one must not be evicted on its own.
+    outputs.set("1", [torch.zeros(1000)])
+    ui.set("1", {"images": [torch.zeros(100)]})
+    outputs.record_execution_time("1", 10.0)
+    outputs.set("2", [torch.zeros(1000)])
+    outputs.record_execution_time("2", 0.1)
+
+    start_prompt(caching, DynamicPrompt, [outputs, ui], ["3"])
+    outputs.clean_unused()
+    key = lambda node_id: (node_id, "EmptyLatentImage")
+    assert key("1") in outputs.cache and key("1") in ui.cache
+    assert key("2") not in outputs.cache
+
+    budget.ram_budget = 1000
+    outputs.clean_unused()
+    assert key("1") not in outputs.cache and key("1") not in ui.cache
+    assert budget.ram_used == 0
@@ -0,0 +1,97 @@
+import threading
+import pytest
+
+
+class DummyServer:
+    client_id = None
+    last_node_id = None
+
+    def send_sync(self, event, data, sid=None):
+        pass
+
+
+class SlowValue:
+    THREAD_SAFE = True
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+    threads = set()
+    # When set, every SlowValue waits for the others: they only get past it if they all run at once.
+    barrier = None
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"value": ("INT",)}}
+
+    def run(self, value):
+        SlowValue.threads.add(threading.get_ident())
+        if SlowValue.barrier is not None:
+            SlowValue.barrier.wait()
+        if value < 0:
+            raise ValueError("negative value")
+        return (value,)
+
+
+class Sum:
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+    OUTPUT_NODE = True
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"a": ("INT",), "b": ("INT",), "c": ("INT",), "d": ("INT",)}}
+
+    def run(self, a, b, c, d):
+        return {"ui": {"sum": [a + b + c + d]}, "result": (a + b + c + d,)}
+
+
+@pytest.fixture(scope="module")
+def executor_class():
+    # See cache_signature_test.py for why these are imported here.
+    from comfy.cli_args import args
+    args.cpu = True
+    import nodes
+    import execution
+    nodes.NODE_CLASS_MAPPINGS["TestSlowValue"] = SlowValue
+    nodes.NODE_CLASS_MAPPINGS["TestSum"] = Sum
+    yield execution.PromptExecutor
+    del nodes.NODE_CLASS_MAPPINGS["TestSlowValue"]
+    del nodes.NODE_CLASS_MAPPINGS["TestSum"]
+
+
+def make_prompt(values):
+    prompt = {str(i): {"class_type": "TestSlowValue", "inputs": {"value": v}} for i, v in enumerate(values)}
+    prompt["sum"] = {"class_type": "TestSum", "inputs": {k: [str(i), 0] for i, k in enumerate("abcd")}}
+    return prompt
+
+
+def test_independent_nodes_run_concurrently(executor_class, monkeypatch):
+    import execution
+    resolved = []
+    get_input_data = execution.get_input_data
+    def counting_get_input_data(inputs, class_def, unique_id, *args):
+        resolved.append(unique_id)
+        return get_input_data(inputs, class_def, unique_id, *args)
+    monkeypatch.setattr(execution, "get_input_data", counting_get_input_data)
+
+    SlowValue.threads.clear()
+    SlowValue.barrier = threading.Barrier(4, timeout=10)
+    try:
+        executor = executor_class(DummyServer(), parallel_nodes=4)
+        executor.execute(make_prompt([1, 2, 3, 4]), "prompt", {}, ["sum"])
+    finally:
+        SlowValue.barrier = None
+    assert executor.success
+    assert executor.history_result["outputs"]["sum"] == {"sum": [10]}
+    assert len(SlowValue.threads) == 4
+    # The inputs of the nodes run in the pool are resolved once.
+    assert sorted(resolved) == ["0", "1", "2", "3", "sum"]
+
+
+def test_errors_in_pool_are_reported(executor_class):
+    executor = executor_class(DummyServer(), parallel_nodes=4)
+    executor.execute(make_prompt([1, -2, 3, 4]), "prompt", {}, ["sum"])
+    assert not executor.success
+    event, data = executor.status_messages[-1]
+    assert event == "execution_error"
+    assert data["node_id"] == "1"
+    assert data["exception_message"] == "negative value"
@@ -0,0 +1,86 @@
+import torch
+import pytest
+
+
+@pytest.fixture
+def profiler():
+    # See cache_signature_test.py for why these are imported here.
+    from comfy.cli_args import args
+    args.cpu = True
+    from comfy_execution.profiler import ExecutionProfiler
+    profiler = ExecutionProfiler("prompt")
+    assert not profiler.track_vram
+    return profiler
+
+
+def test_node_executions_are_timed(profiler):
+    from comfy_execution.caching import get_cache_entry_size
+    outputs = [[torch.zeros(4, 8)]]
+    profiler.start_node("1")
+    profiler.end_node("1", "EmptyLatentImage", False, outputs)
+    profiler.start_node("2")
+    profiler.end_node("2", "VAEDecode", True, None)
+
+    profile = profiler.get_profile()
+    assert set(profile["nodes"]) == {"1", "2"}
+    node = profile["nodes"]["1"]
+    assert node["class_type"] == "EmptyLatentImage"
+    assert not node["cached"]
+    assert node["wall_time"] >= 0 and node["cpu_time"] >= 0
+    assert node["output_ram"] == get_cache_entry_size(outputs)[0] > 4 * 8 * 4
+    assert node["vram_peak_delta"] == 0
+    assert profile["nodes"]["2"]["cached"]
+    assert profile["nodes"]["2"]["output_ram"] == 0
+    assert profile["total_time"] >= node["wall_time"] + profile["nodes"]["2"]["wall_time"]
+
+
+def test_pending_node_executions_are_summed(profiler):
+    from comfy_execution.caching import get_cache_entry_size
+    outputs = [[torch.zeros(16)]]
+    # A node waiting on lazy inputs runs twice: times add up, sizes are the largest, cached only if both were.
+    profiler.start_node("1")
+    profiler.end_node("1", "KSampler", False, None)
+    first = dict(profiler.nodes["1"])
+    profiler.start_node("1")
+    profiler.end_node("1", "KSampler", True, outputs)
+
+    assert len(profiler.events) == 2
+    node = profiler.get_profile()["nodes"]["1"]
+    assert node["wall_time"] == pytest.approx(first["wall_time"] + profiler.events[1]["wall_time"])
+    assert node["cpu_time"] == pytest.approx(first["cpu_time"] + profiler.events[1]["cpu_time"])
+    assert node["output_ram"] == get_cache_entry_size(outputs)[0]
+    assert not node["cached"]
+
+
+def test_chrome_trace(profiler, tmp_path):
+    profiler.start_node("1")
+    profiler.end_node("1", "EmptyLatentImage", False, None)
+    trace = profiler.get_chrome_trace()
+    assert trace["otherData"] == {"prompt_id": "prompt"}
+    event, = trace["traceEvents"]
+    assert event["name"] == "EmptyLatentImage"
+    assert event["cat"] == "executed"
+    assert event["args"]["node_id"] == "1"
+
+    profiler.save_chrome_trace(str(tmp_path))
+    assert (tmp_path / "prompt.json").exists()
+
+
+def test_vram_peak_is_measured_per_node(profiler, monkeypatch):
+    stats = {"allocated": 100, "peak": 5000}
+    monkeypatch.setattr(torch.cuda, "memory_allocated", lambda device=None: stats["allocated"])
+    monkeypatch.setattr(torch.cuda, "max_memory_allocated", lambda device=None: stats["peak"])
+    monkeypatch.setattr(torch.cuda, "reset_peak_memory_stats", lambda device=None: stats.update(peak=stats["allocated"]))
+    profiler.track_vram = True
+
+    # Below the process peak so far, still measured.
+    profiler.start_node("1")
+    stats["peak"] = 700
+    profiler.end_node("1", "VAEDecode", False, None)
+    assert profiler.nodes["1"]["vram_peak_delta"] == 600
+
+    profiler.start_node("2")
+    stats["allocated"] = 300
+    stats["peak"] = 300
+    profiler.end_node("2", "VAEDecode", False, None)
+    assert profiler.nodes["2"]["vram_peak_delta"] == 200
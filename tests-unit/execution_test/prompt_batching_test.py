@@ -0,0 +1,243 @@
+import types
+import pytest
+import torch
+
+
+class DummyServer:
+    client_id = None
+
+    def queue_updated(self):
+        pass
+
+
+@pytest.fixture(scope="module")
+def execution():
+    # See cache_signature_test.py for why execution is imported here.
+    from comfy.cli_args import args
+    args.cpu = True
+    import execution
+    return execution
+
+
+def make_prompt(seed=0, text="a cat", steps=20, sampler_name="euler", prefix="ComfyUI"):
+    return {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "model.safetensors"}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"text": text, "clip": ["1", 1]}},
+        "3": {"class_type": "CLIPTextEncode", "inputs": {"text": "blurry", "clip": ["1", 1]}},
+        "4": {"class_type": "EmptyLatentImage", "inputs": {"width": 512, "height": 512, "batch_size": 1}},
+        "5": {"class_type": "KSampler", "inputs": {"model": ["1", 0], "seed": seed, "steps": steps, "cfg": 7.0,
+                                                   "sampler_name": sampler_name, "scheduler": "normal", "denoise": 1.0,
+                                                   "positive": ["2", 0], "negative": ["3", 0], "latent_image": ["4", 0]}},
+        "6": {"class_type": "VAEDecode", "inputs": {"samples": ["5", 0], "vae": ["1", 2]}},
+        "7": {"class_type": "SaveImage", "inputs": {"images": ["6", 0], "filename_prefix": prefix}},
+    }
+
+
+def test_batch_key_ignores_per_prompt_inputs(execution):
+    from comfy_execution.batching import get_batch_key
+    key = get_batch_key(make_prompt())
+    assert key is not None
+    assert get_batch_key(make_prompt(seed=5, text="a dog", prefix="other")) == key
+    assert get_batch_key(make_prompt(steps=30)) != key
+    assert get_batch_key(make_prompt(sampler_name="euler_ancestral")) is None
+
+
+def test_queue_takes_compatible_prompts(execution):
+    queue = execution.PromptQueue(DummyServer())
+    queue.put((0, "a", make_prompt(seed=0), {}, ["7"]))
+    queue.put((1, "b", make_prompt(steps=30), {}, ["7"]))
+    queue.put((2, "c", make_prompt(seed=2), {}, ["7"]))
+    queue.put((3, "d", make_prompt(seed=3), {}, ["7"]))
+
+    item, _ = queue.get()
+    batch = queue.get_batch(item, 1)
+    assert [x[0][1] for x in batch] == ["c"]
+    assert len(queue.get_current_queue()[0]) == 2
+    assert [x[1] for x in queue.get_current_queue()[1]] == ["b", "d"]
+
+
+def test_batched_prompts_are_no_longer_skipped(execution):
+    queue = execution.PromptQueue(DummyServer())
+    queue.put((0, "a", make_prompt(seed=0), {}, ["7"]))
+    queue.put((1, "b", make_prompt(seed=1), {}, ["7"]))
+    queue.times_skipped["b"] = 2
+    item, _ = queue.get()
+    assert len(queue.get_batch(item, 1)) == 1
+    assert queue.times_skipped == {}
+
+
+def test_sample_batch_splits_results(execution, monkeypatch):
+    import comfy.sample
+    from comfy_execution import batching
+
+    calls = []
+    def sample(model, noise, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, **kwargs):
+        calls.append((noise, positive, latent_image))
+        return latent_image + noise
+    monkeypatch.setattr(comfy.sample, "sample", sample)
+    monkeypatch.setattr(comfy.sample, "fix_empty_latent_channels", lambda model, latent: latent)
+
+    model = object()
+    jobs = []
+    for seed, batch_size in ((1, 1), (2, 2)):
+        cond = [[torch.full((1, 77, 8), float(seed)), {"pooled_output": torch.full((1, 8), float(seed))}]]
+        jobs.append({"model": model, "seed": seed, "steps": 20, "cfg": 7.0, "sampler_name": "euler",
+                     "scheduler": "normal", "denoise": 1.0, "positive": cond, "negative": cond,
+                     "latent_image": {"samples": torch.zeros(batch_size, 4, 8, 8)}})
+    assert batching.get_job_key(jobs[0]) == batching.get_job_key(jobs[1])
+
+    outputs = batching.sample_batch(jobs)
+    assert len(calls) == 1
+    noise, positive, latent_image = calls[0]
+    assert latent_image.shape[0] == 3
+    assert positive[0][0][:, 0, 0].tolist() == [1.0, 2.0, 2.0]
+    assert positive[0][1]["pooled_output"][:, 0].tolist() == [1.0, 2.0, 2.0]
+
+    for job, out in zip(jobs, outputs):
+        # Same noise as sampling the prompt on its own.
+        expected = comfy.sample.prepare_noise(job["latent_image"]["samples"], job["seed"])
+        assert torch.equal(out["samples"], expected)
+
+
+def test_job_key_rejects_unbatchable_inputs(execution):
+    from comfy_execution.batching import get_job_key
+    cond = [[torch.zeros(1, 77, 8), {}]]
+    job = {"model": None, "seed": 0, "steps": 20, "cfg": 7.0, "sampler_name": "euler", "scheduler": "normal",
+           "denoise": 1.0, "positive": cond, "negative": cond, "latent_image": {"samples": torch.zeros(1, 4, 8, 8)}}
+    assert get_job_key(job) is not None
+    assert get_job_key({**job, "latent_image": {"samples": torch.zeros(1, 4, 8, 8), "noise_mask": torch.ones(1, 8, 8)}}) is None
+    assert get_job_key({**job, "positive": [[torch.zeros(1, 77, 8), {"control": object()}]]}) is None
+
+
+class RecordingServer:
+    def __init__(self):
+        self.client_id = None
+        self.last_node_id = None
+        self.last_prompt_id = None
+
+    def send_sync(self, event, data, sid=None):
+        pass
+
+
+class TestModel:
+    RETURN_TYPES = ("MODEL",)
+    FUNCTION = "run"
+    model = types.SimpleNamespace(load_device=torch.device("cpu"), model=types.SimpleNamespace(latent_format=None))
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {}}
+
+    def run(self):
+        return (TestModel.model,)
+
+
+class TestCond:
+    RETURN_TYPES = ("CONDITIONING",)
+    FUNCTION = "run"
+    texts = []
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"text": ("STRING",)}}
+
+    def run(self, text):
+        TestCond.texts.append(text)
+        return ([[torch.full((1, 77, 8), float(len(text))), {}]],)
+
+
+class TestLatent:
+    RETURN_TYPES = ("LATENT",)
+    FUNCTION = "run"
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {}}
+
+    def run(self):
+        return ({"samples": torch.zeros(1, 4, 8, 8)},)
+
+
+def make_test_prompt(text, seed):
+    return {
+        "1": {"class_type": "TestModel", "inputs": {}},
+        "2": {"class_type": "TestCond", "inputs": {"text": text}},
+        "3": {"class_type": "TestCond", "inputs": {"text": "blurry"}},
+        "4": {"class_type": "TestLatent", "inputs": {}},
+        "5": {"class_type": "KSampler", "inputs": {"model": ["1", 0], "seed": seed, "steps": 2, "cfg": 7.0,
+                                                   "sampler_name": "euler", "scheduler": "normal", "denoise": 1.0,
+                                                   "positive": ["2", 0], "negative": ["3", 0], "latent_image": ["4", 0]}},
+    }
+
+
+def test_sample_batched_pins_inputs_and_reports_progress(execution, monkeypatch):
+    import nodes
+    import latent_preview
+    import comfy.metrics
+    import comfy.utils
+    for node_class in (TestModel, TestCond, TestLatent):
+        monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, node_class.__name__, node_class)
+    monkeypatch.setattr(latent_preview, "get_previewer", lambda device, latent_format: None)
+
+    def sample_batch(jobs, callback=None):
+        latents = torch.cat([job["latent_image"]["samples"] for job in jobs])
+        for step in range(2):
+            callback(step, latents, latents, 2)
+        return [{"samples": job["latent_image"]["samples"] + job["seed"]} for job in jobs]
+    monkeypatch.setattr(execution, "sample_batch", sample_batch)
+
+    server = RecordingServer()
+    progress = []
+    monkeypatch.setattr(comfy.utils, "PROGRESS_BAR_HOOK", lambda value, total, preview: progress.append((server.client_id, server.last_prompt_id, server.last_node_id, value)))
+    executions = comfy.metrics.node_executions_total.samples()
+    TestCond.texts.clear()
+
+    executor = execution.PromptExecutor(server)
+    items = [(0, "a", make_test_prompt("a cat", 1), {"client_id": "alice"}, ["5"]),
+             (1, "b", make_test_prompt("a dog", 2), {"client_id": "bob"}, ["5"])]
+    injected = executor.sample_batched(items)
+    # The pre-run isn't counted as node executions.
+    assert comfy.metrics.node_executions_total.samples() == executions
+    assert sorted(progress) == [("alice", "a", "5", 1), ("alice", "a", "5", 2), ("bob", "b", "5", 1), ("bob", "b", "5", 2)]
+    assert server.client_id is None
+
+    for item in items:
+        executor.execute(item[2], item[1], item[3], item[4], injected_outputs=injected.get(item[1]))
+        assert executor.success
+        assert executor.caches.outputs.get("5")[0][0]["samples"][0, 0, 0, 0].item() == item[2]["5"]["inputs"]["seed"]
+    # The conditioning of "a cat" was evicted by pre-running the next prompt, but not computed again.
+    assert sorted(TestCond.texts) == ["a cat", "a dog", "blurry"]
+
+
+class InterruptingCond(TestCond):
+    def run(self, text):
+        import comfy.model_management
+        if text == "a cat":
+            comfy.model_management.interrupt_current_processing(True, "a")
+            comfy.model_management.throw_exception_if_processing_interrupted()
+        return super().run(text)
+
+
+def test_prompt_interrupted_in_its_pre_run_stays_interrupted(execution, monkeypatch):
+    import nodes
+    import comfy.model_management
+    for node_class in (TestModel, TestLatent):
+        monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, node_class.__name__, node_class)
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "TestCond", InterruptingCond)
+    monkeypatch.setattr(execution, "sample_batch", lambda jobs, callback=None: pytest.fail("nothing left to batch"))
+
+    executor = execution.PromptExecutor(RecordingServer())
+    items = [(0, "a", make_test_prompt("a cat", 1), {}, ["5"]),
+             (1, "b", make_test_prompt("a dog", 2), {}, ["5"])]
+    try:
+        injected = executor.sample_batched(items)
+        assert injected["a"] == {}
+        assert "a" in comfy.model_management.interrupted_prompts
+
+        # The prompt itself is interrupted too, instead of running in full.
+        executor.execute(items[0][2], "a", {}, ["5"], injected_outputs=injected["a"])
+        assert not executor.success
+        assert [event for event, _ in executor.status_messages] == ["execution_start", "execution_cached", "execution_interrupted"]
+        assert "a" not in comfy.model_management.interrupted_prompts
+    finally:
+        comfy.model_management.interrupted_prompts.clear()
@@ -0,0 +1,105 @@
+import pytest
+
+
+class DummyServer:
+    client_id = None
+
+    def queue_updated(self):
+        pass
+
+
+@pytest.fixture
+def queue():
+    # See cache_signature_test.py for why execution is imported here.
+    from comfy.cli_args import args
+    args.cpu = True
+    import execution
+    return execution.PromptQueue(DummyServer())
+
+
+def make_item(number):
+    return (number, "prompt-{}".format(number), {"1": {"class_type": "EmptyLatentImage", "inputs": {"width": 64}}}, {}, ["1"])
+
+
+def test_queue_snapshot_is_reused_until_changed(queue):
+    for i in (2, 0, 1):
+        queue.put(make_item(i))
+    running, pending = queue.get_current_queue()
+    assert [x[0] for x in pending] == [0, 1, 2]
+    assert queue.get_current_queue()[1] is pending
+
+    queue.put(make_item(3))
+    assert len(queue.get_current_queue()[1]) == 4
+    assert [x[0] for x in queue.get_current_queue(max_items=2, offset=1)[1]] == [1, 2]
+
+
+def test_executor_copy_does_not_leak_into_history(queue):
+    from execution import PromptQueue
+    queue.put(make_item(0))
+    item, item_id = queue.get()
+    assert queue.get_current_queue()[0][0][1] == "prompt-0"
+
+    item[2]["1"]["inputs"]["width"] = 128
+    queue.task_done(item_id, {"outputs": {}}, PromptQueue.ExecutionStatus("success", True, []))
+    history = queue.get_history(prompt_id="prompt-0")["prompt-0"]
+    assert history["prompt"][2]["1"]["inputs"]["width"] == 64
+    assert queue.get_current_queue()[0] == ()
+
+
+def test_history_pagination(queue):
+    from execution import PromptQueue
+    for i in range(5):
+        queue.put(make_item(i))
+        _, item_id = queue.get()
+        queue.task_done(item_id, {}, PromptQueue.ExecutionStatus("success", True, []))
+    assert list(queue.get_history()) == ["prompt-{}".format(i) for i in range(5)]
+    assert list(queue.get_history(max_items=2)) == ["prompt-3", "prompt-4"]
+    assert list(queue.get_history(max_items=2, offset=1)) == ["prompt-1", "prompt-2"]
+    assert list(queue.get_history(offset=4)) == ["prompt-4"]
+
+
+def make_sized_item(number, width):
+    return (number, "prompt-{}".format(number), {"1": {"class_type": "EmptyLatentImage", "inputs": {"width": width}}}, {}, ["1"])
+
+
+def test_scheduling_reorders_within_window_and_bounds_skips():
+    from comfy.cli_args import args
+    args.cpu = True
+    import execution
+    queue = execution.PromptQueue(DummyServer(), schedule_window=2)
+    queue.put(make_sized_item(0, 64))
+    assert queue.get()[0][1] == "prompt-0"
+
+    # prompt-3 shares the latent with prompt-0 but is outside the window of 2.
+    for number, width in ((1, 128), (2, 128), (3, 64)):
+        queue.put(make_sized_item(number, width))
+    assert [queue.get()[0][1] for _ in range(3)] == ["prompt-1", "prompt-2", "prompt-3"]
+
+    # prompt-4 (128) is passed over at most twice, however many prompts sharing the latent follow it.
+    for number, width in ((4, 128), (5, 64), (6, 64), (7, 64)):
+        queue.put(make_sized_item(number, width))
+    assert [queue.get()[0][1] for _ in range(4)] == ["prompt-5", "prompt-6", "prompt-4", "prompt-7"]
+
+
+def test_skip_counts_are_cleared_with_the_queue():
+    from comfy.cli_args import args
+    args.cpu = True
+    import execution
+    queue = execution.PromptQueue(DummyServer(), schedule_window=2)
+    queue.put(make_sized_item(0, 64))
+    queue.get()
+    queue.put(make_sized_item(1, 128))
+    queue.put(make_sized_item(2, 64))
+    queue.put(make_sized_item(3, 128))
+    assert queue.get()[0][1] == "prompt-2"
+    assert queue.times_skipped == {"prompt-1": 1}
+
+    queue.delete_queue_item(lambda x: x[1] == "prompt-1")
+    assert queue.times_skipped == {}
+
+    queue.put(make_sized_item(4, 64))
+    assert queue.get()[0][1] == "prompt-4"
+    assert queue.times_skipped == {"prompt-3": 1}
+    queue.put(make_sized_item(5, 128))
+    queue.wipe_queue()
+    assert queue.times_skipped == {}
@@ -0,0 +1,87 @@
+import threading
+import pytest
+import torch
+
+
+@pytest.fixture
+def model_management():
+    # See cache_signature_test.py for why these are imported here.
+    from comfy.cli_args import args
+    args.cpu = True
+    import comfy.model_management
+    yield comfy.model_management
+    comfy.model_management.interrupted_prompts.clear()
+
+
+def run_in_thread(func):
+    result = {}
+    def target():
+        try:
+            result["value"] = func()
+        except Exception as e:
+            result["error"] = e
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+def test_device_is_bound_per_thread(model_management):
+    default_device = model_management.get_torch_device()
+    def worker():
+        model_management.set_thread_torch_device("meta")
+        return model_management.get_torch_device()
+
+    assert run_in_thread(worker) == torch.device("meta")
+    assert model_management.get_torch_device() == default_device
+
+
+def test_interrupt_only_stops_its_prompt(model_management):
+    model_management.interrupt_current_processing(True, "a")
+
+    def worker(prompt_id):
+        model_management.set_current_prompt(prompt_id)
+        interrupted = model_management.processing_interrupted()
+        try:
+            model_management.throw_exception_if_processing_interrupted()
+        except model_management.InterruptProcessingException:
+            return interrupted, True
+        return interrupted, False
+
+    assert run_in_thread(lambda: worker("b")) == (False, False)
+    assert run_in_thread(lambda: worker("a")) == (True, True)
+    # The interrupt is consumed when it stops the prompt.
+    assert run_in_thread(lambda: worker("a")) == (False, False)
+
+
+def test_global_interrupt_stops_every_prompt(model_management):
+    model_management.interrupt_current_processing(True)
+    try:
+        model_management.set_current_prompt("a")
+        assert model_management.processing_interrupted()
+        assert run_in_thread(lambda: model_management.processing_interrupted())
+    finally:
+        model_management.interrupt_current_processing(False)
+        model_management.set_current_prompt(None)
+
+
+def test_execution_state_is_tracked_per_worker():
+    import server
+    s = server.PromptServer.__new__(server.PromptServer)
+    s.execution_state = {"client_id": None, "last_node_id": None, "last_prompt_id": None}
+    s.worker_states = []
+    s.client_id = "main"
+
+    def worker(client_id, node_id):
+        s.use_worker_state()
+        s.client_id = client_id
+        s.last_node_id = node_id
+        return s.client_id, s.last_node_id
+
+    assert run_in_thread(lambda: worker("a", "1")) == ("a", "1")
+    assert run_in_thread(lambda: worker("b", "2")) == ("b", "2")
+    assert s.client_id == "main"
+    assert s.last_node_id is None
+    assert [x["client_id"] for x in s.worker_states] == ["a", "b"]
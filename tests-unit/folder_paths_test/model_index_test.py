@@ -0,0 +1,55 @@
+import os
+import pytest
+
+import folder_paths
+from app.model_index import ModelIndex
+
+
+def touch(path, mtime=None):
+    open(path, "w").close()
+    if mtime is not None:
+        os.utime(os.path.dirname(path), (mtime, mtime))
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    root = tmp_path / "checkpoints"
+    os.makedirs(root / "sdxl")
+    os.makedirs(root / ".git")
+    touch(str(root / "a.safetensors"))
+    touch(str(root / "sdxl" / "b.safetensors"))
+    touch(str(root / ".git" / "c.safetensors"))
+    return str(root)
+
+
+def test_index_is_updated_incrementally(model_dir):
+    index = ModelIndex()
+    files, file_set = index.get_files(model_dir)
+    assert files == ["a.safetensors", os.path.join("sdxl", "b.safetensors")]
+    assert index.contains(model_dir, os.path.join("sdxl", "b.safetensors"))
+    assert not index.refresh(model_dir)
+
+    touch(os.path.join(model_dir, "sdxl", "new.safetensors"), mtime=1000)
+    os.makedirs(os.path.join(model_dir, "flux", "dev"))
+    touch(os.path.join(model_dir, "flux", "dev", "d.safetensors"))
+    os.utime(model_dir, (1000, 1000))
+    os.remove(os.path.join(model_dir, "a.safetensors"))
+    os.utime(model_dir, (2000, 2000))
+    assert index.refresh(model_dir)
+    assert index.get_files(model_dir)[0] == [os.path.join("flux", "dev", "d.safetensors"), os.path.join("sdxl", "b.safetensors"), os.path.join("sdxl", "new.safetensors")]
+
+
+def test_index_persists(model_dir, tmp_path):
+    path = str(tmp_path / "index.json")
+    ModelIndex(path).get_files(model_dir)
+    index = ModelIndex(path)
+    assert model_dir in index.roots
+    assert len(index.get_files(model_dir)[0]) == 2
+
+
+def test_folder_paths_use_index(model_dir, monkeypatch):
+    monkeypatch.setitem(folder_paths.folder_names_and_paths, "indexed", ([model_dir], {".safetensors"}))
+    monkeypatch.setattr(folder_paths, "model_index", ModelIndex())
+    assert folder_paths.get_filename_list("indexed") == ["a.safetensors", os.path.join("sdxl", "b.safetensors")]
+    assert folder_paths.get_full_path("indexed", "sdxl/b.safetensors") == os.path.join(model_dir, "sdxl", "b.safetensors")
+    assert folder_paths.get_full_path("indexed", "missing.safetensors") is None
@@ -0,0 +1,46 @@
+import os
+import gzip
+import json
+import threading
+import pytest
+
+
+class ObjectInfoServer:
+    def __init__(self):
+        self.object_info = None
+        self.object_info_lock = threading.Lock()
+        self.builds = 0
+
+    def build_object_info(self):
+        self.builds += 1
+        return {"Node": {"name": "Node"}}
+
+
+@pytest.fixture
+def server_module():
+    # See cache_signature_test.py for why these are imported here.
+    from comfy.cli_args import args
+    args.cpu = True
+    import server
+    return server
+
+
+def test_object_info_rebuilt_only_when_folders_change(server_module, tmp_path, monkeypatch):
+    import folder_paths
+    monkeypatch.setattr(folder_paths, "input_directory", str(tmp_path))
+    s = ObjectInfoServer()
+    get = lambda: server_module.PromptServer.get_object_info_cached(s)
+
+    version, etag, body, gzip_body = get()
+    assert json.loads(body) == {"Node": {"name": "Node"}}
+    assert gzip.decompress(gzip_body) == body
+    assert get()[1] == etag
+    assert s.builds == 1
+
+    (tmp_path / "image.png").write_bytes(b"")
+    st = tmp_path.stat()
+    os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+    assert get()[0] != version
+    assert s.builds == 2
+    # The ETag is of the content, clients with the same content keep getting 304s.
+    assert get()[1] == etag
@@ -0,0 +1,53 @@
+import threading
+import pytest
+from PIL import Image
+
+
+@pytest.fixture
+def server_module():
+    # See cache_signature_test.py for why these are imported here.
+    from comfy.cli_args import args
+    args.cpu = True
+    import server
+    return server
+
+
+class FakeServer:
+    def __init__(self):
+        self.sent = []
+        self.event = threading.Event()
+
+    def send_sync(self, event, data, sid=None):
+        self.sent.append((event, data, sid))
+        self.event.set()
+
+
+def test_previews_for_slow_clients_are_dropped(server_module):
+    fake = FakeServer()
+    encoder = server_module.PreviewEncoder(fake)
+    image = Image.new("RGB", (64, 32))
+    encoder.put(("JPEG", image, 16), "a")
+    assert fake.event.wait(5)
+    fake.event.clear()
+
+    # Not sent to the client yet: the next previews wait and only the latest one is kept.
+    encoder.put(("PNG", image, 16), "a")
+    encoder.put(("JPEG", image, 16), "a")
+    assert not fake.event.wait(0.1)
+    encoder.sent("a")
+    assert fake.event.wait(5)
+    assert len(fake.sent) == 2
+    for event, data, sid in fake.sent:
+        assert event == server_module.BinaryEventTypes.PREVIEW_IMAGE and sid == "a"
+        assert data[:4] == b"\x00\x00\x00\x01"
+
+
+def test_previewers_are_cached(server_module, monkeypatch):
+    from comfy.cli_args import args, LatentPreviewMethod
+    import comfy.latent_formats
+    import latent_preview
+    monkeypatch.setattr(args, "preview_method", LatentPreviewMethod.Latent2RGB)
+    monkeypatch.setattr(latent_preview, "previewers", {})
+    previewer = latent_preview.get_previewer("cpu", comfy.latent_formats.SD15())
+    assert previewer is latent_preview.get_previewer("cpu", comfy.latent_formats.SD15())
+    assert previewer is not latent_preview.get_previewer("cpu", comfy.latent_formats.SDXL())
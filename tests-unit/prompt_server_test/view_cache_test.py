@@ -0,0 +1,47 @@
+import os
+from PIL import Image
+from unittest.mock import patch
+
+from app.view_cache import ViewCache, get_transform, get_key, apply_transform
+
+
+def make_image(path, color=(255, 0, 0, 128)):
+    Image.new("RGBA", (32, 32), color).save(path)
+    return path
+
+
+def test_transforms_match_view_parameters():
+    assert get_transform({}) is None
+    assert get_transform({"channel": "rgba"}) is None
+    assert get_transform({"preview": "jpeg;50"}) == ("preview", "jpeg", 50, True)
+    assert get_transform({"preview": "png", "channel": "a"}) == ("preview", "webp", 90, False)
+    assert get_transform({"channel": "a"}) == ("a",)
+
+
+def test_cached_until_file_changes(tmp_path):
+    file = make_image(str(tmp_path / "image.png"))
+    cache = ViewCache(str(tmp_path / "cache"), 1024 * 1024)
+    transform = get_transform({"channel": "a"})
+    key = get_key(file, os.stat(file), transform)
+    data = cache.get_image(file, key, transform)
+    assert Image.open(cache.directory + "/" + key).getchannel("A").getextrema() == (128, 128)
+    with patch("app.view_cache.apply_transform", side_effect=AssertionError("not cached")):
+        assert cache.get_image(file, key, transform) == data
+
+    make_image(file, (0, 0, 0, 255))
+    os.utime(file, ns=(0, 1))
+    assert get_key(file, os.stat(file), transform) != key
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    file = make_image(str(tmp_path / "image.png"))
+    size = len(apply_transform(file, ("rgb",)))
+    cache = ViewCache(str(tmp_path / "cache"), size * 3)
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.put(key, apply_transform(file, ("rgb",)))
+        os.utime(os.path.join(cache.directory, key), ns=(i, i))
+    assert cache.get("a") is not None
+    cache.put("d", apply_transform(file, ("rgb",)))
+    # Evicted down to 90% of the limit, the recently read entry stays.
+    assert sorted(os.listdir(cache.directory)) == ["a", "d"]
+    assert cache.size == size * 2
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import pytest
+
+pytestmark = (
+    pytest.mark.asyncio
+)  # This applies the asyncio mark to all test functions in the module
+
+
+@pytest.fixture
+def server_module():
+    # See cache_signature_test.py for why these are imported here.
+    from comfy.cli_args import args
+    args.cpu = True
+    import server
+    return server
+
+
+class SlowWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.unblock = asyncio.Event()
+        self.closed = False
+
+    async def send_str(self, data):
+        await self.unblock.wait()
+        self.sent.append(data)
+
+    async def send_bytes(self, data):
+        await self.unblock.wait()
+        self.sent.append(data)
+
+    async def close(self):
+        self.closed = True
+
+
+class Server:
+    def __init__(self, server_module, clients):
+        self.clients = clients
+        self.send_message = lambda *args: server_module.PromptServer.send_message(self, *args)
+        self.encode_bytes = lambda *args: server_module.PromptServer.encode_bytes(self, *args)
+
+
+async def test_slow_client_gets_latest_progress(server_module):
+    slow_ws, fast_ws = SlowWebSocket(), SlowWebSocket()
+    fast_ws.unblock.set()
+    s = Server(server_module, {"slow": server_module.WebSocketClient(slow_ws), "fast": server_module.WebSocketClient(fast_ws)})
+    send_json = lambda *args: server_module.PromptServer.send_json(s, *args)
+
+    await send_json("executing", {"node": "1"})
+    for i in range(5):
+        await asyncio.sleep(0)
+        await send_json("progress", {"value": i, "max": 5})
+    await server_module.PromptServer.send_bytes(s, server_module.BinaryEventTypes.PREVIEW_IMAGE, b"jpeg")
+    await send_json("executed", {"node": "1"}, "slow")
+    await asyncio.sleep(0.01)
+    assert len(fast_ws.sent) == 7
+
+    slow_ws.unblock.set()
+    await asyncio.sleep(0.01)
+    messages = [json.loads(m)["type"] if isinstance(m, str) else m for m in slow_ws.sent]
+    assert messages == ["executing", "progress", b"\x00\x00\x00\x01jpeg", "executed"]
+    assert json.loads(slow_ws.sent[1])["data"]["value"] == 4
+    # Same encoded message for every client.
+    assert slow_ws.sent[0] is fast_ws.sent[0]
+    for client in s.clients.values():
+        client.close()
+
+
+async def test_stuck_client_is_disconnected(server_module, monkeypatch):
+    monkeypatch.setattr(server_module.WebSocketClient, "MAX_QUEUE", 3)
+    ws = SlowWebSocket()
+    client = server_module.WebSocketClient(ws)
+    for i in range(5):
+        client.put("message {}".format(i))
+    await asyncio.sleep(0.01)
+    assert ws.closed and client.closed
+    assert len(client.queue) == 0
+
+
+async def test_replaceable_messages_are_reported_done(server_module):
+    ws = SlowWebSocket()
+    done = []
+    client = server_module.WebSocketClient(ws, done.append)
+    client.put(b"first", "preview")
+    await asyncio.sleep(0)
+    # The first preview is being sent, the second one is replaced by the third.
+    client.put(b"second", "preview")
+    client.put(b"third", "preview")
+    client.put("status")
+    assert done == ["preview"]
+
+    ws.unblock.set()
+    await asyncio.sleep(0.01)
+    assert ws.sent == [b"first", b"third", "status"]
+    assert done == ["preview"] * 3
+
+    ws.unblock.clear()
+    client.put(b"fourth", "preview")
+    await asyncio.sleep(0)
+    client.put(b"fifth", "preview")
+    client.close()
+    await asyncio.sleep(0.01)
+    # Dropped when the client closes, whether queued or being sent.
+    assert done == ["preview"] * 5
+
+
+async def test_preview_to_closed_client_is_reported_done(server_module):
+    done = []
+    client = server_module.WebSocketClient(SlowWebSocket(), done.append)
+    client.close()
+    client.put(b"preview", "preview")
+    assert done == ["preview"]
+    assert len(client.queue) == 0
+
+
+async def test_preview_disconnecting_stuck_client_is_reported_done(server_module, monkeypatch):
+    monkeypatch.setattr(server_module.WebSocketClient, "MAX_QUEUE", 3)
+    ws = SlowWebSocket()
+    done = []
+    client = server_module.WebSocketClient(ws, done.append)
+    for i in range(3):
+        client.put("message {}".format(i))
+    client.put(b"preview", "preview")
+    assert client.closed
+    assert done == ["preview"]
+    await asyncio.sleep(0.01)
+    assert ws.closed